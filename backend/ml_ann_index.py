@@ -0,0 +1,109 @@
+"""
+Cluster-backed Approximate Nearest Neighbour Index for MuzikaX
+This module implements an IVF-style (inverted file) index over the SVD track embeddings.
+Tracks are grouped into inverted lists by their K-Means cluster, and a query only scores
+the tracks in the n_probe clusters whose centroids are closest to it, so memory stays
+linear in catalog size instead of materializing a dense N x N similarity matrix.
+"""
+
+import numpy as np
+from typing import Iterable, Optional, Tuple
+
+from ml_catalog import top_n_rows
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize rows as float32, leaving all-zero rows at zero
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class ClusterANNIndex:
+    ARRAY_ATTRIBUTES = ('embeddings', 'centroids', 'list_rows', 'list_offsets')
+
+    def __init__(self, n_probe: int = 8):
+        """
+        Initialize an empty index
+        n_probe is the default number of clusters scanned per query (higher = more accurate, slower)
+        """
+        self.n_probe = n_probe
+        self.embeddings = None
+        self.centroids = None
+        self.list_rows = None
+        self.list_offsets = None
+
+    @property
+    def n_clusters(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+
+    def build(self, embeddings: np.ndarray, centroids: np.ndarray, labels: np.ndarray):
+        """
+        Build the inverted lists from the track embeddings and their K-Means assignment
+        Row i of embeddings/labels corresponds to catalog row i
+        """
+        self.embeddings = _normalize_rows(embeddings)
+        self.centroids = _normalize_rows(centroids)
+
+        # Inverted lists stored CSR-style: the rows of cluster c are
+        # list_rows[list_offsets[c]:list_offsets[c + 1]]
+        labels = np.asarray(labels, dtype=np.int64)
+        self.list_rows = np.argsort(labels, kind='stable').astype(np.int64)
+        counts = np.bincount(labels, minlength=len(self.centroids))
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return self
+
+    def _probe_clusters(self, query: np.ndarray, n_probe: int) -> np.ndarray:
+        """
+        Return the clusters whose centroids are most similar to the query, best first
+        """
+        return top_n_rows(self.centroids @ query, n_probe)
+
+    def _candidate_rows(self, clusters: np.ndarray) -> np.ndarray:
+        """
+        Concatenate the inverted lists of the given clusters
+        """
+        return np.concatenate([
+            self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in clusters
+        ]) if len(clusters) else np.empty(0, dtype=np.int64)
+
+    def search(self, query: np.ndarray, k: int, exclude_rows: Optional[Iterable[int]] = None,
+               n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k catalog rows with the highest cosine similarity to the query vector
+        Probes more clusters when the first n_probe do not hold k candidates
+        Returns (rows, similarities), best first
+        """
+        if self.embeddings is None or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = np.asarray(query, dtype=np.float32)
+        exclude = np.unique(np.fromiter(exclude_rows, dtype=np.int64)) if exclude_rows is not None \
+            else np.empty(0, dtype=np.int64)
+        n_probe = min(self.n_clusters, n_probe or self.n_probe)
+
+        ranked_clusters = self._probe_clusters(query, self.n_clusters)
+        candidates = self._candidate_rows(ranked_clusters[:n_probe])
+        while len(np.setdiff1d(candidates, exclude)) < k and n_probe < self.n_clusters:
+            n_probe = min(self.n_clusters, n_probe * 2)
+            candidates = self._candidate_rows(ranked_clusters[:n_probe])
+
+        candidates = np.setdiff1d(candidates, exclude)
+        similarities = self.embeddings[candidates] @ query
+        best = top_n_rows(similarities, k)
+        return candidates[best], similarities[best]
+
+    def search_by_rows(self, rows: Iterable[int], k: int,
+                       n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k rows most similar on average to the given catalog rows, excluding them
+        The mean of unit vectors gives the average cosine similarity to every seed
+        """
+        rows = np.asarray(list(rows), dtype=np.int64)
+        if len(rows) == 0 or self.embeddings is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = self.embeddings[rows].mean(axis=0)
+        return self.search(query, k, exclude_rows=rows, n_probe=n_probe)
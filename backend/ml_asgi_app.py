@@ -0,0 +1,326 @@
+"""
+Asynchronous (ASGI) Serving for the MuzikaX Enhanced ML API
+This module serves the enhanced recommendation API from an asyncio event loop. The hot
+read endpoints are native coroutines: CPU-bound scoring is offloaded to a small thread
+pool, the independent sub-recommenders of a personalized request are fanned out
+concurrently, and MongoDB work (cold-start loading, track hydration) runs on a separate
+I/O pool so a slow query never holds a scoring thread. Every other route is bridged to
+the existing Flask app, so one process can keep many proxy connections open while only
+a handful of threads do the actual work.
+"""
+
+import asyncio
+import contextvars
+import functools
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+from ml_metrics import REGISTRY, REQUEST_DURATION, time_stage
+
+logger = logging.getLogger(__name__)
+
+# Profiler capture of the native request being served (see ml_profiling); tasks fanned out
+# by a handler inherit it, and the work they hand to the thread pools is profiled under it
+_request_capture: contextvars.ContextVar = contextvars.ContextVar('request_capture', default=None)
+
+
+def _first_query_values(query_string: bytes) -> Dict[str, str]:
+    """
+    Parse a query string keeping the first value of each parameter (like Flask's request.args.get)
+    """
+    args: Dict[str, str] = {}
+    for key, value in parse_qsl(query_string.decode('latin-1'), keep_blank_values=True):
+        args.setdefault(key, value)
+    return args
+
+
+async def _read_body(receive: Callable) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+class MLRecommendationASGIApp:
+    def __init__(self, api: Any, scoring_threads: Optional[int] = None, io_threads: int = 32):
+        """
+        Initialize the app around the enhanced API module (ml_recommendation_api_enhanced)
+        The module object is passed in rather than imported so the app shares the globals of
+        the running API (engine, database client, hydrator) even when it runs as __main__
+        scoring_threads defaults to one per core; io_threads bounds concurrent MongoDB calls
+        """
+        self.api = api
+        self.flask_app = api.app
+        self.scoring_executor = ThreadPoolExecutor(
+            max_workers=scoring_threads or os.cpu_count() or 1, thread_name_prefix='ml-scoring'
+        )
+        self.io_executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='ml-io')
+        self.routes = {
+            ('GET', '/api/ml-recommendations/personalized'): self.personalized,
+            ('GET', '/api/ml-recommendations/location-based'): self.location_based,
+            ('GET', '/api/ml-recommendations/collaborative'): self.collaborative,
+            ('GET', '/api/ml-recommendations/content-based'): self.content_based
+        }
+
+    async def __call__(self, scope: Dict, receive: Callable, send: Callable):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            handler = self.routes.get((scope['method'], scope['path']))
+            if handler is not None:
+                # The same timing and profiling the Flask before/after request hooks give bridged routes
+                started = time.perf_counter()
+                profiler = self.api.profiler
+                capture = profiler.begin_request(profile_thread=False) if profiler.active else None
+                token = _request_capture.set(capture)
+                try:
+                    status, payload = await self._run_handler(handler, scope['path'],
+                                                              _first_query_values(scope['query_string']))
+                    with time_stage(scope['path'], 'serialization'):
+                        body = self.flask_app.json.dumps(payload).encode('utf-8')
+                    await self._send(send, status, [('Content-Type', 'application/json')], body)
+                finally:
+                    _request_capture.reset(token)
+                    if capture is not None:
+                        profiler.end_request(capture)
+                    REGISTRY.observe(REQUEST_DURATION, time.perf_counter() - started, endpoint=scope['path'])
+            else:
+                # Flask's own request hooks time bridged routes
+                await self._bridge_to_flask(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive: Callable, send: Callable):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def shutdown(self):
+        self.scoring_executor.shutdown(wait=False)
+        self.io_executor.shutdown(wait=False)
+
+    @staticmethod
+    async def _send(send: Callable, status: int, headers: List[Tuple[str, str]], body: bytes):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _run_handler(self, handler: Callable, endpoint: str, args: Dict[str, str]) -> Tuple[int, Dict]:
+        try:
+            return await handler(endpoint, args)
+        except Exception as e:
+            logger.error(f"Error in {handler.__name__}: {e}")
+            return 500, {'error': str(e)}
+
+    def _profiled(self, fn: Callable) -> Callable:
+        """
+        fn, profiled on the pool thread that runs it when the current request is being captured
+        """
+        capture = _request_capture.get()
+        if capture is None:
+            return fn
+        return functools.partial(self.api.profiler.profile_call, capture, fn)
+
+    def _score(self, fn: Callable, *args) -> 'asyncio.Future':
+        return asyncio.get_running_loop().run_in_executor(self.scoring_executor, self._profiled(fn), *args)
+
+    def _io(self, fn: Callable, *args) -> 'asyncio.Future':
+        return asyncio.get_running_loop().run_in_executor(self.io_executor, self._profiled(fn), *args)
+
+    async def _engine(self, endpoint: str, track_limit: int, user_id: Optional[str] = None):
+        """
+        Return the serving engine; a cold start loads from MongoDB on the I/O pool
+        """
+        with time_stage(endpoint, 'engine_init'):
+            if self.api.engine_initialized:
+                return self.api.engine
+            return await self._io(self.api.ensure_engine_initialized, track_limit, user_id)
+
+    async def _tracks(self, endpoint: str, recommendations: List[str], max_limit: int) -> List[Dict]:
+        with time_stage(endpoint, 'hydration'):
+            track_details = await self._io(self.api.track_hydrator.hydrate, recommendations)
+        return track_details[:max_limit]
+
+    async def personalized(self, endpoint: str, args: Dict[str, str]) -> Tuple[int, Dict]:
+        user_id = args.get('userId')
+        current_track_id = args.get('currentTrackId')
+        limit = int(args.get('limit', 10))
+        user_location = args.get('location')
+
+        # Keep one engine reference for the whole request (see the Flask handler)
+        current_engine = await self._engine(endpoint, 1000, user_id)
+        max_limit = min(limit, 20)
+
+        with time_stage(endpoint, 'scoring'):
+            cache_key = current_engine.personalized_cache_key(user_id, current_track_id, user_location, max_limit)
+            if cache_key in current_engine.recommendation_cache:
+                recommendations = current_engine.get_personalized_recommendations(
+                    user_id=user_id, seed_track_id=current_track_id,
+                    user_location=user_location, n_recommendations=max_limit
+                )
+            else:
+                # The sub-recommenders are independent, so score them concurrently and blend
+                generation = current_engine.recommendation_cache.generation()
+                collab_recs, content_recs, location_recs, popular_recs = await asyncio.gather(
+                    self._score(current_engine.get_collaborative_filtering_recommendations, user_id, max_limit),
+                    self._score(current_engine.get_content_based_recommendations, [current_track_id], max_limit)
+                    if current_track_id else asyncio.sleep(0, []),
+                    self._score(current_engine.get_location_based_recommendations, user_location, max_limit)
+                    if user_location else asyncio.sleep(0, []),
+                    self._score(current_engine.get_popular_tracks, max_limit)
+                )
+                recommendations = current_engine.blend_personalized_recommendations(
+                    user_id, current_track_id, user_location, max_limit,
+                    collab_recs, content_recs, location_recs, popular_recs, generation=generation
+                )
+
+        tracks = await self._tracks(endpoint, recommendations, max_limit)
+        return 200, {'tracks': tracks, 'count': len(tracks), 'algorithm': 'enhanced_ml_personalized'}
+
+    async def location_based(self, endpoint: str, args: Dict[str, str]) -> Tuple[int, Dict]:
+        location = args.get('location')
+        limit = int(args.get('limit', 10))
+        if not location:
+            return 400, {'error': 'Location parameter is required'}
+
+        current_engine = await self._engine(endpoint, 500)
+        max_limit = min(limit, 20)
+        with time_stage(endpoint, 'scoring'):
+            recommendations = await self._score(current_engine.get_location_based_recommendations, location, max_limit)
+
+        tracks = await self._tracks(endpoint, recommendations, max_limit)
+        return 200, {
+            'tracks': tracks,
+            'count': len(tracks),
+            'algorithm': 'enhanced_location_based',
+            'location': location
+        }
+
+    async def collaborative(self, endpoint: str, args: Dict[str, str]) -> Tuple[int, Dict]:
+        user_id = args.get('userId')
+        limit = int(args.get('limit', 10))
+        if not user_id:
+            return 400, {'error': 'User ID parameter is required'}
+
+        current_engine = await self._engine(endpoint, 500, user_id)
+        max_limit = min(limit, 20)
+        with time_stage(endpoint, 'scoring'):
+            recommendations = await self._score(current_engine.get_collaborative_filtering_recommendations,
+                                                user_id, max_limit)
+
+        tracks = await self._tracks(endpoint, recommendations, max_limit)
+        return 200, {
+            'tracks': tracks,
+            'count': len(tracks),
+            'algorithm': 'enhanced_collaborative_filtering',
+            'userId': user_id
+        }
+
+    async def content_based(self, endpoint: str, args: Dict[str, str]) -> Tuple[int, Dict]:
+        seed_track_ids_param = args.get('seedTrackIds')
+        limit = int(args.get('limit', 10))
+        if not seed_track_ids_param:
+            return 400, {'error': 'seedTrackIds parameter is required'}
+        seed_track_ids = [tid.strip() for tid in seed_track_ids_param.split(',')]
+
+        current_engine = await self._engine(endpoint, 500)
+        max_limit = min(limit, 20)
+        with time_stage(endpoint, 'scoring'):
+            recommendations = await self._score(current_engine.get_content_based_recommendations,
+                                                seed_track_ids, max_limit)
+
+        tracks = await self._tracks(endpoint, recommendations, max_limit)
+        return 200, {
+            'tracks': tracks,
+            'count': len(tracks),
+            'algorithm': 'enhanced_content_based',
+            'seedTrackIds': seed_track_ids
+        }
+
+    async def _bridge_to_flask(self, scope: Dict, receive: Callable, send: Callable):
+        """
+        Serve a request with the Flask app on the scoring pool (training, events, batch, stats)
+        """
+        body = await _read_body(receive)
+        server = scope.get('server') or ('localhost', 5001)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'content-length':
+                key = 'HTTP_' + name.upper().replace('-', '_')
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+        def call_flask():
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response['status'] = int(status.split(' ', 1)[0])
+                response['headers'] = headers
+
+            result = self.flask_app(environ, start_response)
+            try:
+                response_body = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            return response['status'], response['headers'], response_body
+
+        status, headers, response_body = await self._score(call_flask)
+        await self._send(send, status, headers, response_body)
+
+
+def create_asgi_app(api: Any, scoring_threads: Optional[int] = None, io_threads: int = 32) -> MLRecommendationASGIApp:
+    return MLRecommendationASGIApp(api, scoring_threads=scoring_threads, io_threads=io_threads)
+
+
+def serve_asgi(app: MLRecommendationASGIApp, host: str, port: int) -> bool:
+    """
+    Serve app with uvicorn; returns False (without serving) when uvicorn is not installed
+    """
+    try:
+        import uvicorn
+    except ImportError:
+        return False
+    # A single process: concurrency comes from the event loop and the two thread pools
+    uvicorn.run(app, host=host, port=port, lifespan='on', log_level='warning')
+    return True
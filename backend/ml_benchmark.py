@@ -0,0 +1,377 @@
+"""
+Synthetic-catalog Benchmark for the MuzikaX Recommendation Engines
+This module generates seeded, reproducible catalogs (Zipf-distributed plays, skewed
+genre/creator/location mixes) with matching interaction logs, then times data loading,
+training, every recommendation method and model save/load for both
+MLRecommendationEngine and AdvancedMLRecommendationEngine. Each (engine, catalog size)
+case runs in a fresh process so its peak RSS is its own. Results are written as
+key-sorted JSON, so runs from two commits can be diffed or compared with --compare.
+
+Usage:
+    python ml_benchmark.py --sizes 10000 100000 --output bench.json
+    python ml_benchmark.py --sizes 10000 --engines advanced --compare bench.json
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+ENGINES = ('base', 'advanced')
+
+GENRES = ['afrobeat', 'gospel', 'hip hop', 'r&b', 'pop', 'amapiano', 'dancehall', 'reggae',
+          'traditional', 'jazz', 'electronic', 'rock']
+LOCATIONS = ['Kigali, Rwanda', 'Musanze, Rwanda', 'Huye, Rwanda', 'Rubavu, Rwanda', 'Kampala, Uganda',
+             'Nairobi, Kenya', 'Dar es Salaam, Tanzania', 'Bujumbura, Burundi', 'Lagos, Nigeria',
+             'Johannesburg, South Africa', 'global']
+LOCATION_WEIGHTS = [0.30, 0.06, 0.05, 0.05, 0.08, 0.08, 0.06, 0.04, 0.08, 0.05, 0.15]
+TRACK_TYPES = ['song', 'beat', 'mix']
+TRACK_TYPE_WEIGHTS = [0.8, 0.15, 0.05]
+INTERACTION_TYPES = ['play', 'like', 'skip', 'comment']
+INTERACTION_TYPE_WEIGHTS = [0.78, 0.10, 0.09, 0.03]
+
+# Fixed reference time so generated timestamps do not depend on when the benchmark runs
+REFERENCE_TIME = datetime(2026, 1, 1)
+
+
+def _object_id(prefix: int, index: int) -> str:
+    # 24 hex digits, so generated ids are valid ObjectIds like the real ones
+    return f'{prefix:08x}{index:016x}'
+
+
+def _zipf_weights(n: int, exponent: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Zipf weights over n items in a random rank order
+    """
+    ranks = rng.permutation(n) + 1
+    weights = 1.0 / ranks.astype(np.float64) ** exponent
+    return weights / weights.sum()
+
+
+def generate_catalog(n_tracks: int, seed: int = 42, zipf_exponent: float = 1.1,
+                     total_plays: Optional[int] = None) -> List[Dict]:
+    """
+    Generate n_tracks track documents shaped like src/models/Track.js
+    Plays follow a Zipf law over tracks; genres, creators and locations are skewed too
+    """
+    rng = np.random.default_rng(seed)
+    popularity = _zipf_weights(n_tracks, zipf_exponent, rng)
+    total_plays = total_plays or n_tracks * 500
+    plays = rng.poisson(popularity * total_plays)
+    likes = rng.binomial(plays, 0.06)
+    shares = rng.binomial(plays, 0.01)
+
+    n_creators = max(10, n_tracks // 25)
+    creators = rng.choice(n_creators, size=n_tracks, p=_zipf_weights(n_creators, 0.8, rng))
+    genres = rng.choice(len(GENRES), size=n_tracks, p=_zipf_weights(len(GENRES), 0.7, rng))
+    locations = rng.choice(len(LOCATIONS), size=n_tracks, p=LOCATION_WEIGHTS)
+    types = rng.choice(len(TRACK_TYPES), size=n_tracks, p=TRACK_TYPE_WEIGHTS)
+    age_days = rng.uniform(0, 3 * 365, size=n_tracks)
+
+    return [
+        {
+            '_id': _object_id(1, i),
+            'title': f'Track {i}',
+            'creatorId': _object_id(2, int(creators[i])),
+            'creatorType': 'artist',
+            'genre': GENRES[genres[i]],
+            'type': TRACK_TYPES[types[i]],
+            'location': LOCATIONS[locations[i]],
+            'plays': int(plays[i]),
+            'likes': int(likes[i]),
+            'shares': int(shares[i]),
+            'createdAt': REFERENCE_TIME - timedelta(days=float(age_days[i]))
+        }
+        for i in range(n_tracks)
+    ]
+
+
+def generate_interactions(tracks: List[Dict], n_users: Optional[int] = None, events_per_user: float = 30.0,
+                          seed: int = 43) -> List[Dict]:
+    """
+    Generate an interaction log over tracks
+    Users' activity is log-normal; the track of each event is drawn in proportion to plays
+    """
+    rng = np.random.default_rng(seed)
+    n_users = n_users or max(200, len(tracks) // 20)
+    activity = rng.lognormal(mean=0.0, sigma=1.0, size=n_users)
+    counts = np.maximum(1, np.round(activity / activity.mean() * events_per_user)).astype(np.int64)
+    n_events = int(counts.sum())
+
+    plays = np.array([track['plays'] for track in tracks], dtype=np.float64) + 1.0
+    track_rows = rng.choice(len(tracks), size=n_events, p=plays / plays.sum())
+    user_rows = np.repeat(np.arange(n_users), counts)
+    types = rng.choice(len(INTERACTION_TYPES), size=n_events, p=INTERACTION_TYPE_WEIGHTS)
+    ages = rng.uniform(0, 365 * 24 * 3600, size=n_events)
+
+    return [
+        {
+            'userId': _object_id(3, int(user_rows[i])),
+            'trackId': tracks[track_rows[i]]['_id'],
+            'type': INTERACTION_TYPES[types[i]],
+            'timestamp': REFERENCE_TIME - timedelta(seconds=float(ages[i]))
+        }
+        for i in range(n_events)
+    ]
+
+
+def _current_rss_bytes() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _directory_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _time_phase(phases: Dict[str, Dict], name: str, fn: Callable[[], Any]) -> Any:
+    gc.collect()
+    started = time.perf_counter()
+    result = fn()
+    phases[name] = {'seconds': time.perf_counter() - started, 'rss_after_bytes': _current_rss_bytes()}
+    return result
+
+
+def _time_queries(fn: Callable, arg_lists: Sequence[Tuple], before_each: Optional[Callable[[], None]] = None) -> Dict:
+    """
+    Call fn once per argument tuple and summarize the latencies in milliseconds
+    """
+    latencies = []
+    for args in arg_lists:
+        if before_each is not None:
+            before_each()
+        started = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    latencies = np.array(latencies)
+    return {
+        'calls': len(latencies),
+        'first_ms': float(latencies[0]),
+        'mean_ms': float(latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99))
+    }
+
+
+def run_case(engine_name: str, n_tracks: int, seed: int = 42, n_queries: int = 50,
+             batch_users: int = 256) -> Dict[str, Any]:
+    """
+    Benchmark one engine on one synthetic catalog (meant to run in its own process)
+    """
+    phases: Dict[str, Dict] = {}
+    tracks = _time_phase(phases, 'generate_catalog', lambda: generate_catalog(n_tracks, seed=seed))
+    interactions = _time_phase(phases, 'generate_interactions',
+                               lambda: generate_interactions(tracks, seed=seed + 1))
+    user_ids = list(dict.fromkeys(interaction['userId'] for interaction in interactions))
+    n_interactions = len(interactions)
+
+    # The same queries for both engines: users, seed tracks and locations drawn with the seed
+    rng = np.random.default_rng(seed + 2)
+    query_users = [user_ids[i] for i in rng.integers(0, len(user_ids), size=n_queries)]
+    query_seeds = [tracks[i]['_id'] for i in rng.integers(0, n_tracks, size=n_queries)]
+    query_locations = [LOCATIONS[i] for i in rng.integers(0, len(LOCATIONS), size=n_queries)]
+
+    # Imported here so each case process only loads the engine it measures
+    if engine_name == 'advanced':
+        from ml_recommendation_enhanced import AdvancedMLRecommendationEngine
+        engine = AdvancedMLRecommendationEngine(max_tracks_for_training=n_tracks)
+        _time_phase(phases, 'load_data_incrementally',
+                    lambda: engine.load_data_incrementally(tracks, interactions, batch_size=10000))
+        _time_phase(phases, 'train_models', engine.train_models)
+        # Measure computation, not the result cache
+        clear_cache = engine.recommendation_cache.clear
+    else:
+        from ml_recommendation import MLRecommendationEngine
+        engine = MLRecommendationEngine()
+        # The base engine featurizes and builds profiles in load_data; it has no separate training step
+        _time_phase(phases, 'load_data', lambda: engine.load_data(tracks, interactions))
+        clear_cache = None
+    del tracks, interactions
+
+    queries = {
+        'get_collaborative_filtering_recommendations': _time_queries(
+            engine.get_collaborative_filtering_recommendations, [(user, 10) for user in query_users], clear_cache),
+        'get_content_based_recommendations': _time_queries(
+            engine.get_content_based_recommendations, [([seed_id], 10) for seed_id in query_seeds], clear_cache),
+        'get_popular_tracks': _time_queries(engine.get_popular_tracks, [(10,)] * n_queries, clear_cache),
+        'get_location_based_recommendations': _time_queries(
+            engine.get_location_based_recommendations, [(location, 10) for location in query_locations],
+            clear_cache),
+        'get_personalized_recommendations': _time_queries(
+            engine.get_personalized_recommendations,
+            list(zip(query_users, query_seeds, query_locations, [10] * n_queries)), clear_cache)
+    }
+    if engine_name == 'advanced':
+        batches = [(user_ids[i:i + batch_users],) for i in range(0, min(len(user_ids), batch_users * 8), batch_users)]
+        queries['get_batch_recommendations'] = dict(
+            _time_queries(engine.get_batch_recommendations, batches, clear_cache), users_per_call=batch_users
+        )
+
+    work_dir = tempfile.mkdtemp(prefix='ml-benchmark-')
+    try:
+        if engine_name == 'advanced':
+            model_path = os.path.join(work_dir, 'model')
+            _time_phase(phases, 'save_model', lambda: engine.save_model(model_path))
+            _time_phase(phases, 'load_model', lambda: AdvancedMLRecommendationEngine().load_model(model_path))
+            _time_phase(phases, 'load_model_no_mmap',
+                        lambda: AdvancedMLRecommendationEngine().load_model(model_path, mmap=False))
+        else:
+            model_path = os.path.join(work_dir, 'model.pkl')
+            _time_phase(phases, 'save_model', lambda: engine.save_model(model_path))
+            _time_phase(phases, 'load_model', lambda: MLRecommendationEngine().load_model(model_path))
+        model_size = _directory_size(model_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'engine': engine_name,
+        'n_tracks': n_tracks,
+        'n_users': len(user_ids),
+        'n_interactions': n_interactions,
+        'phases': phases,
+        'queries': queries,
+        'model_size_bytes': model_size,
+        'peak_rss_bytes': _peak_rss_bytes()
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes: Sequence[int] = DEFAULT_SIZES, engines: Sequence[str] = ENGINES, seed: int = 42,
+                   n_queries: int = 50, isolate: bool = True) -> Dict[str, Any]:
+    """
+    Run every (engine, size) case, each in a fresh spawned process unless isolate is False
+    """
+    import sklearn
+    import scipy
+
+    results = []
+    for n_tracks in sizes:
+        for engine_name in engines:
+            logger.info(f"Benchmarking {engine_name} engine on {n_tracks} tracks...")
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    result = executor.submit(run_case, engine_name, n_tracks, seed, n_queries).result()
+            else:
+                result = run_case(engine_name, n_tracks, seed, n_queries)
+            results.append(result)
+
+    return {
+        'meta': {
+            'git_commit': _git_commit(),
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'sklearn': sklearn.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'seed': seed,
+            'n_queries': n_queries,
+            'isolated': isolate
+        },
+        'results': results
+    }
+
+
+def _comparable_metrics(result: Dict[str, Any]) -> Dict[str, float]:
+    metrics = {f'{name}.seconds': phase['seconds'] for name, phase in result['phases'].items()}
+    for name, query in result['queries'].items():
+        metrics[f'{name}.p50_ms'] = query['p50_ms']
+        metrics[f'{name}.p95_ms'] = query['p95_ms']
+    if result.get('peak_rss_bytes'):
+        metrics['peak_rss_mb'] = result['peak_rss_bytes'] / 2 ** 20
+    metrics['model_size_mb'] = result['model_size_bytes'] / 2 ** 20
+    return metrics
+
+
+def compare_benchmarks(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """
+    One line per metric present in both runs: baseline, current and the relative change
+    """
+    baseline_cases = {(result['engine'], result['n_tracks']): result for result in baseline['results']}
+    lines = []
+    for result in current['results']:
+        key = (result['engine'], result['n_tracks'])
+        if key not in baseline_cases:
+            continue
+        old_metrics = _comparable_metrics(baseline_cases[key])
+        for name, value in _comparable_metrics(result).items():
+            old = old_metrics.get(name)
+            if old is None:
+                continue
+            change = (value - old) / old * 100 if old else 0.0
+            lines.append(f'{key[0]:>8} {key[1]:>8} {name:<60} {old:>12.3f} {value:>12.3f} {change:>+8.1f}%')
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Benchmark the MuzikaX recommendation engines on synthetic catalogs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='catalog sizes in tracks')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--queries', type=int, default=50, help='calls per recommendation method')
+    parser.add_argument('--output', help='write the JSON results here (default: stdout)')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--no-isolate', action='store_true', help='run every case in this process')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    logger.setLevel(logging.INFO)
+
+    report = run_benchmarks(args.sizes, args.engines, seed=args.seed, n_queries=args.queries,
+                            isolate=not args.no_isolate)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f"Results written to {args.output}")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('\n'.join(compare_benchmarks(baseline, report)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Recommendation Result Cache for MuzikaX
+This module implements a thread-safe LRU cache with per-entry time-to-live, a cap on
+the number of entries and (optionally) on their estimated size in bytes, and a tag
+index so related entries (everything computed for one user, from one seed track, or
+by one model version) can be invalidated together without scanning the cache. Every
+invalidation advances a generation counter, so a result computed before an invalidation
+of one of its tags is not cached after it.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+
+def user_tag(user_id: str) -> str:
+    return f'user:{user_id}'
+
+
+def seed_tag(track_id: str) -> str:
+    return f'seed:{track_id}'
+
+
+def model_tag(model_version: Any) -> str:
+    return f'model:{model_version}'
+
+
+def key_prefix(key: Any) -> str:
+    """
+    Key family of 'family_rest' style keys ('collab_u1_10' -> 'collab')
+    """
+    return str(key).split('_', 1)[0]
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Rough size in bytes of a cached value (lists/tuples of ids and their elements)
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'size', 'tags')
+
+    def __init__(self, value: Any, expires_at: Optional[float], size: int, tags: tuple):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.tags = tags
+
+
+class RecommendationCache:
+    def __init__(self, max_entries: int = 1000, max_bytes: Optional[int] = None,
+                 default_ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic,
+                 key_family: Optional[Callable[[Any], str]] = None, max_tracked_tags: int = 65536):
+        """
+        Initialize the cache
+        default_ttl is in seconds (None keeps entries until evicted); max_bytes bounds the
+        estimated size of all cached values (None for no byte cap); key_family maps a key to
+        the family its hits and misses are counted under (e.g. key_prefix);
+        max_tracked_tags bounds how many recently invalidated tags remember their generation
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self.key_family = key_family
+
+        self._entries: 'OrderedDict[Any, _Entry]' = OrderedDict()  # Least recently used first
+        self._tag_index: Dict[str, Set[Any]] = defaultdict(set)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Generation of the last invalidation, and of the last one of each recently invalidated
+        # tag (oldest first); writes computed before _generation_floor are always dropped
+        self.max_tracked_tags = max_tracked_tags
+        self._generation = 0
+        self._invalidated_at: 'OrderedDict[str, int]' = OrderedDict()
+        self._generation_floor = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_writes = 0
+        self._family_counts: Dict[str, list] = defaultdict(lambda: [0, 0])  # family -> [hits, misses]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Any) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._is_expired(entry)
+
+    def _is_expired(self, entry: _Entry) -> bool:
+        return entry.expires_at is not None and entry.expires_at <= self.clock()
+
+    def _remove(self, key: Any) -> _Entry:
+        # Callers hold the lock
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        for tag in entry.tags:
+            keys = self._tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tag_index[tag]
+        return entry
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """
+        Return the cached value and mark it most recently used, or default on a miss
+        """
+        family = self.key_family(key) if self.key_family is not None else None
+        with self._lock:
+            family_counts = self._family_counts[family] if family is not None else None
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry):
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                if family_counts is not None:
+                    family_counts[1] += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if family_counts is not None:
+                family_counts[0] += 1
+            return entry.value
+
+    def generation(self) -> int:
+        """
+        Current generation; take it before computing a value and pass it to set
+        """
+        with self._lock:
+            return self._generation
+
+    def _advance_generation(self, tags: Iterable[str]):
+        # Callers hold the lock
+        self._generation += 1
+        for tag in tags:
+            self._invalidated_at[tag] = self._generation
+            self._invalidated_at.move_to_end(tag)
+        while len(self._invalidated_at) > self.max_tracked_tags:
+            _, generation = self._invalidated_at.popitem(last=False)
+            self._generation_floor = generation
+
+    def _is_stale(self, generation: int, tags: tuple) -> bool:
+        # Callers hold the lock
+        return generation < self._generation_floor or \
+            any(self._invalidated_at.get(tag, 0) > generation for tag in tags)
+
+    def set(self, key: Any, value: Any, ttl: Optional[float] = None, tags: Iterable[str] = (),
+            generation: Optional[int] = None):
+        """
+        Cache a value under key with the given tags, evicting least recently used entries
+        to stay within the entry and byte caps
+        With the generation taken before the value was computed, the write is dropped if any
+        of the tags has been invalidated since
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = self.clock() + ttl if ttl is not None else None
+        entry = _Entry(value, expires_at, estimate_size(value), tuple(tags))
+
+        with self._lock:
+            if generation is not None and self._is_stale(generation, entry.tags):
+                self.stale_writes += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            if self.max_bytes is not None and entry.size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._bytes += entry.size
+            for tag in entry.tags:
+                self._tag_index[tag].add(key)
+
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key: Any) -> bool:
+        """
+        Drop one entry; returns whether it was cached
+        """
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            self.invalidations += 1
+            return True
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        """
+        Drop every entry carrying any of the tags; returns the number of entries dropped
+        """
+        removed = 0
+        tags = list(tags)
+        with self._lock:
+            self._advance_generation(tags)
+            for tag in tags:
+                for key in list(self._tag_index.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+            self.invalidations += removed
+        return removed
+
+    def invalidate_tag(self, tag: str) -> int:
+        return self.invalidate_tags((tag,))
+
+    def purge_expired(self) -> int:
+        """
+        Drop every expired entry (expired entries are otherwise dropped lazily on access)
+        """
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if self._is_expired(entry)]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._generation_floor = self._generation
+            self._invalidated_at.clear()
+            self._entries.clear()
+            self._tag_index.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Hit/miss/eviction counters plus the current size of the cache
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'stale_writes': self.stale_writes,
+                'families': {
+                    family: {
+                        'hits': hits,
+                        'misses': misses,
+                        'hit_ratio': hits / (hits + misses) if hits + misses else 0.0
+                    }
+                    for family, (hits, misses) in self._family_counts.items()
+                }
+            }
@@ -0,0 +1,141 @@
+"""
+Genre and Creator Posting Lists for MuzikaX Candidate Retrieval
+This module is the first stage of two-stage collaborative recommendations. When a model
+is trained (or loaded), catalog rows are grouped by genre code and by creator code into
+posting lists ranked by the static popularity/freshness prior, and they are re-ranked
+whenever that prior is refreshed. A request then retrieves
+a few thousand candidates from the heads of the lists of the user's top-weighted genres
+and creators (plus the head of the global prior ranking, so strong tracks outside the
+profile still compete), and only those candidates are fully scored.
+"""
+
+from typing import Optional, Tuple
+import numpy as np
+import logging
+
+from ml_catalog import Preferences, preference_arrays
+
+logger = logging.getLogger(__name__)
+
+# Catalogs up to this many times the candidate budget are scored in full (retrieval
+# would touch a large share of them anyway)
+FULL_SCAN_FACTOR = 4
+
+
+def _posting_lists(codes: np.ndarray, n_codes: int, ranked_rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group ranked_rows by code, keeping the ranking within each group
+    Returns (rows, offsets): the rows of code c are rows[offsets[c]:offsets[c + 1]]
+    """
+    rows = ranked_rows[np.argsort(codes[ranked_rows], kind='stable')]
+    offsets = np.zeros(n_codes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=n_codes), out=offsets[1:])
+    return rows, offsets
+
+
+def _allocate(weights: np.ndarray, budget: int) -> np.ndarray:
+    """
+    Split a candidate budget across lists in proportion to their weights
+    """
+    if len(weights) == 0 or budget <= 0:
+        return np.zeros(len(weights), dtype=np.int64)
+    return np.ceil(budget * weights / weights.sum()).astype(np.int64)
+
+
+class CandidateIndex:
+    def __init__(self, catalog, max_candidates: int = 2000, max_genres: int = 5, max_creators: int = 20):
+        """
+        Build the posting lists over a TrackCatalog, ranked by its static prior (desc), then row
+        max_candidates is the retrieval budget per request, split across the user's
+        max_genres top genres, max_creators top creators and the global ranking.
+        The lists follow the prior vector they were ranked by (self.prior): once the catalog's
+        prior is refreshed the index is stale (see is_current) and must be rebuilt
+        """
+        self.catalog = catalog
+        self.max_candidates = max_candidates
+        self.max_genres = max_genres
+        self.max_creators = max_creators
+        # Below this size retrieval saves little over scoring every track
+        self.enabled = catalog.n_tracks > max_candidates * FULL_SCAN_FACTOR
+
+        self.prior = catalog.static_prior()
+        ranked = np.lexsort((np.arange(catalog.n_tracks), -self.prior)).astype(np.int32)
+        self.prior_rows = ranked
+        self.genre_rows, self.genre_offsets = _posting_lists(catalog.genre_codes, len(catalog.genre_values), ranked)
+        self.creator_rows, self.creator_offsets = _posting_lists(catalog.creator_codes,
+                                                                 len(catalog.creator_values), ranked)
+        # (creator, genre) posting lists, found by binary search over their sorted keys: the
+        # tracks matching both a preferred creator and genre score highest, and ranking them
+        # by prior within the pair keeps retrieval exact for the profile's top genres/creators
+        self.n_genres = max(len(catalog.genre_values), 1)
+        pair_keys = catalog.creator_codes.astype(np.int64) * self.n_genres + catalog.genre_codes
+        self.pair_rows = ranked[np.argsort(pair_keys[ranked], kind='stable')]
+        self.pair_keys = pair_keys[self.pair_rows]
+
+    def is_current(self, catalog) -> bool:
+        """
+        Whether the index was built over this catalog and its current prior vector
+        """
+        return self.catalog is catalog and self.prior is catalog.static_prior()
+
+    def nbytes(self) -> int:
+        return int(sum(array.nbytes for array in (self.prior_rows, self.genre_rows, self.genre_offsets,
+                                                  self.creator_rows, self.creator_offsets,
+                                                  self.pair_rows, self.pair_keys)))
+
+    @staticmethod
+    def _top_weighted(preferences: Tuple[np.ndarray, np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The k highest positive preferences (codes, weights), strongest first
+        """
+        codes, weights = preferences
+        keep = weights > 0
+        codes, weights = codes[keep], np.asarray(weights[keep], dtype=np.float64)
+        order = np.lexsort((codes, -weights))[:k]
+        return codes[order], weights[order]
+
+    @staticmethod
+    def _heads(rows: np.ndarray, offsets: np.ndarray, codes: np.ndarray, sizes: np.ndarray) -> list:
+        starts = offsets[codes]
+        ends = np.minimum(offsets[codes + 1], starts + sizes)
+        return [rows[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+
+    def candidates(self, genre_preferences: Preferences, creator_preferences: Preferences,
+                   min_per_list: int = 0, genre_weight: float = 0.4, creator_weight: float = 0.3,
+                   miss_bonus: float = 0.0) -> Optional[np.ndarray]:
+        """
+        Sorted, distinct catalog rows to score for a user: the best-prior tracks of each of
+        the user's top genres and creators (budget split by preference weight, at least
+        min_per_list each), of each of their (creator, genre) pairs and of the whole catalog
+        With min_per_list >= n plus the excluded rows, the top n by score_collaborative (with
+        the same weights and miss_bonus) are always among them unless the profile has more
+        than max_genres genres or max_creators creators. That relies on every preferred value
+        scoring at least the miss_bonus an unmatched one gets: otherwise a track outside
+        the lists can outscore them, and None is returned so the caller scores every track
+        """
+        genre_arrays = preference_arrays(self.catalog.genre_vocabulary, genre_preferences)
+        creator_arrays = preference_arrays(self.catalog.creator_vocabulary, creator_preferences)
+        for (_, weights), term_weight in ((genre_arrays, genre_weight), (creator_arrays, creator_weight)):
+            if len(weights) and np.min(weights) * term_weight < miss_bonus:
+                return None
+        genres, genre_weights = self._top_weighted(genre_arrays, self.max_genres)
+        creators, creator_weights = self._top_weighted(creator_arrays, self.max_creators)
+
+        # Half the budget for genres, a quarter for creators, the rest (and any unused share)
+        # for the global ranking
+        genre_budget = self.max_candidates // 2 if len(genres) else 0
+        creator_budget = self.max_candidates // 4 if len(creators) else 0
+        prior_budget = self.max_candidates - genre_budget - creator_budget
+
+        heads = [self.prior_rows[:max(prior_budget, min_per_list)]]
+        heads += self._heads(self.genre_rows, self.genre_offsets, genres,
+                             np.maximum(_allocate(genre_weights, genre_budget), min_per_list))
+        heads += self._heads(self.creator_rows, self.creator_offsets, creators,
+                             np.maximum(_allocate(creator_weights, creator_budget), min_per_list))
+        if min_per_list > 0 and len(genres) and len(creators):
+            keys = (creators[:, None] * self.n_genres + genres[None, :]).ravel()
+            starts = np.searchsorted(self.pair_keys, keys, side='left')
+            ends = np.minimum(np.searchsorted(self.pair_keys, keys, side='right'), starts + min_per_list)
+            heads += [self.pair_rows[start:end] for start, end in zip(starts.tolist(), ends.tolist()) if end > start]
+        # Ascending rows, so score ties break in catalog order as in a full scan
+        return np.unique(np.concatenate(heads)).astype(np.int64)
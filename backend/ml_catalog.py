@@ -0,0 +1,439 @@
+"""
+Columnar Track Catalog for MuzikaX Recommendations
+This module keeps the per-track values used for scoring (genre and creator codes,
+play counts and creation times) as NumPy arrays that are built once when data is
+loaded, together with a track id -> row hash index, so recommendation requests can
+look tracks up in O(1) and score the whole catalog with array operations.
+"""
+
+import threading
+import time
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+import logging
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400.0
+DAYS_PER_YEAR = 365.0
+
+# Weights of the user-independent prior (popularity, freshness) in the collaborative score
+POPULARITY_WEIGHT = 0.2
+FRESHNESS_WEIGHT = 0.1
+
+# A user's preferences: {value: preference} or (codes, preferences) arrays in catalog codes
+Preferences = Union[Dict, Tuple[np.ndarray, np.ndarray]]
+
+
+# Columns of the engine's track metadata frame once compacted: repeated strings become
+# categoricals, counts the narrowest integer dtype and createdAt nullable int64 epoch
+# seconds; track ids stay strings (shared with the catalog's id index), anything else is dropped
+CATEGORICAL_COLUMNS = ('title', 'genre', 'creatorId', 'location', 'type')
+COUNT_COLUMNS = ('plays', 'likes')
+TRACK_COLUMNS = ('_id',) + CATEGORICAL_COLUMNS + COUNT_COLUMNS + ('createdAt',)
+
+
+def _encode_column(track_df: pd.DataFrame, column: str, default: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encode a categorical column as int32 codes plus the code -> value array
+    """
+    if column not in track_df.columns:
+        values = pd.Series(default, index=track_df.index)
+    elif isinstance(track_df[column].dtype, pd.CategoricalDtype):
+        # Factorize the category codes, then map the few distinct categories to strings
+        categories = track_df[column].cat.categories
+        codes, unique_codes = pd.factorize(track_df[column].cat.codes.to_numpy(), sort=False)
+        unique_values = [str(categories[code]) if code >= 0 else default for code in unique_codes]
+        value_codes, uniques = pd.factorize(np.asarray(unique_values, dtype=object), sort=False)
+        return value_codes[codes].astype(np.int32), np.asarray(uniques, dtype=object)
+    else:
+        values = track_df[column].fillna(default).astype(str)
+    codes, uniques = pd.factorize(values, sort=False)
+    return codes.astype(np.int32), np.asarray(uniques, dtype=object)
+
+
+def _to_epoch_seconds(values: pd.Series) -> np.ndarray:
+    """
+    Convert datetimes, ISO strings or integer epoch seconds to float64 epoch seconds
+    (NaN when unknown)
+    """
+    if pd.api.types.is_integer_dtype(values):
+        return values.to_numpy(dtype=np.float64, na_value=np.nan)
+    parsed = pd.to_datetime(values, utc=True, errors='coerce', format='mixed')
+    epochs = (parsed - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)
+    return epochs.to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _epoch_seconds_column(values: pd.Series) -> pd.Series:
+    """
+    Datetimes or ISO strings as nullable int64 epoch seconds (floored)
+    """
+    if pd.api.types.is_integer_dtype(values):
+        return values.astype('Int64')
+    parsed = pd.to_datetime(values, utc=True, errors='coerce', format='mixed')
+    seconds = (parsed - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+    return seconds.astype('Int64')
+
+
+def _narrow_counts(values: pd.Series) -> pd.Series:
+    """
+    Counts in the narrowest integer dtype that holds them (missing counts are 0)
+    """
+    values = pd.to_numeric(values, errors='coerce').fillna(0)
+    if len(values) and (values % 1 != 0).any():
+        return values.astype(np.float32)
+    return pd.to_numeric(values.astype(np.int64), downcast='unsigned' if not len(values) or values.min() >= 0
+                         else 'integer')
+
+
+def compact_track_frame(track_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Narrow a batch of track documents to the compact columns of TRACK_COLUMNS
+    Run after featurization, which still needs the raw values
+    """
+    columns = {}
+    for column in TRACK_COLUMNS:
+        if column not in track_df.columns:
+            continue
+        values = track_df[column]
+        if column in CATEGORICAL_COLUMNS:
+            if values.dtype == object:
+                # Mixed ids and numbers would give the batches incompatible categories
+                values = values.map(lambda v: v if pd.isna(v) else str(v))
+            columns[column] = values.astype('category')
+        elif column in COUNT_COLUMNS:
+            columns[column] = _narrow_counts(values)
+        elif column == 'createdAt':
+            columns[column] = _epoch_seconds_column(values)
+        else:
+            columns[column] = values
+    return pd.DataFrame(columns, index=track_df.index)
+
+
+def concat_track_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate compacted batches, merging each categorical column's categories into one
+    shared dictionary (pd.concat would fall back to object columns)
+    """
+    lengths = [len(frame) for frame in frames]
+    columns = {}
+    for column in TRACK_COLUMNS:
+        if not any(column in frame.columns for frame in frames):
+            continue
+        if column in CATEGORICAL_COLUMNS:
+            pieces = [frame[column] if column in frame.columns else pd.Categorical([None] * length)
+                      for frame, length in zip(frames, lengths)]
+            columns[column] = pd.api.types.union_categoricals(pieces)
+        else:
+            series = pd.concat([
+                frame[column] if column in frame.columns else pd.Series([None] * length, dtype=object)
+                for frame, length in zip(frames, lengths)
+            ], ignore_index=True)
+            columns[column] = _narrow_counts(series) if column in COUNT_COLUMNS else \
+                _epoch_seconds_column(series) if column == 'createdAt' else series
+    return pd.DataFrame(columns)
+
+
+def frame_footprint(frame: pd.DataFrame) -> Dict[str, int]:
+    """
+    Deep memory usage of each column of a DataFrame in bytes
+    """
+    usage = frame.memory_usage(deep=True, index=True)
+    return {str(column): int(nbytes) for column, nbytes in usage.items()}
+
+
+def preference_arrays(vocabulary: Dict[str, int], preferences: Preferences) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    A user's preferences as (codes, preferences) arrays in the vocabulary's codes
+    ({value: preference} counters are mapped, unknown values dropped)
+    """
+    if isinstance(preferences, tuple):
+        codes, values = preferences
+        return np.asarray(codes, dtype=np.int64), np.asarray(values)
+    pairs = [(vocabulary.get(str(value)), preference) for value, preference in preferences.items()]
+    pairs = [(code, preference) for code, preference in pairs if code is not None]
+    return (np.array([code for code, _ in pairs], dtype=np.int64),
+            np.array([preference for _, preference in pairs], dtype=np.float64))
+
+
+def top_n_rows(scores: np.ndarray, n: int, exclude_rows: Optional[Iterable[int]] = None) -> np.ndarray:
+    """
+    Return the row indices of the n highest scores, best first
+    Uses argpartition so only the selected rows are fully sorted; ties keep catalog order
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if exclude_rows is not None:
+        exclude_rows = np.fromiter(exclude_rows, dtype=np.int64)
+        if len(exclude_rows):
+            scores = scores.copy()
+            scores[exclude_rows] = -np.inf
+            n = min(n, len(scores) - len(np.unique(exclude_rows)))
+    n = max(0, min(n, len(scores)))
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    if n < len(scores):
+        candidates = np.argpartition(-scores, n - 1)[:n]
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def top_n_rows_batch(scores: np.ndarray, n: int) -> np.ndarray:
+    """
+    Row-wise top_n_rows for a (users x catalog) score matrix
+    Returns a (users x n) array of catalog rows, best first; excluded entries should be
+    scored -inf and dropped by the caller
+    """
+    n_rows, n_columns = scores.shape
+    n = max(0, min(n, n_columns))
+    if n == 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
+    if n < n_columns:
+        candidates = np.argpartition(scores, n_columns - n, axis=1)[:, n_columns - n:]
+    else:
+        candidates = np.broadcast_to(np.arange(n_columns), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.lexsort((candidates, -candidate_scores), axis=-1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class TrackCatalog:
+    # Large per-track arrays; everything else is rebuilt from them by rebuild_lookups
+    ARRAY_ATTRIBUTES = ('track_ids', 'genre_codes', 'genre_values', 'creator_codes', 'creator_values',
+                        'location_codes', 'location_values', 'plays', 'created_epoch')
+    LOOKUP_ATTRIBUTES = ('row_index', 'genre_vocabulary', 'creator_vocabulary', 'location_vocabulary', 'prior')
+
+    def __init__(self, track_metadata: pd.DataFrame):
+        """
+        Build the columnar arrays from the engine's track metadata DataFrame
+        Row i of every array corresponds to track_metadata.iloc[i]
+        """
+        self.n_tracks = len(track_metadata)
+
+        # Row -> track id array and track id -> row hash index (first occurrence wins)
+        self.track_ids = track_metadata['_id'].to_numpy(dtype=object) if '_id' in track_metadata.columns \
+            else np.empty(self.n_tracks, dtype=object)
+
+        self.genre_codes, self.genre_values = _encode_column(track_metadata, 'genre', 'unknown')
+        self.creator_codes, self.creator_values = _encode_column(track_metadata, 'creatorId', 'unknown')
+        self.location_codes, self.location_values = _encode_column(track_metadata, 'location', 'global')
+
+        if 'plays' in track_metadata.columns:
+            self.plays = pd.to_numeric(track_metadata['plays'], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        else:
+            self.plays = np.zeros(self.n_tracks)
+
+        if 'createdAt' in track_metadata.columns:
+            self.created_epoch = _to_epoch_seconds(track_metadata['createdAt'])
+        else:
+            self.created_epoch = np.full(self.n_tracks, np.nan)
+
+        self.rebuild_lookups()
+
+    def rebuild_lookups(self, prior_time: Optional[float] = None):
+        """
+        Rebuild the hash lookups and aggregates derived from the arrays
+        (called after the arrays are loaded back from a model directory)
+        The prior is computed as of prior_time (default: now)
+        """
+        self.n_tracks = len(self.track_ids)
+        self.row_index = {}
+        for row, track_id in enumerate(self.track_ids.tolist()):
+            self.row_index.setdefault(track_id, row)
+
+        self.genre_values = np.asarray(self.genre_values, dtype=object)
+        self.creator_values = np.asarray(self.creator_values, dtype=object)
+        self.location_values = np.asarray(self.location_values, dtype=object)
+        self.genre_vocabulary = {value: code for code, value in enumerate(self.genre_values)}
+        self.creator_vocabulary = {value: code for code, value in enumerate(self.creator_values)}
+        self.location_vocabulary = {value: code for code, value in enumerate(self.location_values)}
+
+        self.max_plays = float(self.plays.max()) if self.n_tracks else 0.0
+        self.refresh_prior(prior_time)
+
+    def refresh_prior(self, now: Optional[float] = None):
+        """
+        Recompute the precomputed float32 prior (freshness decays, so this runs periodically)
+        The vector is replaced in one assignment; requests keep whichever one they read
+        """
+        now = time.time() if now is None else now
+        self.prior = self.prior_scores(POPULARITY_WEIGHT, FRESHNESS_WEIGHT, now).astype(np.float32)
+        self.prior_refreshed_at = now
+
+    def static_prior(self) -> np.ndarray:
+        """
+        The precomputed popularity + freshness vector (float32, aligned with the catalog rows)
+        """
+        prior = getattr(self, 'prior', None)
+        if prior is None:
+            # Catalogs pickled before the prior was precomputed
+            self.refresh_prior()
+            prior = self.prior
+        return prior
+
+    def nbytes(self) -> int:
+        """
+        Bytes held by the catalog arrays (for object arrays, their pointers: the strings
+        are shared with the metadata frame and vocabularies)
+        """
+        return int(sum(getattr(self, attribute).nbytes for attribute in self.ARRAY_ATTRIBUTES))
+
+    def row_of(self, track_id) -> Optional[int]:
+        """
+        Look up the catalog row of a track id, or None if the track is unknown
+        """
+        return self.row_index.get(track_id)
+
+    def rows_of(self, track_ids: Iterable) -> np.ndarray:
+        """
+        Look up the catalog rows of several track ids, skipping unknown ids
+        """
+        rows = [self.row_index.get(track_id) for track_id in track_ids]
+        return np.array([row for row in rows if row is not None], dtype=np.int64)
+
+    def _term_vector(self, vocabulary: Dict[str, int], preferences: Preferences, weight: float,
+                     miss_bonus: float) -> np.ndarray:
+        """
+        Turn a user's {value: preference} counters, or a (codes, preferences) pair of arrays
+        already in this vocabulary's codes, into a per-code score lookup table
+        """
+        terms = np.full(len(vocabulary), miss_bonus, dtype=np.float64)
+        if isinstance(preferences, tuple):
+            codes, values = preferences
+            terms[codes] = values * weight
+            return terms
+        for value, preference in preferences.items():
+            code = vocabulary.get(str(value))
+            if code is not None:
+                terms[code] = preference * weight
+        return terms
+
+    def _row_terms(self, vocabulary: Dict[str, int], preferences: Preferences, codes: np.ndarray,
+                   weight: float, miss_bonus: float) -> np.ndarray:
+        """
+        _term_vector looked up for the given codes only, without building the per-code table
+        (binary search over the user's few preferred codes)
+        """
+        preferred, values = preference_arrays(vocabulary, preferences)
+        terms = np.full(len(codes), miss_bonus, dtype=np.float64)
+        if len(preferred):
+            order = np.argsort(preferred, kind='stable')
+            preferred, values = preferred[order], values[order]
+            positions = np.minimum(np.searchsorted(preferred, codes), len(preferred) - 1)
+            hits = preferred[positions] == codes
+            terms[hits] = values[positions[hits]] * weight
+        return terms
+
+    def score_collaborative_rows(self, rows: np.ndarray, genre_preferences: Preferences,
+                                 creator_preferences: Preferences, genre_weight: float = 0.4,
+                                 creator_weight: float = 0.3, miss_bonus: float = 0.0,
+                                 prior: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        score_collaborative (default prior weights) for a subset of catalog rows, e.g. retrieved
+        candidates; the work depends on len(rows), not the catalog size. prior defaults to
+        static_prior() (pass the vector the candidates were retrieved with to stay consistent
+        across a concurrent refresh)
+        """
+        scores = self._row_terms(self.genre_vocabulary, genre_preferences, self.genre_codes[rows],
+                                 genre_weight, miss_bonus)
+        scores += self._row_terms(self.creator_vocabulary, creator_preferences, self.creator_codes[rows],
+                                  creator_weight, miss_bonus)
+        scores += (self.static_prior() if prior is None else prior)[rows]
+        return scores
+
+    def score_collaborative(self, genre_preferences: Preferences, creator_preferences: Preferences,
+                            genre_weight: float = 0.4, creator_weight: float = 0.3,
+                            popularity_weight: float = POPULARITY_WEIGHT, freshness_weight: float = FRESHNESS_WEIGHT,
+                            miss_bonus: float = 0.0, now: Optional[float] = None) -> np.ndarray:
+        """
+        Score every track in the catalog against a user's genre and creator preferences
+        Only the user-dependent terms are computed per call; with the default weights the
+        precomputed prior is added on top. Returns a float64 array aligned with the catalog rows
+        """
+        genre_terms = self._term_vector(self.genre_vocabulary, genre_preferences, genre_weight, miss_bonus)
+        creator_terms = self._term_vector(self.creator_vocabulary, creator_preferences, creator_weight, miss_bonus)
+        scores = genre_terms[self.genre_codes] + creator_terms[self.creator_codes]
+        if now is None and popularity_weight == POPULARITY_WEIGHT and freshness_weight == FRESHNESS_WEIGHT:
+            scores += self.static_prior()
+        else:
+            scores += self.prior_scores(popularity_weight, freshness_weight, now)
+        return scores
+
+    def prior_scores(self, popularity_weight: float = POPULARITY_WEIGHT, freshness_weight: float = FRESHNESS_WEIGHT,
+                     now: Optional[float] = None) -> np.ndarray:
+        """
+        User-independent part of the collaborative score: popularity plus freshness
+        """
+        scores = np.zeros(self.n_tracks)
+
+        # Popularity boost
+        if self.max_plays > 0:
+            scores += np.where(self.plays > 0, self.plays / self.max_plays, 0.0) * popularity_weight
+
+        # Freshness factor: tracks up to a year old decay linearly, unknown dates count as new
+        now = time.time() if now is None else now
+        days_old = np.floor((now - self.created_epoch) / SECONDS_PER_DAY)
+        freshness = np.minimum(1.0, np.nan_to_num(days_old, nan=0.0) / DAYS_PER_YEAR)
+        scores += (1 - freshness) * freshness_weight
+
+        return scores
+
+    def score_collaborative_batch(self, genre_preferences: List[Preferences], creator_preferences: List[Preferences],
+                                  genre_weight: float = 0.4, creator_weight: float = 0.3,
+                                  miss_bonus: float = 0.0, prior: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        score_collaborative for several users at once as a float32 (users x catalog) matrix
+        prior defaults to the precomputed prior vector
+        """
+        genre_terms = np.stack([
+            self._term_vector(self.genre_vocabulary, preferences, genre_weight, miss_bonus)
+            for preferences in genre_preferences
+        ]).astype(np.float32)
+        creator_terms = np.stack([
+            self._term_vector(self.creator_vocabulary, preferences, creator_weight, miss_bonus)
+            for preferences in creator_preferences
+        ]).astype(np.float32)
+        scores = genre_terms[:, self.genre_codes]
+        scores += creator_terms[:, self.creator_codes]
+        if prior is None:
+            prior = self.static_prior()
+        scores += prior.astype(np.float32, copy=False)
+        return scores
+
+
+class PriorRefresher:
+    def __init__(self, get_catalogs: Callable[[], Iterable[TrackCatalog]], interval: float = 3600.0):
+        """
+        Initialize the refresher
+        get_catalogs returns the catalogs currently serving (engines swap theirs on reload),
+        or engines, whose refresh_prior also rebuilds their prior-ranked indexes; each gets
+        refresh_prior() called every interval seconds so freshness keeps decaying
+        """
+        self.get_catalogs = get_catalogs
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'PriorRefresher':
+        self._thread = threading.Thread(target=self._run, name='prior-refresher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def refresh(self):
+        for catalog in self.get_catalogs():
+            if catalog is not None:
+                catalog.refresh_prior()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing the catalog prior: {e}")
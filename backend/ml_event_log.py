@@ -0,0 +1,83 @@
+"""
+Shared Interaction Event Log for the MuzikaX ML API
+This module appends the live interactions posted to the events endpoint to a SQLite file
+shared by every pre-forked worker. Each engine remembers the sequence number of the last
+logged event it has applied, so a worker can catch up on the events other workers
+received, and an engine loaded for a newly published model version can replay the events
+logged after its training snapshot before it is swapped in.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InteractionEventLog:
+    def __init__(self, db_path: str, max_events: int = 1000000):
+        """
+        Open (creating if needed) the SQLite event log at db_path
+        Only the newest max_events events are kept; a model trained before the oldest of them
+        can no longer replay everything it missed
+        Each thread gets its own connection (per process, like MaterializedRecommendationStore)
+        """
+        self.db_path = db_path
+        self.max_events = max_events
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS events ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'received_at REAL NOT NULL, '
+                'event TEXT NOT NULL'
+                ')'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        # A pre-forked worker must not reuse its parent's connection
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def append(self, events: Iterable[Dict]) -> int:
+        """
+        Log a batch of validated events in one transaction and return the last sequence number
+        Events without a timestamp are stamped with the time they were received, so a later
+        replay records them at the same time as the first application
+        """
+        received_at = time.time()
+        records = [
+            (received_at, json.dumps(event if event.get('timestamp') is not None
+                                     else dict(event, timestamp=received_at)))
+            for event in events
+        ]
+        with self._connect() as connection:
+            connection.executemany('INSERT INTO events (received_at, event) VALUES (?, ?)', records)
+            last_seq = connection.execute('SELECT COALESCE(MAX(seq), 0) FROM events').fetchone()[0]
+            connection.execute('DELETE FROM events WHERE seq <= ?', (last_seq - self.max_events,))
+        return last_seq
+
+    def last_seq(self) -> int:
+        """
+        Sequence number of the newest logged event (0 for an empty log)
+        """
+        return self._connect().execute('SELECT COALESCE(MAX(seq), 0) FROM events').fetchone()[0]
+
+    def since(self, seq: int, limit: int = 5000) -> List[Tuple[int, Dict]]:
+        """
+        Up to limit (sequence number, event) pairs logged after seq, oldest first
+        """
+        return [(row[0], json.loads(row[1])) for row in self._connect().execute(
+            'SELECT seq, event FROM events WHERE seq > ? ORDER BY seq LIMIT ?', (seq, limit)
+        )]
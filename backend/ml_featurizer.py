@@ -0,0 +1,174 @@
+"""
+Streaming Track Featurizer for MuzikaX Recommendations
+This module builds the sparse track feature matrix in two passes over a stream of
+track chunks: a statistics pass that collects global normalizers (max plays/likes,
+creator track counts) and separate genre and location TF-IDF vocabularies, then a
+transform pass that featurizes each chunk with those global statistics. Features no
+longer depend on batch boundaries, and memory is bounded by the chunk size.
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from collections import Counter
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+from typing import Dict, List
+
+# Track types encoded as one-hot features (see the Track model's type enum)
+TRACK_TYPES = ['song', 'beat', 'mix']
+
+
+class StreamingTfidf:
+    def __init__(self, max_features: int = 100, stop_words: str = 'english'):
+        """
+        TF-IDF whose vocabulary and document frequencies are accumulated chunk by chunk
+        Uses the same tokenization, smooth idf and l2 normalization as TfidfVectorizer
+        """
+        self.max_features = max_features
+        self.stop_words = stop_words
+        self.term_counts = Counter()
+        self.doc_counts = Counter()
+        self.n_docs = 0
+        self.vocabulary_ = None
+        self.idf_ = None
+
+    def _analyzer(self):
+        return TfidfVectorizer(stop_words=self.stop_words).build_analyzer()
+
+    def partial_fit(self, texts: pd.Series):
+        """
+        Accumulate term and document frequencies from one chunk of texts
+        """
+        analyze = self._analyzer()
+        for text in texts:
+            terms = analyze(text)
+            self.term_counts.update(terms)
+            self.doc_counts.update(set(terms))
+            self.n_docs += 1
+        return self
+
+    def finalize(self):
+        """
+        Keep the max_features most frequent terms and compute their idf weights
+        """
+        top_terms = sorted(self.term_counts, key=lambda term: (-self.term_counts[term], term))[:self.max_features]
+        self.vocabulary_ = {term: i for i, term in enumerate(sorted(top_terms))}
+        doc_freq = np.array([self.doc_counts[term] for term in sorted(top_terms)], dtype=np.float64)
+        self.idf_ = np.log((1 + self.n_docs) / (1 + doc_freq)) + 1
+        # The raw counters are only needed while fitting
+        self.term_counts = Counter()
+        self.doc_counts = Counter()
+        return self
+
+    def transform(self, texts: pd.Series) -> sp.csr_matrix:
+        """
+        Transform one chunk of texts into l2-normalized TF-IDF rows
+        """
+        analyze = self._analyzer()
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            for term in analyze(text):
+                col = self.vocabulary_.get(term)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        counts = sp.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(texts), len(self.vocabulary_))
+        )
+        counts.sum_duplicates()
+        return normalize(counts @ sp.diags(self.idf_))
+
+
+class StreamingTrackFeaturizer:
+    def __init__(self, max_text_features: int = 100):
+        """
+        Initialize the featurizer; call update_stats on every chunk, then finalize, then transform
+        """
+        self.genre_tfidf = StreamingTfidf(max_features=max_text_features)
+        self.location_tfidf = StreamingTfidf(max_features=max_text_features)
+        self.max_plays = 0.0
+        self.max_likes = 0.0
+        self.creator_counts: Dict[str, int] = Counter()
+        self.max_creator_count = 0
+        self.n_tracks = 0
+        self.is_fitted = False
+
+    @staticmethod
+    def _text(track_df: pd.DataFrame, column: str, default: str) -> pd.Series:
+        if column in track_df.columns:
+            return track_df[column].fillna(default).astype(str)
+        return pd.Series(default, index=track_df.index)
+
+    @staticmethod
+    def _numeric(track_df: pd.DataFrame, column: str) -> np.ndarray:
+        if column in track_df.columns:
+            return pd.to_numeric(track_df[column], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        return np.zeros(len(track_df))
+
+    def update_stats(self, track_df: pd.DataFrame):
+        """
+        Statistics pass: fold one chunk into the global normalizers and vocabularies
+        """
+        if len(track_df) == 0:
+            return self
+        self.max_plays = max(self.max_plays, float(self._numeric(track_df, 'plays').max()))
+        self.max_likes = max(self.max_likes, float(self._numeric(track_df, 'likes').max()))
+        if 'creatorId' in track_df.columns:
+            self.creator_counts.update(track_df['creatorId'].dropna().tolist())
+        self.genre_tfidf.partial_fit(self._text(track_df, 'genre', 'unknown'))
+        self.location_tfidf.partial_fit(self._text(track_df, 'location', 'global'))
+        self.n_tracks += len(track_df)
+        return self
+
+    def finalize(self):
+        """
+        Freeze the statistics collected by the statistics pass
+        """
+        self.genre_tfidf.finalize()
+        self.location_tfidf.finalize()
+        self.max_creator_count = max(self.creator_counts.values(), default=0)
+        self.is_fitted = True
+        return self
+
+    @property
+    def feature_names(self) -> List[str]:
+        return (['normalized_plays', 'normalized_likes']
+                + [f'genre_{term}' for term in self.genre_tfidf.vocabulary_]
+                + ['creator_popularity']
+                + [f'type_{track_type}' for track_type in TRACK_TYPES]
+                + [f'loc_{term}' for term in self.location_tfidf.vocabulary_])
+
+    def transform(self, track_df: pd.DataFrame) -> sp.csr_matrix:
+        """
+        Transform pass: featurize one chunk with the global statistics
+        Every chunk gets the same sparse column layout
+        """
+        n_tracks = len(track_df)
+
+        def column(values: np.ndarray) -> sp.csr_matrix:
+            return sp.csr_matrix(np.nan_to_num(values).reshape(-1, 1))
+
+        plays = column(self._numeric(track_df, 'plays') / (self.max_plays if self.max_plays > 0 else 1))
+        likes = column(self._numeric(track_df, 'likes') / (self.max_likes if self.max_likes > 0 else 1))
+        genre_matrix = self.genre_tfidf.transform(self._text(track_df, 'genre', 'unknown'))
+
+        if 'creatorId' in track_df.columns and self.max_creator_count > 0:
+            creator_counts = track_df['creatorId'].map(self.creator_counts).fillna(0).to_numpy(dtype=np.float64)
+            creator_popularity = column(creator_counts / self.max_creator_count)
+        else:
+            creator_popularity = column(np.zeros(n_tracks))
+
+        # Type encoding (song, beat, mix); tracks without a type default to song
+        type_codes = pd.Categorical(self._text(track_df, 'type', 'song'), categories=TRACK_TYPES).codes
+        known = type_codes >= 0
+        type_matrix = sp.csr_matrix(
+            (np.ones(known.sum()), (np.flatnonzero(known), type_codes[known])),
+            shape=(n_tracks, len(TRACK_TYPES))
+        )
+
+        location_matrix = self.location_tfidf.transform(self._text(track_df, 'location', 'global'))
+
+        return sp.hstack(
+            [plays, likes, genre_matrix, creator_popularity, type_matrix, location_matrix], format='csr'
+        )
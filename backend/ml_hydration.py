@@ -0,0 +1,172 @@
+"""
+Track Hydration for the MuzikaX ML APIs
+This module turns ranked track ids into track documents with a single MongoDB `$in`
+query and a field projection, restores the ranking order, and keeps a bounded LRU of
+hydrated documents. Cached documents are revalidated in the same query that fetches the
+missing ones, so a response costs at most one round-trip: an unchanged `updatedAt` keeps
+the cached document, and a cached track the query no longer returns has been deleted
+and is evicted.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+import logging
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+logger = logging.getLogger(__name__)
+
+# Track fields returned to clients (see src/models/Track.js); the per-track comment
+# id list and stem processing state are left out
+TRACK_DETAIL_PROJECTION = {
+    '_id': 1,
+    'creatorId': 1,
+    'creatorType': 1,
+    'title': 1,
+    'description': 1,
+    'audioURL': 1,
+    'audioVariants': 1,
+    'coverURL': 1,
+    'genre': 1,
+    'type': 1,
+    'paymentType': 1,
+    'price': 1,
+    'currency': 1,
+    'plays': 1,
+    'uniquePlays': 1,
+    'likes': 1,
+    'shares': 1,
+    'reposts': 1,
+    'albumId': 1,
+    'releaseDate': 1,
+    'collaborators': 1,
+    'hasStems': 1,
+    'isPublic': 1,
+    'createdAt': 1,
+    'updatedAt': 1
+}
+
+
+def _stringify_ids(value: Any) -> Any:
+    """
+    Replace ObjectIds (top level and nested) with their string form so documents are JSON-ready
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: _stringify_ids(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_stringify_ids(item) for item in value]
+    return value
+
+
+class _CachedTrack:
+    __slots__ = ('document', 'updated_at', 'fetched_at', 'validated_at')
+
+    def __init__(self, document: Dict, updated_at: Optional[datetime], now: float):
+        self.document = document
+        self.updated_at = updated_at
+        self.fetched_at = now
+        self.validated_at = now
+
+
+class TrackHydrator:
+    def __init__(self, get_collection: Callable[[], Any], projection: Optional[Dict] = None,
+                 max_entries: int = 10000, revalidate_after: float = 30.0, max_age: float = 600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the hydrator
+        get_collection returns the tracks collection (called per query, so a reconnected client is picked up);
+        cached documents are served as-is for revalidate_after seconds, then checked against their
+        updatedAt, and refetched outright once older than max_age; either way a track that is
+        no longer found is dropped from the cache
+        """
+        self.get_collection = get_collection
+        self.projection = projection or TRACK_DETAIL_PROJECTION
+        self.max_entries = max_entries
+        self.revalidate_after = revalidate_after
+        self.max_age = max_age
+        self.clock = clock
+
+        self._cache: 'OrderedDict[str, _CachedTrack]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.round_trips = 0
+
+    def hydrate(self, track_ids: List[str]) -> List[Dict]:
+        """
+        Return the documents of track_ids in the given order, skipping unknown or invalid ids
+        """
+        now = self.clock()
+        documents: Dict[str, Dict] = {}
+        missing: List[ObjectId] = []
+        stale: Dict[str, _CachedTrack] = {}
+
+        with self._lock:
+            for track_id in dict.fromkeys(track_ids):
+                entry = self._cache.get(track_id)
+                if entry is not None and now - entry.fetched_at < self.max_age:
+                    self._cache.move_to_end(track_id)
+                    if now - entry.validated_at < self.revalidate_after:
+                        documents[track_id] = entry.document
+                        self.hits += 1
+                        continue
+                    if entry.updated_at is not None:
+                        stale[track_id] = entry
+                        continue
+                try:
+                    missing.append(ObjectId(track_id))
+                except (InvalidId, TypeError):
+                    continue
+                self.misses += 1
+
+        if missing or stale:
+            # Stale tracks are queried unconditionally: one that is not returned was deleted
+            queried = missing + [ObjectId(track_id) for track_id in stale]
+            fetched = list(self.get_collection().find({'_id': {'$in': queried}}, self.projection))
+            self.round_trips += 1
+
+            with self._lock:
+                for document in fetched:
+                    updated_at = document.get('updatedAt')
+                    track_id = str(document['_id'])
+                    entry = stale.get(track_id)
+                    if entry is not None and updated_at == entry.updated_at:
+                        # Unchanged since it was cached
+                        entry.validated_at = now
+                        documents[track_id] = entry.document
+                        self.revalidated += 1
+                        continue
+                    document = _stringify_ids(document)
+                    documents[track_id] = document
+                    self._cache[track_id] = _CachedTrack(document, updated_at, now)
+                    self._cache.move_to_end(track_id)
+                for object_id in queried:
+                    if str(object_id) not in documents:
+                        self._cache.pop(str(object_id), None)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+        return [dict(documents[track_id]) for track_id in track_ids if track_id in documents]
+
+    def invalidate(self, track_ids: List[str]):
+        with self._lock:
+            for track_id in track_ids:
+                self._cache.pop(track_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._cache),
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'round_trips': self.round_trips
+            }
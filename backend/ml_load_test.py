@@ -0,0 +1,575 @@
+"""
+HTTP Load Test for the MuzikaX Enhanced ML API
+This module boots ml_recommendation_api_enhanced in a separate process against an
+in-memory stand-in for MongoDB (seeded with synthetic tracks, users, favorites and
+comments from ml_benchmark's generators), drives mixed personalized / content-based /
+location-based / collaborative traffic over real HTTP at a target request rate or
+concurrency, and reports throughput, error rate and latency percentiles per route,
+together with the database queries issued per request. It can also target an API
+that is already running (--url).
+
+Usage:
+    python ml_load_test.py --tracks 20000 --concurrency 32 --duration 30
+    python ml_load_test.py --rps 200 --duration 60 --output load.json --max-p99-ms 250
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+import logging
+
+import numpy as np
+from bson import ObjectId
+
+from ml_benchmark import LOCATIONS, generate_catalog, generate_interactions
+
+logger = logging.getLogger(__name__)
+
+ROUTES = {
+    'personalized': '/api/ml-recommendations/personalized',
+    'content': '/api/ml-recommendations/content-based',
+    'location': '/api/ml-recommendations/location-based',
+    'collaborative': '/api/ml-recommendations/collaborative'
+}
+DEFAULT_MIX = {'personalized': 0.4, 'collaborative': 0.25, 'content': 0.2, 'location': 0.15}
+# Recently played entries kept per user document
+RECENTLY_PLAYED_LIMIT = 50
+
+
+def _compare(operator: str, value: Any, operand: Any) -> bool:
+    if operator == '$in':
+        return value in operand
+    if operator == '$nin':
+        return value not in operand
+    if operator == '$ne':
+        return value != operand
+    if operator == '$exists':
+        return (value is not None) == bool(operand)
+    if value is None:
+        return False
+    if operator == '$gt':
+        return value > operand
+    if operator == '$gte':
+        return value >= operand
+    if operator == '$lt':
+        return value < operand
+    if operator == '$lte':
+        return value <= operand
+    raise ValueError(f"Unsupported query operator: {operator}")
+
+
+def _matches(document: Dict, query: Dict) -> bool:
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(_matches(document, clause) for clause in condition):
+                return False
+        elif key == '$and':
+            if not all(_matches(document, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict) and condition and all(op.startswith('$') for op in condition):
+            value = document.get(key)
+            if not all(_compare(op, value, operand) for op, operand in condition.items()):
+                return False
+        elif document.get(key) != condition:
+            return False
+    return True
+
+
+def _project(document: Dict, projection: Optional[Dict]) -> Dict:
+    # Shallow copies, like fresh documents off the wire (callers mutate top-level fields)
+    if not projection:
+        return dict(document)
+    if any(projection.values()):
+        fields = [field for field, include in projection.items() if include]
+        if projection.get('_id', 1):
+            fields.append('_id')
+        return {field: document[field] for field in fields if field in document}
+    return {field: value for field, value in document.items() if field not in projection}
+
+
+class InMemoryCursor:
+    def __init__(self, collection: 'InMemoryCollection', query: Dict, projection: Optional[Dict]):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._skip = 0
+        self._limit = 0
+
+    def skip(self, n: int) -> 'InMemoryCursor':
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> 'InMemoryCursor':
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int) -> 'InMemoryCursor':
+        return self
+
+    def __iter__(self) -> Iterator[Dict]:
+        self.collection._round_trip('find')
+        skipped = returned = 0
+        for document in self.collection._candidates(self.query):
+            if not _matches(document, self.query):
+                continue
+            if skipped < self._skip:
+                skipped += 1
+                continue
+            if self._limit and returned >= self._limit:
+                break
+            returned += 1
+            self.collection.stats['documents'] += 1
+            yield _project(document, self.projection)
+
+
+class InMemoryCollection:
+    def __init__(self, name: str, documents: Iterable[Dict] = (), indexed_fields: Tuple[str, ...] = (),
+                 latency: float = 0.0):
+        """
+        Initialize the collection
+        Lookups by _id (equality, $in, or $or of such clauses) and by indexed_fields equality
+        avoid a scan; every query sleeps `latency` seconds to stand in for the network round-trip
+        """
+        self.name = name
+        self.latency = latency
+        self.documents: Dict[Any, Dict] = {}
+        self.indexes: Dict[str, Dict[Any, List[Dict]]] = {field: defaultdict(list) for field in indexed_fields}
+        self.stats = defaultdict(int)
+        self._lock = threading.Lock()
+        for document in documents:
+            self.insert_one(document)
+
+    def insert_one(self, document: Dict):
+        self.documents[document['_id']] = document
+        for field, index in self.indexes.items():
+            if field in document:
+                index[document[field]].append(document)
+
+    def _round_trip(self, operation: str):
+        with self._lock:
+            self.stats[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _id_candidates(self, condition: Any) -> Optional[List[Dict]]:
+        if isinstance(condition, dict):
+            if set(condition) != {'$in'}:
+                return None
+            ids = condition['$in']
+        else:
+            ids = [condition]
+        return [self.documents[_id] for _id in ids if _id in self.documents]
+
+    def _candidates(self, query: Dict) -> Iterable[Dict]:
+        if '_id' in query:
+            candidates = self._id_candidates(query['_id'])
+            if candidates is not None:
+                return candidates
+        if set(query) == {'$or'}:
+            merged = {}
+            for clause in query['$or']:
+                candidates = self._id_candidates(clause['_id']) if '_id' in clause else None
+                if candidates is None:
+                    return list(self.documents.values())
+                merged.update((document['_id'], document) for document in candidates)
+            return list(merged.values())
+        for field, index in self.indexes.items():
+            if field in query and not isinstance(query[field], dict):
+                return list(index.get(query[field], ()))
+        # Snapshot so concurrent inserts cannot break iteration
+        return list(self.documents.values())
+
+    def find(self, query: Optional[Dict] = None, projection: Optional[Dict] = None) -> InMemoryCursor:
+        return InMemoryCursor(self, query or {}, projection)
+
+    def find_one(self, query: Optional[Dict] = None, projection: Optional[Dict] = None) -> Optional[Dict]:
+        self._round_trip('find_one')
+        query = query or {}
+        for document in self._candidates(query):
+            if _matches(document, query):
+                self.stats['documents'] += 1
+                return _project(document, projection)
+        return None
+
+
+class InMemoryDatabase:
+    def __init__(self, collections: Dict[str, InMemoryCollection]):
+        self.collections = collections
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        if name not in self.collections:
+            self.collections[name] = InMemoryCollection(name)
+        return self.collections[name]
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: dict(collection.stats) for name, collection in self.collections.items()}
+
+
+def seed_database(n_tracks: int, seed: int = 42, latency: float = 0.001) -> Tuple[InMemoryDatabase, Dict[str, Any]]:
+    """
+    Build the tracks, users, favorites and comments collections from a synthetic catalog
+    Returns the database and the ids the traffic generator samples from
+    """
+    catalog = generate_catalog(n_tracks, seed=seed)
+    interactions = generate_interactions(catalog, seed=seed + 1)
+
+    now = datetime(2026, 1, 1)
+    tracks = []
+    for track in catalog:
+        track = dict(track, _id=ObjectId(track['_id']), creatorId=ObjectId(track['creatorId']))
+        track.update(description='', audioURL=f"https://cdn.muzikax.test/audio/{track['_id']}.mp3",
+                     coverURL=f"https://cdn.muzikax.test/covers/{track['_id']}.jpg", paymentType='free',
+                     price=0, currency='RWF', uniquePlays=track['plays'] // 2, reposts=0, collaborators=[],
+                     hasStems=False, isPublic=True, comments=[], updatedAt=now)
+        tracks.append(track)
+
+    users: Dict[ObjectId, Dict] = {}
+    favorites, comments = [], []
+    for interaction in interactions:
+        user_id, track_id = ObjectId(interaction['userId']), ObjectId(interaction['trackId'])
+        user = users.setdefault(user_id, {'_id': user_id, 'recentlyPlayed': []})
+        if interaction['type'] == 'play':
+            user['recentlyPlayed'].append({'trackId': track_id, 'timestamp': interaction['timestamp']})
+        elif interaction['type'] == 'like':
+            favorites.append({'_id': ObjectId(), 'userId': user_id, 'trackId': track_id,
+                              'timestamp': interaction['timestamp']})
+        elif interaction['type'] == 'comment':
+            comments.append({'_id': ObjectId(), 'userId': user_id, 'trackId': track_id, 'text': 'Nice!',
+                             'createdAt': interaction['timestamp']})
+    for user in users.values():
+        user['recentlyPlayed'] = sorted(user['recentlyPlayed'], key=lambda rp: rp['timestamp'])[-RECENTLY_PLAYED_LIMIT:]
+
+    database = InMemoryDatabase({
+        'tracks': InMemoryCollection('tracks', tracks, latency=latency),
+        'users': InMemoryCollection('users', users.values(), latency=latency),
+        'favorites': InMemoryCollection('favorites', favorites, indexed_fields=('userId',), latency=latency),
+        'comments': InMemoryCollection('comments', comments, indexed_fields=('userId',), latency=latency)
+    })
+    # Sample traffic like production: active users and popular tracks show up more often
+    plays = np.array([track['plays'] for track in catalog], dtype=np.float64) + 1.0
+    activity = defaultdict(int)
+    for interaction in interactions:
+        activity[interaction['userId']] += 1
+    population = {
+        'track_ids': [track['_id'] for track in catalog],
+        'track_weights': (plays / plays.sum()).tolist(),
+        'user_ids': list(activity),
+        'user_weights': (np.array(list(activity.values()), dtype=np.float64) / len(interactions)).tolist()
+    }
+    return database, population
+
+
+def _serve_api(n_tracks: int, seed: int, db_latency: float, warm: bool, server: str,
+               messages: 'multiprocessing.Queue', stop: 'multiprocessing.Event'):
+    """
+    Process target: seed the stand-in, boot the API on a free loopback port, serve until stopped
+    """
+    # Keep training artifacts out of the repository
+    os.environ.setdefault('ML_MODEL_DIR', tempfile.mkdtemp(prefix='ml-load-test-'))
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    try:
+        import ml_recommendation_api_enhanced as api
+        from ml_recommendation_enhanced import AdvancedMLRecommendationEngine
+        # Per-request INFO logging would dominate the console at load-test rates
+        logging.getLogger(api.__name__).setLevel(logging.WARNING)
+        logging.getLogger('ml_recommendation_enhanced').setLevel(logging.WARNING)
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+        database, population = seed_database(n_tracks, seed=seed, latency=db_latency)
+        api.db = database
+        if warm:
+            # The state of a production worker: an engine trained on the whole catalog
+            interactions = []
+            for user_id in population['user_ids']:
+                interactions.extend(api.get_user_interactions_from_db(user_id=user_id, limit=100))
+            new_engine = AdvancedMLRecommendationEngine(max_tracks_for_training=n_tracks)
+            new_engine.load_data_incrementally(lambda: api.iter_tracks_from_db(batch_size=5000),
+                                               interactions, batch_size=5000)
+            new_engine.train_models()
+            api.publish_engine(new_engine)
+        for collection in database.collections.values():
+            collection.stats.clear()
+
+        if server == 'asgi':
+            import uvicorn
+            config = uvicorn.Config(api.create_asgi_app(api), host='127.0.0.1', port=0, log_level='warning')
+            http_server = uvicorn.Server(config)
+            thread = threading.Thread(target=http_server.run, daemon=True)
+            thread.start()
+            while not http_server.started:
+                time.sleep(0.05)
+            port = http_server.servers[0].sockets[0].getsockname()[1]
+            shutdown = lambda: setattr(http_server, 'should_exit', True)
+        else:
+            from werkzeug.serving import make_server
+            http_server = make_server('127.0.0.1', 0, api.app, threaded=True)
+            port = http_server.server_port
+            thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+            thread.start()
+            shutdown = http_server.shutdown
+
+        messages.put(('ready', {'port': port, 'population': population}))
+        stop.wait()
+        messages.put(('stats', {'db': database.get_stats()}))
+        shutdown()
+    except Exception as e:
+        messages.put(('error', repr(e)))
+
+
+class _Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.status_codes: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.sent = 0  # Including warmup requests
+        self._lock = threading.Lock()
+
+    def count_sent(self):
+        with self._lock:
+            self.sent += 1
+
+    def record(self, route: str, latency: float, status: Optional[int]):
+        with self._lock:
+            self.latencies[route].append(latency)
+            if status is None or status >= 400:
+                self.errors[route] += 1
+            self.status_codes[route][status or 0] += 1
+
+
+class TrafficGenerator:
+    def __init__(self, population: Dict[str, Any], mix: Dict[str, float], seed: int = 7, limit: int = 10):
+        self.population = population
+        self.routes = list(mix)
+        weights = np.array([mix[route] for route in self.routes], dtype=np.float64)
+        self.route_weights = weights / weights.sum()
+        self.rng = np.random.default_rng(seed)
+        self.limit = limit
+        self._lock = threading.Lock()
+
+    def next_request(self) -> Tuple[str, str]:
+        """
+        Draw (route name, path with query string) from the traffic mix
+        """
+        population = self.population
+        with self._lock:
+            route = self.routes[self.rng.choice(len(self.routes), p=self.route_weights)]
+            user_id = population['user_ids'][self.rng.choice(len(population['user_ids']), p=population['user_weights'])]
+            track_id = population['track_ids'][self.rng.choice(len(population['track_ids']), p=population['track_weights'])]
+            location = LOCATIONS[self.rng.integers(0, len(LOCATIONS))]
+            with_seed = self.rng.random() < 0.6
+        if route == 'personalized':
+            params = {'userId': user_id, 'limit': self.limit, 'location': location}
+            if with_seed:
+                params['currentTrackId'] = track_id
+        elif route == 'content':
+            params = {'seedTrackIds': track_id, 'limit': self.limit}
+        elif route == 'location':
+            params = {'location': location, 'limit': self.limit}
+        else:
+            params = {'userId': user_id, 'limit': self.limit}
+        return route, f'{ROUTES[route]}?{urlencode(params)}'
+
+
+def _send(connection: http.client.HTTPConnection, path: str) -> int:
+    connection.request('GET', path, headers={'Accept': 'application/json'})
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def drive_traffic(base_url: str, generator: TrafficGenerator, duration: float, concurrency: int = 32,
+                  rps: Optional[float] = None, warmup: float = 0.0, timeout: float = 30.0) -> Dict[str, Any]:
+    """
+    Send traffic for warmup + duration seconds and summarize the measured part
+    Without rps each of `concurrency` clients sends back-to-back (closed loop); with rps,
+    requests are scheduled at fixed arrival times and latency counts from the scheduled
+    time, so a saturated server shows up as queueing delay instead of a lower send rate
+    """
+    url = urlsplit(base_url)
+    recorder = _Recorder()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+    schedule: 'queue.Queue[Optional[float]]' = queue.Queue(maxsize=concurrency * 4)
+
+    def client():
+        connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+        while True:
+            if rps:
+                intended = schedule.get()
+                if intended is None:
+                    break
+                delay = intended - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                intended = time.perf_counter()
+                if intended >= deadline:
+                    break
+            route, path = generator.next_request()
+            try:
+                status = _send(connection, path)
+            except (OSError, http.client.HTTPException):
+                status = None
+                connection.close()
+                connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+            finished = time.perf_counter()
+            recorder.count_sent()
+            if intended >= measure_from:
+                recorder.record(route, finished - intended, status)
+        connection.close()
+
+    clients = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    if rps:
+        n_requests = int((warmup + duration) * rps)
+        for i in range(n_requests):
+            schedule.put(started + i / rps)
+        for _ in clients:
+            schedule.put(None)
+    for thread in clients:
+        thread.join()
+    elapsed = max(time.perf_counter() - measure_from, 1e-9)
+    return summarize(recorder, min(elapsed, duration) if not rps else elapsed)
+
+
+def summarize(recorder: _Recorder, elapsed: float) -> Dict[str, Any]:
+    routes = {}
+    all_latencies = []
+    total_errors = 0
+    for route, latencies in sorted(recorder.latencies.items()):
+        values = np.array(latencies) * 1000.0
+        all_latencies.extend(latencies)
+        total_errors += recorder.errors[route]
+        routes[route] = dict(_latency_summary(values), requests=len(values),
+                             throughput_rps=len(values) / elapsed,
+                             error_rate=recorder.errors[route] / len(values),
+                             status_codes={str(code): count for code, count in recorder.status_codes[route].items()})
+    values = np.array(all_latencies) * 1000.0
+    overall = dict(_latency_summary(values), requests=len(values), throughput_rps=len(values) / elapsed,
+                   error_rate=total_errors / len(values) if len(values) else 0.0)
+    return {'elapsed_seconds': elapsed, 'requests_sent': recorder.sent, 'overall': overall, 'routes': routes}
+
+
+def _latency_summary(values_ms: np.ndarray) -> Dict[str, float]:
+    if not len(values_ms):
+        return {}
+    return {
+        'mean_ms': float(values_ms.mean()),
+        'p50_ms': float(np.percentile(values_ms, 50)),
+        'p90_ms': float(np.percentile(values_ms, 90)),
+        'p95_ms': float(np.percentile(values_ms, 95)),
+        'p99_ms': float(np.percentile(values_ms, 99)),
+        'max_ms': float(values_ms.max())
+    }
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(','):
+        route, _, weight = part.partition('=')
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown route {route!r} (choose from {', '.join(ROUTES)})")
+        mix[route] = float(weight or 1)
+    return mix
+
+
+def _format_table(report: Dict[str, Any]) -> str:
+    lines = [f"{'route':<14}{'requests':>10}{'rps':>10}{'errors':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for route, stats in list(report['routes'].items()) + [('overall', report['overall'])]:
+        if not stats.get('requests'):
+            continue
+        lines.append(f"{route:<14}{stats['requests']:>10}{stats['throughput_rps']:>10.1f}{stats['error_rate']:>8.1%} "
+                     f"{stats['p50_ms']:>9.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    for collection, per_request in report.get('db_queries_per_request', {}).items():
+        lines.append(f"db {collection}: {per_request:.2f} queries/request")
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Load test the enhanced ML API over HTTP')
+    parser.add_argument('--url', help='target an API that is already running instead of booting one')
+    parser.add_argument('--tracks', type=int, default=20000, help='synthetic catalog size')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db-latency-ms', type=float, default=1.0, help='simulated MongoDB round-trip')
+    parser.add_argument('--cold', action='store_true', help="leave the engine to the API's first-request initialization")
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--mix', type=_parse_mix, default=DEFAULT_MIX, help='e.g. personalized=4,content=2,location=1')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--rps', type=float, help='target request rate (open loop); default is closed loop')
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--warmup', type=float, default=5.0)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--max-p99-ms', type=float, help='exit non-zero if the overall p99 exceeds this')
+    parser.add_argument('--max-error-rate', type=float, help='exit non-zero if the overall error rate exceeds this')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
+    logger.setLevel(logging.INFO)
+
+    process = None
+    if args.url:
+        base_url = args.url
+        _, population = seed_database(args.tracks, seed=args.seed, latency=0.0)
+    else:
+        context = multiprocessing.get_context('spawn')
+        messages, stop = context.Queue(), context.Event()
+        process = context.Process(target=_serve_api, args=(args.tracks, args.seed, args.db_latency_ms / 1000.0,
+                                                           not args.cold, args.server, messages, stop))
+        logger.info(f"Seeding {args.tracks} tracks and booting the API ({args.server})...")
+        process.start()
+        kind, payload = messages.get()
+        if kind == 'error':
+            logger.error(f"API failed to start: {payload}")
+            return 1
+        base_url = f"http://127.0.0.1:{payload['port']}"
+        population = payload['population']
+
+    logger.info(f"Driving traffic at {base_url} for {args.duration:.0f}s "
+                f"({f'{args.rps:g} rps' if args.rps else f'{args.concurrency} clients'})...")
+    report = drive_traffic(base_url, TrafficGenerator(population, args.mix, seed=args.seed), args.duration,
+                           concurrency=args.concurrency, rps=args.rps, warmup=args.warmup)
+    report['config'] = {key: value for key, value in vars(args).items() if key not in ('output',)}
+
+    if process is not None:
+        stop.set()
+        kind, payload = messages.get()
+        process.join(timeout=30)
+        if kind == 'stats':
+            # Queries are counted over warmup and measurement alike, so divide by every request sent
+            report['db'] = payload['db']
+            report['db_queries_per_request'] = {
+                collection: (stats.get('find', 0) + stats.get('find_one', 0)) / max(1, report['requests_sent'])
+                for collection, stats in payload['db'].items()
+            }
+
+    print(_format_table(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    overall = report['overall']
+    if args.max_p99_ms is not None and overall.get('p99_ms', 0.0) > args.max_p99_ms:
+        logger.error(f"p99 {overall['p99_ms']:.1f}ms exceeds {args.max_p99_ms:g}ms")
+        return 2
+    if args.max_error_rate is not None and overall['error_rate'] > args.max_error_rate:
+        logger.error(f"Error rate {overall['error_rate']:.2%} exceeds {args.max_error_rate:.2%}")
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
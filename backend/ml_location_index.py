@@ -0,0 +1,222 @@
+"""
+Inverted Location Index for MuzikaX Recommendations
+This module maps normalized location tokens (city, country, region) to catalog rows.
+Rows are grouped by location code into posting lists that are presorted by plays once,
+when the index is built, so a location request matches the query against the few
+distinct location values and merges the heads of already-sorted lists. When a place has
+too few tracks, the lookup widens along a region hierarchy (e.g. Kigali -> Rwanda ->
+East Africa -> Africa -> global) instead of re-ranking the whole catalog.
+"""
+
+import json
+import os
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Set
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default place -> parent region links; places not listed here take their parent from
+# the location values themselves ("Huye, Rwanda" makes Rwanda the parent of Huye)
+DEFAULT_REGION_PARENTS = {
+    'kigali': 'rwanda', 'musanze': 'rwanda', 'huye': 'rwanda', 'rubavu': 'rwanda', 'gisenyi': 'rwanda',
+    'ruhengeri': 'rwanda', 'butare': 'rwanda', 'muhanga': 'rwanda', 'rwamagana': 'rwanda',
+    'kampala': 'uganda', 'entebbe': 'uganda', 'gulu': 'uganda',
+    'nairobi': 'kenya', 'mombasa': 'kenya', 'kisumu': 'kenya',
+    'dar es salaam': 'tanzania', 'dodoma': 'tanzania', 'arusha': 'tanzania', 'zanzibar': 'tanzania',
+    'bujumbura': 'burundi', 'gitega': 'burundi',
+    'goma': 'dr congo', 'kinshasa': 'dr congo', 'bukavu': 'dr congo',
+    'juba': 'south sudan', 'addis ababa': 'ethiopia',
+    'lagos': 'nigeria', 'abuja': 'nigeria', 'accra': 'ghana', 'kumasi': 'ghana', 'dakar': 'senegal',
+    'johannesburg': 'south africa', 'cape town': 'south africa', 'durban': 'south africa',
+    'lusaka': 'zambia', 'harare': 'zimbabwe',
+    'rwanda': 'east africa', 'uganda': 'east africa', 'kenya': 'east africa', 'tanzania': 'east africa',
+    'burundi': 'east africa', 'south sudan': 'east africa', 'ethiopia': 'east africa',
+    'dr congo': 'central africa',
+    'nigeria': 'west africa', 'ghana': 'west africa', 'senegal': 'west africa',
+    'south africa': 'southern africa', 'zambia': 'southern africa', 'zimbabwe': 'southern africa',
+    'east africa': 'africa', 'central africa': 'africa', 'west africa': 'africa', 'southern africa': 'africa'
+}
+
+# Location value of tracks meant for every listener (the root of the hierarchy)
+GLOBAL_LOCATION = 'global'
+
+
+def normalize_location(value) -> str:
+    """
+    Lowercase, accent-free, single-spaced form of a location string
+    """
+    text = unicodedata.normalize('NFKD', str(value))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def location_tokens(value) -> List[str]:
+    """
+    Comma-separated parts of a location, most specific first ("Kigali, Rwanda" -> kigali, rwanda)
+    """
+    return [token for token in (part.strip() for part in normalize_location(value).split(',')) if token]
+
+
+def load_region_parents(path: Optional[str] = None) -> Dict[str, str]:
+    """
+    The region hierarchy: DEFAULT_REGION_PARENTS overlaid with the {place: parent} JSON file
+    at path (or ML_REGION_HIERARCHY); a null parent removes a link
+    """
+    parents = dict(DEFAULT_REGION_PARENTS)
+    path = path or os.getenv('ML_REGION_HIERARCHY')
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        for place, parent in overrides.items():
+            if parent is None:
+                parents.pop(normalize_location(place), None)
+            else:
+                parents[normalize_location(place)] = normalize_location(parent)
+    return parents
+
+
+class LocationIndex:
+    def __init__(self, catalog, region_parents: Optional[Dict[str, str]] = None, max_cached_queries: int = 4096,
+                 max_cached_bytes: int = 8 * 1024 * 1024):
+        """
+        Build the index over a TrackCatalog's location codes and plays
+        region_parents maps normalized places to their parent region (see load_region_parents);
+        the matched levels of up to max_cached_queries queries (and max_cached_bytes) are cached
+        """
+        self.catalog = catalog
+        n_codes = len(catalog.location_values)
+        self.normalized_values = [normalize_location(value) for value in catalog.location_values]
+
+        # Posting lists: rows grouped by location code, each group by plays (desc), then row
+        by_plays = np.lexsort((np.arange(catalog.n_tracks), -catalog.plays))
+        grouped = by_plays[np.argsort(catalog.location_codes[by_plays], kind='stable')]
+        # All rows in the same order, for the "everywhere else" fallback level
+        self.rows_by_plays = by_plays.astype(np.int64)
+        self.location_codes = catalog.location_codes
+        self.posting_rows = grouped.astype(np.int64)
+        self.posting_offsets = np.zeros(n_codes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(catalog.location_codes, minlength=n_codes), out=self.posting_offsets[1:])
+        self.plays = catalog.plays
+
+        # Place hierarchy: configured links first, then the ones implied by the values
+        self.parents = dict(region_parents if region_parents is not None else load_region_parents())
+        for value in self.normalized_values:
+            tokens = location_tokens(value)
+            for child, parent in zip(tokens, tokens[1:]):
+                self.parents.setdefault(child, parent)
+
+        # Place -> location codes of the tracks under it (the place itself or any descendant)
+        place_codes: Dict[str, Set[int]] = {}
+        for code, value in enumerate(self.normalized_values):
+            for token in location_tokens(value):
+                for place in self.ancestors(token, include_self=True):
+                    place_codes.setdefault(place, set()).add(code)
+        self.place_codes = {place: np.array(sorted(codes), dtype=np.int64) for place, codes in place_codes.items()}
+
+        self.max_cached_queries = max_cached_queries
+        self.max_cached_bytes = max_cached_bytes
+        self._levels: Dict[str, List[np.ndarray]] = {}
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def ancestors(self, place: str, include_self: bool = False) -> List[str]:
+        """
+        The chain of regions above a place, nearest first (cycles in the hierarchy are cut)
+        """
+        chain = [place] if include_self else []
+        seen = {place}
+        parent = self.parents.get(place)
+        while parent is not None and parent not in seen and parent != GLOBAL_LOCATION:
+            chain.append(parent)
+            seen.add(parent)
+            parent = self.parents.get(parent)
+        return chain
+
+    def _query_levels(self, location: str) -> List[np.ndarray]:
+        """
+        Location codes to draw from, in order: values containing the query, then each
+        region above the query's most specific known place (every other location is the
+        fallback of lookup, not a level, so cached entries stay as small as the match)
+        """
+        levels = self._levels.get(location)
+        if levels is not None:
+            return levels
+
+        query = normalize_location(location)
+        used = np.zeros(len(self.normalized_values), dtype=bool)
+        levels = []
+
+        def add_level(codes: np.ndarray):
+            codes = codes[~used[codes]]
+            if len(codes):
+                used[codes] = True
+                levels.append(codes)
+
+        # Case-insensitive substring match against the distinct values, not every track
+        add_level(np.array([code for code, value in enumerate(self.normalized_values) if query in value],
+                           dtype=np.int64))
+        places = location_tokens(query)
+        anchor = next((place for place in places if place in self.parents or place in self.place_codes), None)
+        if anchor is not None:
+            for region in self.ancestors(anchor):
+                if region in self.place_codes:
+                    add_level(self.place_codes[region])
+
+        size = sum(codes.nbytes for codes in levels)
+        with self._lock:
+            if len(self._levels) >= self.max_cached_queries or self._cached_bytes + size > self.max_cached_bytes:
+                self._levels.clear()
+                self._cached_bytes = 0
+            if size <= self.max_cached_bytes:
+                self._levels[location] = levels
+                self._cached_bytes += size
+        return levels
+
+    def _top_rows(self, codes: np.ndarray, n: int) -> np.ndarray:
+        """
+        Merge the heads (at most n rows each) of the posting lists of codes
+        """
+        starts = self.posting_offsets[codes]
+        ends = np.minimum(self.posting_offsets[codes + 1], starts + n)
+        if len(codes) == 1:
+            return self.posting_rows[starts[0]:ends[0]]
+        heads = np.concatenate([self.posting_rows[start:end] for start, end in zip(starts.tolist(), ends.tolist())])
+        order = np.lexsort((heads, -self.plays[heads]))[:n]
+        return heads[order]
+
+    def lookup(self, location: str, n: int) -> np.ndarray:
+        """
+        Up to n catalog rows for a location: tracks matching it first, then those of each
+        wider region, most played first within each level
+        """
+        rows = []
+        remaining = n
+        levels = self._query_levels(location)
+        for codes in levels:
+            if remaining <= 0:
+                break
+            level_rows = self._top_rows(codes, remaining)
+            rows.append(level_rows)
+            remaining -= len(level_rows)
+        if remaining > 0:
+            rows.append(self._top_rows_elsewhere(np.concatenate(levels) if levels else None, remaining))
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+    def _top_rows_elsewhere(self, matched_codes: Optional[np.ndarray], n: int) -> np.ndarray:
+        """
+        The n most played rows of every location outside matched_codes, scanning the global
+        plays order in growing windows (work follows n, unless the matched places dominate it)
+        """
+        if matched_codes is None or len(matched_codes) == 0:
+            return self.rows_by_plays[:n]
+        window = max(2 * n, 64)
+        while True:
+            head = self.rows_by_plays[:window]
+            head = head[~np.isin(self.location_codes[head], matched_codes)]
+            if len(head) >= n or window >= len(self.rows_by_plays):
+                return head[:n]
+            window *= 4
@@ -0,0 +1,145 @@
+"""
+Materialized Top-K Recommendations for MuzikaX
+This module precomputes the top-K collaborative recommendations of every known user
+after a training run, in parallel worker processes that each memory-map the saved
+model version, and stores them in an indexed SQLite table keyed by (user, model
+version) as compact int32 arrays of catalog rows. Serving a covered user is then a
+single primary-key lookup instead of scoring the whole catalog.
+Each entry is stamped with the prior it was ranked by and the user's event count, so
+the engine scores live once the prior is refreshed or the user has interacted since.
+"""
+
+import os
+import sqlite3
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Engine loaded once in each materialization worker process
+_worker_engine = None
+
+
+class MaterializedRecommendationStore:
+    def __init__(self, db_path: str):
+        """
+        Open (creating if needed) the SQLite store at db_path
+        Each thread gets its own connection; WAL mode lets readers run while a job writes
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS recommendations ('
+                'user_id TEXT NOT NULL, '
+                'model_version INTEGER NOT NULL, '
+                'track_rows BLOB NOT NULL, '
+                'prior_version REAL NOT NULL DEFAULT 0, '
+                'event_count INTEGER NOT NULL DEFAULT 0, '
+                'PRIMARY KEY (user_id, model_version)'
+                ') WITHOUT ROWID'
+            )
+            # Stores created before entries were stamped: their rows read as stale
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(recommendations)')}
+            for column, definition in (('prior_version', 'REAL NOT NULL DEFAULT 0'),
+                                       ('event_count', 'INTEGER NOT NULL DEFAULT 0')):
+                if column not in columns:
+                    connection.execute(f'ALTER TABLE recommendations ADD COLUMN {column} {definition}')
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        # Connections are per process too: a pre-forked worker must not reuse its parent's
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, user_id: str, model_version: int) -> Optional[Tuple[np.ndarray, float, int]]:
+        """
+        Return (ranked catalog rows, prior version, event count) materialized for the user,
+        or None if not covered
+        The prior version is the prior_refreshed_at of the catalog prior the rows were ranked
+        by, the event count the number of interactions the user had then
+        """
+        row = self._connect().execute(
+            'SELECT track_rows, prior_version, event_count FROM recommendations '
+            'WHERE user_id = ? AND model_version = ?',
+            (user_id, model_version)
+        ).fetchone()
+        return (np.frombuffer(row[0], dtype='<i4'), row[1], row[2]) if row is not None else None
+
+    def write(self, model_version: int, items: Iterable[Tuple[str, np.ndarray, float, int]]) -> int:
+        """
+        Store (user id, ranked catalog rows, prior version, event count) entries for a model
+        version in one transaction
+        """
+        records = [
+            (user_id, model_version, np.asarray(rows, dtype='<i4').tobytes(), float(prior_version), int(event_count))
+            for user_id, rows, prior_version, event_count in items
+        ]
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO recommendations '
+                '(user_id, model_version, track_rows, prior_version, event_count) VALUES (?, ?, ?, ?, ?)',
+                records
+            )
+        return len(records)
+
+    def model_versions(self) -> List[int]:
+        return [row[0] for row in self._connect().execute(
+            'SELECT DISTINCT model_version FROM recommendations ORDER BY model_version'
+        )]
+
+    def prune(self, keep: int = 3):
+        """
+        Delete everything but the newest `keep` model versions
+        """
+        stale = self.model_versions()[:-keep] if keep > 0 else self.model_versions()
+        if stale:
+            with self._connect() as connection:
+                connection.executemany('DELETE FROM recommendations WHERE model_version = ?',
+                                       [(version,) for version in stale])
+
+
+def _init_worker(model_dir: str):
+    global _worker_engine
+    # Imported here so the engine module is only loaded in the worker processes
+    from ml_recommendation_enhanced import AdvancedMLRecommendationEngine
+    _worker_engine = AdvancedMLRecommendationEngine()
+    _worker_engine.load_model(model_dir, mmap=True)
+
+
+def _materialize_chunk(user_ids: List[str], k: int) -> List[Tuple[str, np.ndarray, float, int]]:
+    # The worker's prior is the one saved with the model, so it matches the serving engine's
+    prior_version = _worker_engine.catalog.prior_refreshed_at
+    rows = _worker_engine.get_batch_recommendation_rows(user_ids, [k] * len(user_ids))
+    profiles = _worker_engine.user_profiles
+    return [(user_id, user_rows.astype(np.int32), prior_version, profiles.event_count(user_id))
+            for user_id, user_rows in zip(user_ids, rows)]
+
+
+def materialize_recommendations(model_dir: str, db_path: str, model_version: int, user_ids: List[str],
+                                k: int = 50, n_workers: Optional[int] = None, chunk_size: int = 1024,
+                                keep_versions: int = 3) -> int:
+    """
+    Compute and store the top-k recommendations of user_ids for the model saved in model_dir
+    Chunks of users are scored in a pool of n_workers processes (default: one per core)
+    Returns the number of users materialized
+    """
+    store = MaterializedRecommendationStore(db_path)
+    chunks = [user_ids[i:i + chunk_size] for i in range(0, len(user_ids), chunk_size)]
+    n_workers = max(1, min(n_workers or os.cpu_count() or 1, len(chunks)))
+
+    written = 0
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(model_dir,)) as executor:
+        for items in executor.map(_materialize_chunk, chunks, [k] * len(chunks)):
+            written += store.write(model_version, items)
+
+    store.prune(keep=keep_versions)
+    logger.info(f"Materialized top-{k} recommendations of {written} users for model version {model_version}")
+    return written
@@ -0,0 +1,221 @@
+"""
+Latency Metrics for the MuzikaX ML APIs
+This module records request, stage and engine-call latencies on the monotonic
+perf_counter clock into labelled histograms. Each series keeps cumulative buckets
+(for Prometheus' histogram_quantile) plus a window of recent samples for exact
+p50/p95/p99 in the JSON stats. Gauges and counters that already live elsewhere
+(cache and hydration counters, model version) are pulled from registered collectors
+at scrape time, and everything renders in the Prometheus text exposition format.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram families recorded by the APIs and the engine
+REQUEST_DURATION = 'ml_request_duration_seconds'
+STAGE_DURATION = 'ml_stage_duration_seconds'
+ENGINE_CALL_DURATION = 'ml_engine_call_duration_seconds'
+MODEL_LOAD_DURATION = 'ml_model_load_duration_seconds'
+
+HISTOGRAM_HELP = {
+    REQUEST_DURATION: 'End-to-end request latency by endpoint',
+    STAGE_DURATION: 'Latency of request stages (engine_init, scoring, hydration, serialization) by endpoint',
+    ENGINE_CALL_DURATION: 'Latency of recommendation engine calls by method and cache result',
+    MODEL_LOAD_DURATION: 'Time taken to load a published model version'
+}
+
+# Upper bounds in seconds, from sub-millisecond cache hits to cold starts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+# (metric name, 'counter' | 'gauge', help text, labels, value)
+Sample = Tuple[str, str, str, Dict[str, Any], float]
+
+
+def _format_labels(labels: Iterable[Tuple[str, Any]]) -> str:
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, window: int = 2048):
+        """
+        Initialize the histogram
+        buckets are increasing upper bounds in seconds (+Inf is implicit); window is the
+        number of recent samples kept for percentiles
+        """
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        # Linear scan: ~15 buckets beats bisect's call overhead here
+        index = 0
+        for bound in self.buckets:
+            if seconds <= bound:
+                break
+            index += 1
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            self.recent.append(seconds)
+
+    def percentiles(self, quantiles: Sequence[float] = DEFAULT_QUANTILES) -> Dict[str, float]:
+        """
+        Nearest-rank percentiles of the recent window, keyed 'p50', 'p95', ...
+        """
+        with self._lock:
+            samples = sorted(self.recent)
+        if not samples:
+            return {}
+        return {
+            f'p{q * 100:g}': samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+            for q in quantiles
+        }
+
+    def snapshot(self) -> Tuple[List[int], int, float]:
+        """
+        Cumulative bucket counts (ending with +Inf), count and sum
+        """
+        with self._lock:
+            counts = list(self.bucket_counts)
+            count, total = self.count, self.sum
+        cumulative, running = [], 0
+        for bucket_count in counts:
+            running += bucket_count
+            cumulative.append(running)
+        return cumulative, count, total
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, window: int = 2048):
+        self.buckets = tuple(buckets)
+        self.window = window
+        self._histograms: Dict[str, Dict[LabelKey, LatencyHistogram]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, **labels: Any) -> LatencyHistogram:
+        key = tuple(sorted((label, str(value)) for label, value in labels.items()))
+        series = self._histograms.get(name)
+        histogram = series.get(key) if series is not None else None
+        if histogram is None:
+            with self._lock:
+                series = self._histograms.setdefault(name, {})
+                histogram = series.get(key)
+                if histogram is None:
+                    histogram = series[key] = LatencyHistogram(self.buckets, self.window)
+        return histogram
+
+    def observe(self, name: str, seconds: float, **labels: Any):
+        self.histogram(name, **labels).observe(seconds)
+
+    @contextmanager
+    def time(self, name: str, **labels: Any) -> Iterator[None]:
+        """
+        Time the block on the monotonic clock (recorded even when it raises)
+        """
+        histogram = self.histogram(name, **labels)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """
+        Add a callable returning (name, type, help, labels, value) samples at scrape time
+        """
+        self._collectors.append(collector)
+
+    def percentiles(self, name: str, quantiles: Sequence[float] = DEFAULT_QUANTILES) -> Dict[str, Dict[str, float]]:
+        """
+        Recent percentiles and totals of every series of a histogram, keyed by their labels
+        """
+        with self._lock:
+            series = list(self._histograms.get(name, {}).items())
+        result = {}
+        for key, histogram in series:
+            _, count, total = histogram.snapshot()
+            label = ','.join(f'{label}={value}' for label, value in key) or 'all'
+            result[label] = dict(histogram.percentiles(quantiles), count=count, mean=total / count if count else 0.0)
+        return result
+
+    def render_prometheus(self) -> str:
+        """
+        All histograms and collected samples in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            histograms = {name: list(series.items()) for name, series in self._histograms.items()}
+        for name, series in sorted(histograms.items()):
+            lines.append(f'# HELP {name} {HISTOGRAM_HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, histogram in sorted(series, key=lambda item: item[0]):
+                cumulative, count, total = histogram.snapshot()
+                for bound, bucket_count in zip(self.buckets + (math.inf,), cumulative):
+                    lines.append(f'{name}_bucket{_format_labels(key + (("le", _format_value(bound)),))} {bucket_count}')
+                lines.append(f'{name}_sum{_format_labels(key)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(key)} {count}')
+
+        families: Dict[str, Tuple[str, str, List[Tuple[Dict[str, Any], float]]]] = {}
+        for collector in list(self._collectors):
+            try:
+                for name, kind, help_text, labels, value in collector():
+                    families.setdefault(name, (kind, help_text, []))[2].append((labels, value))
+            except Exception as e:
+                # A broken collector must not take the whole scrape down
+                logger.error(f"Metrics collector failed: {e}")
+        for name, (kind, help_text, samples) in families.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide registry shared by the API and the engines it swaps in (each pre-forked
+# worker has its own)
+REGISTRY = MetricsRegistry()
+
+
+def time_stage(endpoint: str, stage: str):
+    return REGISTRY.time(STAGE_DURATION, endpoint=endpoint, stage=stage)
+
+
+def cache_samples(prefix: str, stats: Dict[str, Any], help_subject: str) -> List[Sample]:
+    """
+    Hit/miss counters and hit ratio per key family from RecommendationCache.get_stats()
+    """
+    samples = []
+    for family, family_stats in stats.get('families', {}).items():
+        for result, field in (('hit', 'hits'), ('miss', 'misses')):
+            samples.append((f'{prefix}_requests_total', 'counter', f'{help_subject} lookups by key family and result',
+                            {'family': family, 'result': result}, family_stats[field]))
+        samples.append((f'{prefix}_hit_ratio', 'gauge', f'{help_subject} hit ratio by key family',
+                        {'family': family}, family_stats['hit_ratio']))
+    samples.append((f'{prefix}_entries', 'gauge', f'{help_subject} entries', {}, stats.get('entries', 0)))
+    return samples
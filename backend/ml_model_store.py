@@ -0,0 +1,268 @@
+"""
+Versioned Model Artifact Store for MuzikaX Recommendations
+This module saves a trained model as a directory of NumPy .npy arrays (features,
+embeddings, clusters, indexes) that can be memory-mapped read-only at load time,
+plus a small pickle of the fitted sklearn objects and a JSON manifest holding the
+schema version and a SHA-256 checksum of every file. Loading is near-instant and
+several processes mapping the same files share one copy in the page cache.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+MODEL_SCHEMA_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+OBJECTS_FILE = 'objects.pkl'
+CURRENT_FILE = 'CURRENT'  # Names the published version directory under a model root
+VERSIONS_DIR = 'versions'
+
+
+class ModelArtifactError(Exception):
+    """Raised when a model directory is missing, incompatible or corrupted"""
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_model_artifacts(model_dir: str, arrays: Dict[str, np.ndarray], objects: Dict[str, Any],
+                         metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Write arrays as .npy files, objects as one pickle, and the manifest last
+    Object-dtype arrays (e.g. track ids) are stored as fixed-width strings so they can be mapped
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    manifest = {
+        'schema_version': MODEL_SCHEMA_VERSION,
+        'created_at': datetime.utcnow().isoformat() + 'Z',
+        'metadata': metadata or {},
+        'arrays': {},
+        'objects': {}
+    }
+
+    for name, array in arrays.items():
+        if array is None:
+            continue
+        array = np.asarray(array)
+        if array.dtype == object:
+            array = array.astype(str)
+        filename = f'{name}.npy'
+        path = os.path.join(model_dir, filename)
+        np.save(path, np.ascontiguousarray(array), allow_pickle=False)
+        manifest['arrays'][name] = {
+            'file': filename,
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'sha256': _sha256(path)
+        }
+
+    objects_path = os.path.join(model_dir, OBJECTS_FILE)
+    with open(objects_path, 'wb') as f:
+        pickle.dump(objects, f, protocol=pickle.HIGHEST_PROTOCOL)
+    manifest['objects'] = {'file': OBJECTS_FILE, 'sha256': _sha256(objects_path)}
+
+    # Write the manifest atomically so a reader never sees a half-written model
+    manifest_path = os.path.join(model_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def load_model_artifacts(model_dir: str, mmap: bool = True,
+                         verify: bool = False) -> Tuple[Dict[str, np.ndarray], Dict[str, Any], Dict[str, Any]]:
+    """
+    Load (arrays, objects, manifest) from a model directory
+    Arrays are memory-mapped read-only unless mmap is False; verify checks every checksum
+    """
+    manifest_path = os.path.join(model_dir, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        raise FileNotFoundError(f"No model manifest found at {manifest_path}")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    if manifest.get('schema_version') != MODEL_SCHEMA_VERSION:
+        raise ModelArtifactError(
+            f"Model schema version {manifest.get('schema_version')} is not supported "
+            f"(expected {MODEL_SCHEMA_VERSION})"
+        )
+
+    def check(path: str, expected: str):
+        if verify and _sha256(path) != expected:
+            raise ModelArtifactError(f"Checksum mismatch for {path}")
+
+    arrays = {}
+    for name, entry in manifest['arrays'].items():
+        path = os.path.join(model_dir, entry['file'])
+        check(path, entry['sha256'])
+        array = np.load(path, mmap_mode='r' if mmap else None, allow_pickle=False)
+        if list(array.shape) != entry['shape'] or array.dtype.str != entry['dtype']:
+            raise ModelArtifactError(f"Array {name} does not match the manifest")
+        arrays[name] = array
+
+    objects_path = os.path.join(model_dir, manifest['objects']['file'])
+    check(objects_path, manifest['objects']['sha256'])
+    with open(objects_path, 'rb') as f:
+        objects = pickle.load(f)
+
+    return arrays, objects, manifest
+
+
+def version_dir(model_root: str, model_version: int) -> str:
+    """
+    Directory holding one published model version under model_root
+    """
+    return os.path.join(model_root, VERSIONS_DIR, f'v{model_version}')
+
+
+def publish_model_version(model_root: str, model_version: int):
+    """
+    Point model_root's CURRENT file at a saved version (atomic rename, so readers
+    see either the old or the new version, never a partial one)
+    """
+    path = os.path.join(model_root, CURRENT_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(os.path.relpath(version_dir(model_root, model_version), model_root))
+    os.replace(tmp_path, path)
+
+
+def resolve_published_model(model_root: str) -> Optional[str]:
+    """
+    Return the directory of the currently published model, or None if there is none
+    A root holding a manifest itself (saved before versioning) is returned as-is
+    """
+    try:
+        with open(os.path.join(model_root, CURRENT_FILE)) as f:
+            return os.path.join(model_root, f.read().strip())
+    except FileNotFoundError:
+        return model_root if os.path.isfile(os.path.join(model_root, MANIFEST_FILE)) else None
+
+
+def prune_model_versions(model_root: str, keep: int = 3):
+    """
+    Delete all but the newest `keep` version directories, never the published one
+    Processes still mapping a deleted version keep their (unlinked) files until they reload
+    """
+    versions_root = os.path.join(model_root, VERSIONS_DIR)
+    if not os.path.isdir(versions_root):
+        return
+    published = resolve_published_model(model_root)
+    versions = sorted(
+        (name for name in os.listdir(versions_root) if name.startswith('v') and name[1:].isdigit()),
+        key=lambda name: int(name[1:])
+    )
+    for name in versions[:-keep] if keep > 0 else versions:
+        path = os.path.join(versions_root, name)
+        if published is None or os.path.abspath(path) != os.path.abspath(published):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def detach_arrays(obj: Any, attributes: Iterable[str], prefix: str,
+                  drop: Iterable[str] = ()) -> Tuple[Dict[str, np.ndarray], Any]:
+    """
+    Split an object into its large array attributes and a lightweight shallow copy without them
+    Attributes in drop (e.g. lookups rebuilt at load time) are cleared from the copy too
+    """
+    shell = copy.copy(obj)
+    arrays = {}
+    for attribute in attributes:
+        arrays[f'{prefix}.{attribute}'] = getattr(obj, attribute)
+        setattr(shell, attribute, None)
+    for attribute in drop:
+        setattr(shell, attribute, None)
+    return arrays, shell
+
+
+def attach_arrays(shell: Any, arrays: Dict[str, np.ndarray], attributes: Iterable[str], prefix: str) -> Any:
+    """
+    Put arrays saved by detach_arrays back onto the lightweight object
+    """
+    for attribute in attributes:
+        setattr(shell, attribute, arrays.get(f'{prefix}.{attribute}'))
+    return shell
+
+
+def _encode_strings(values: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Strings as one UTF-8 byte array plus int64 offsets (string i is data[offsets[i]:offsets[i + 1]]),
+    compact for long, varied values such as titles where fixed-width strings pad every entry
+    """
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_strings(data: np.ndarray, offsets: np.ndarray) -> list:
+    raw = np.asarray(data).tobytes()
+    bounds = np.asarray(offsets).tolist()
+    return [raw[start:end].decode('utf-8') for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def frame_to_arrays(frame: pd.DataFrame, prefix: str) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Store a DataFrame column by column: numeric and datetime columns as-is, nullable
+    integers as values plus a missing-value mask, and everything else as int32
+    categorical codes plus its offset-encoded categories (arrays too, never pickled)
+    """
+    arrays = {}
+    layout = {'columns': [], 'categories': {}, 'encoded': [], 'masked': []}
+    for column in frame.columns:
+        values = frame[column]
+        key = f'{prefix}.{column}'
+        layout['columns'].append(column)
+        if isinstance(values.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(values):
+            arrays[key] = values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)
+            arrays[f'{key}.mask'] = values.isna().to_numpy()
+            layout['masked'].append(column)
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            if values.dt.tz is not None:
+                values = values.dt.tz_convert(None)
+            arrays[key] = values.to_numpy(dtype='datetime64[ns]')
+        elif pd.api.types.is_numeric_dtype(values):
+            arrays[key] = values.to_numpy()
+        else:
+            categorical = pd.Categorical(values.map(lambda v: v if pd.isna(v) else str(v)))
+            arrays[key] = categorical.codes.astype(np.int32)
+            arrays[f'{key}.categories.data'], arrays[f'{key}.categories.offsets'] = \
+                _encode_strings(categorical.categories)
+            layout['encoded'].append(column)
+    return arrays, layout
+
+
+def frame_from_arrays(arrays: Dict[str, np.ndarray], layout: Dict[str, Any], prefix: str) -> pd.DataFrame:
+    """
+    Rebuild a DataFrame saved with frame_to_arrays
+    """
+    columns = {}
+    for column in layout['columns']:
+        values = arrays[f'{prefix}.{column}']
+        if column in layout.get('encoded', ()):
+            categories = _decode_strings(arrays[f'{prefix}.{column}.categories.data'],
+                                         arrays[f'{prefix}.{column}.categories.offsets'])
+            columns[column] = pd.Categorical.from_codes(np.asarray(values), categories)
+        elif column in layout['categories']:
+            # Saved before categories were stored as arrays
+            columns[column] = pd.Categorical.from_codes(np.asarray(values), layout['categories'][column])
+        elif column in layout.get('masked', ()):
+            columns[column] = pd.arrays.IntegerArray(np.asarray(values), np.asarray(arrays[f'{prefix}.{column}.mask']))
+        else:
+            columns[column] = values
+    return pd.DataFrame(columns)
@@ -0,0 +1,125 @@
+"""
+Pre-fork Multi-process Server for the MuzikaX ML API
+This module serves a WSGI app from N forked worker processes that accept connections
+on one shared listening socket. The model is loaded once in the master before forking,
+so its memory-mapped arrays are shared by every worker (copy-on-write), and each worker
+pins its BLAS/OpenMP thread pools so N workers do not oversubscribe the cores.
+NumPy/pandas scoring then scales across cores instead of being GIL-bound in one process.
+"""
+
+import gc
+import os
+import signal
+import socket
+import time
+from typing import Callable, Dict, Optional
+import logging
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+# Environment variables read by the common BLAS / OpenMP runtimes
+BLAS_THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS'
+)
+
+
+def pin_blas_threads(n_threads: int = 1):
+    """
+    Limit BLAS/OpenMP thread pools in this process
+    Environment variables cover libraries loaded later, threadpoolctl the ones already loaded
+    """
+    for name in BLAS_THREAD_ENV_VARS:
+        os.environ[name] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=n_threads)
+    except ImportError:
+        logger.warning("threadpoolctl not installed, BLAS thread pools only limited through environment")
+
+
+def serve_prefork(app, host: str, port: int, workers: int, blas_threads: int = 1,
+                  threaded: bool = True, on_worker_start: Optional[Callable[[int], None]] = None):
+    """
+    Serve app from `workers` forked processes sharing one listening socket
+    Call after the model is loaded so workers inherit it. Crashed workers are respawned;
+    SIGINT/SIGTERM stop every worker. Falls back to a single process where fork is unavailable.
+    """
+    if not hasattr(os, 'fork'):
+        logger.warning("os.fork is not available on this platform, serving from a single process")
+        app.run(debug=False, host=host, port=port, threaded=True)
+        return
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(1024)
+    listener.set_inheritable(True)
+
+    # Move everything allocated so far out of the GC's reach so collections in the
+    # workers do not touch (and copy) the pages shared with the master
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    children: Dict[int, int] = {}
+    shutting_down = False
+
+    def run_worker(worker_id: int):
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        pin_blas_threads(blas_threads)
+        if on_worker_start is not None:
+            on_worker_start(worker_id)
+        server = make_server(host, port, app, threaded=threaded, fd=listener.fileno())
+        logger.info(f"Worker {worker_id} (pid {os.getpid()}) serving on {host}:{port}")
+        server.serve_forever()
+
+    def spawn(worker_id: int):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                run_worker(worker_id)
+            except BaseException as e:
+                logger.error(f"Worker {worker_id} exited with error: {e}")
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        children[pid] = worker_id
+
+    def stop(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+    logger.info(f"Pre-fork server listening on {host}:{port} with {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker_id = children.pop(pid, None)
+        if worker_id is not None and not shutting_down:
+            logger.warning(f"Worker {worker_id} (pid {pid}) exited with status {status}, respawning")
+            time.sleep(1)  # Avoid a tight respawn loop if workers crash on start
+            spawn(worker_id)
+
+    listener.close()
@@ -0,0 +1,520 @@
+"""
+Compact User Profile Store for MuzikaX Recommendations
+This module keeps user preference profiles in typed arrays instead of per-user dicts.
+Genre, creator and location values are integer-coded through shared vocabularies, each
+user's preference weights form one row of a CSR matrix per field (recent updates sit in
+a fixed-size append log that is merged in when it fills up), and the recent listening
+history is a fixed-size ring buffer of track codes and epoch timestamps per user. A
+profile stays around a kilobyte however active the user is, and the whole store saves
+to plain arrays instead of a pickle of nested dicts.
+"""
+
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Preference fields of a profile (the keys of the dict-based profiles this store replaces)
+PROFILE_FIELDS = ('genres', 'creators', 'locations')
+
+_EMPTY_CODES = np.empty(0, dtype=np.int32)
+_EMPTY_WEIGHTS = np.empty(0, dtype=np.float64)
+
+
+# History times are stored as uint32 epoch seconds (1970 to 2106)
+MAX_EPOCH_SECONDS = 2**32 - 1
+
+
+def parse_timestamp(value: Any) -> Optional[int]:
+    """
+    Convert an interaction timestamp (datetime, ISO string or epoch number in seconds,
+    milliseconds, microseconds or nanoseconds) to epoch seconds
+    Returns None for unparseable values and times outside the storable range
+    """
+    if isinstance(value, datetime):
+        seconds = value.timestamp()
+    elif isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool):
+        seconds = float(value)
+        # Sub-second units (JavaScript Date.now() milliseconds, µs, ns) are scaled down
+        for limit, scale in ((1e17, 1e9), (1e14, 1e6), (1e11, 1e3)):
+            if abs(seconds) > limit:
+                seconds /= scale
+                break
+    elif isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        seconds = parsed.replace(tzinfo=parsed.tzinfo or timezone.utc).timestamp()
+    else:
+        return None
+    if not np.isfinite(seconds) or seconds < 0 or seconds > MAX_EPOCH_SECONDS:
+        return None
+    return int(seconds)
+
+
+def _epoch_seconds(value: Any) -> int:
+    """
+    parse_timestamp for the history ring: missing, unparseable or out-of-range
+    timestamps count as now
+    """
+    seconds = parse_timestamp(value)
+    return int(time.time()) if seconds is None else seconds
+
+
+def _concatenated_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Positions start, start + 1, ..., start + length - 1 of every range, concatenated
+    """
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(total)
+
+
+class _FieldWeights:
+    """
+    One field's weights: a CSR matrix (users x codes) plus the log of updates appended since
+    it was built. Merging replaces the whole object, so a reader holding one sees a
+    consistent matrix and log
+    """
+    __slots__ = ('indptr', 'indices', 'data', 'log_rows', 'log_codes', 'log_weights', 'log_size')
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, log_capacity: int):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.log_rows = np.empty(log_capacity, dtype=np.int32)
+        self.log_codes = np.empty(log_capacity, dtype=np.int32)
+        self.log_weights = np.empty(log_capacity, dtype=np.float64)
+        self.log_size = 0
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.indptr) - 1
+
+    def row(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Codes and weights of one row, log entries included (summed in arrival order)
+        """
+        if row < self.n_rows:
+            start, end = self.indptr[row], self.indptr[row + 1]
+            codes, weights = self.indices[start:end], self.data[start:end]
+        else:
+            codes, weights = _EMPTY_CODES, _EMPTY_WEIGHTS
+        # Read the size first: the writer fills a slot before publishing it
+        size = self.log_size
+        if size:
+            hits = np.flatnonzero(self.log_rows[:size] == row)
+            if len(hits):
+                codes = np.concatenate([codes, self.log_codes[hits]])
+                unique_codes, inverse = np.unique(codes, return_inverse=True)
+                # bincount adds in input order: the merged weight first, then each update
+                weights = np.bincount(inverse, weights=np.concatenate([weights, self.log_weights[hits]]),
+                                      minlength=len(unique_codes))
+                codes = unique_codes.astype(np.int32)
+        return codes, weights
+
+    def merged(self, n_rows: int) -> '_FieldWeights':
+        """
+        A new CSR matrix with n_rows rows holding the log folded into this one (empty log)
+        Only the rows the log touches are searched; the rest of the matrix is copied
+        """
+        size = self.log_size
+        log_rows = self.log_rows[:size].astype(np.int64)
+        log_codes = self.log_codes[:size]
+        log_weights = self.log_weights[:size]
+
+        # Distinct (row, code) pairs of the log in row-major order; lexsort is stable,
+        # so each pair's updates stay in arrival order
+        order = np.lexsort((log_codes, log_rows))
+        log_keys = (log_rows[order] << 32) | log_codes[order].astype(np.int64)
+        first = np.ones(size, dtype=bool)
+        first[1:] = log_keys[1:] != log_keys[:-1]
+        groups = np.cumsum(first) - 1
+        pair_keys = log_keys[first]
+        pair_rows = (pair_keys >> 32).astype(np.int64)
+
+        # Locate the pairs in the rows of the matrix they touch (codes are sorted within a row)
+        n_old_rows = self.n_rows
+        touched = np.unique(pair_rows[pair_rows < n_old_rows])
+        segment_lengths = self.indptr[touched + 1] - self.indptr[touched]
+        positions = _concatenated_ranges(self.indptr[touched], segment_lengths)
+        segment_keys = (np.repeat(touched, segment_lengths) << 32) | self.indices[positions].astype(np.int64)
+        found_at = np.searchsorted(segment_keys, pair_keys)
+        found = found_at < len(segment_keys)
+        found[found] = segment_keys[found_at[found]] == pair_keys[found]
+
+        # Sum each pair starting from its merged weight, then its updates in arrival order
+        found_pairs = np.flatnonzero(found)
+        sums = np.bincount(
+            np.concatenate([found_pairs, groups]),
+            weights=np.concatenate([self.data[positions[found_at[found]]], log_weights[order]]),
+            minlength=len(pair_keys)
+        )
+        data = self.data.copy()
+        data[positions[found_at[found]]] = sums[found]
+
+        # Insert the new pairs at their sorted place within their row
+        new_pairs = ~found
+        new_rows = pair_rows[new_pairs]
+        segment_offsets = np.cumsum(segment_lengths) - segment_lengths
+        insert_at = np.full(len(new_rows), len(self.indices), dtype=np.int64)
+        in_old_rows = new_rows < n_old_rows
+        rank = np.searchsorted(touched, new_rows[in_old_rows])
+        insert_at[in_old_rows] = (self.indptr[new_rows[in_old_rows]] +
+                                  found_at[new_pairs][in_old_rows] - segment_offsets[rank])
+        indices = np.insert(self.indices, insert_at, (pair_keys[new_pairs] & 0xFFFFFFFF).astype(np.int32))
+        data = np.insert(data, insert_at, sums[new_pairs])
+
+        row_lengths = np.zeros(n_rows, dtype=np.int64)
+        row_lengths[:n_old_rows] = np.diff(self.indptr)
+        row_lengths += np.bincount(new_rows, minlength=n_rows)
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=indptr[1:])
+        return _FieldWeights(indptr, indices.astype(np.int32), data.astype(np.float64), len(self.log_rows))
+
+
+class UserProfileStore:
+    def __init__(self, history_size: int = 64, log_capacity: int = 65536):
+        """
+        Initialize an empty store
+        history_size is the number of recent interactions kept per user; log_capacity is
+        the number of preference updates buffered per field before they are merged
+        """
+        self.history_size = history_size
+        self.log_capacity = log_capacity
+        self.user_rows: Dict[str, int] = {}
+        self.user_ids: List[str] = []
+        self.vocabularies: Dict[str, Dict[str, int]] = {field: {} for field in PROFILE_FIELDS}
+        self.values: Dict[str, List[str]] = {field: [] for field in PROFILE_FIELDS}
+        self.track_vocabulary: Dict[str, int] = {}
+        self.track_ids: List[str] = []
+        self._weights = {field: self._empty_weights() for field in PROFILE_FIELDS}
+        # Ring buffers: row u holds user u's last history_size track codes and uint32 epoch
+        # seconds, and event_counts[u] the number of interactions recorded (the next slot is
+        # count % history_size)
+        self.recent_tracks = np.zeros((0, history_size), dtype=np.int32)
+        self.recent_times = np.zeros((0, history_size), dtype=np.uint32)
+        self.event_counts = np.zeros(0, dtype=np.int64)
+        # Loaded ring buffers stay read-only memory maps: a write copies only the row it
+        # touches into the overlay (store row -> overlay row), where new users live too
+        self._ring_writable = True
+        self._overlay_rows: Dict[int, int] = {}
+        self._overlay_tracks = np.zeros((0, history_size), dtype=np.int32)
+        self._overlay_times = np.zeros((0, history_size), dtype=np.uint32)
+        self._overlay_counts = np.zeros(0, dtype=np.int64)
+        # Field -> (vocabulary, number of values mapped, store code -> vocabulary code)
+        self._code_maps: Dict[str, Tuple[Dict[str, int], int, np.ndarray]] = {}
+        self._code_map_lock = threading.Lock()
+
+    def _empty_weights(self) -> _FieldWeights:
+        return _FieldWeights(np.zeros(1, dtype=np.int64), _EMPTY_CODES, _EMPTY_WEIGHTS, self.log_capacity)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self.user_rows
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.user_ids))
+
+    def _grown_rings(self, tracks: np.ndarray, times: np.ndarray, counts: np.ndarray,
+                     n_rows: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Copies of ring arrays with room for at least n_rows rows (capacity doubles)
+        """
+        capacity = max(n_rows, 2 * len(counts), 1024)
+        grown = (np.zeros((capacity, self.history_size), dtype=np.int32),
+                 np.zeros((capacity, self.history_size), dtype=np.uint32),
+                 np.zeros(capacity, dtype=np.int64))
+        n_old = len(counts)
+        grown[0][:n_old] = tracks
+        grown[1][:n_old] = times
+        grown[2][:n_old] = counts
+        return grown
+
+    def _grow_rings(self, n_users: int):
+        # Loaded (read-only) rings are never grown: new users go to the overlay
+        if self._ring_writable and n_users > len(self.event_counts):
+            self.recent_tracks, self.recent_times, self.event_counts = self._grown_rings(
+                self.recent_tracks, self.recent_times, self.event_counts, n_users)
+
+    def _ring(self, row: int) -> Optional[Tuple[np.ndarray, np.ndarray, int]]:
+        """
+        A user's (track codes, times, event count) ring row, or None if it has no history
+        """
+        overlay_row = self._overlay_rows.get(row)
+        if overlay_row is not None:
+            return (self._overlay_tracks[overlay_row], self._overlay_times[overlay_row],
+                    int(self._overlay_counts[overlay_row]))
+        if row < len(self.event_counts):
+            return self.recent_tracks[row], self.recent_times[row], int(self.event_counts[row])
+        return None
+
+    def _writable_ring(self, row: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """
+        (track codes, times, counts, row) arrays to write a user's ring row to; on loaded
+        rings the row is first copied into the overlay (callers serialize writes)
+        """
+        if self._ring_writable:
+            return self.recent_tracks, self.recent_times, self.event_counts, row
+        overlay_row = self._overlay_rows.get(row)
+        if overlay_row is None:
+            overlay_row = len(self._overlay_rows)
+            if overlay_row >= len(self._overlay_counts):
+                self._overlay_tracks, self._overlay_times, self._overlay_counts = self._grown_rings(
+                    self._overlay_tracks, self._overlay_times, self._overlay_counts, overlay_row + 1)
+            if row < len(self.event_counts):
+                self._overlay_tracks[overlay_row] = self.recent_tracks[row]
+                self._overlay_times[overlay_row] = self.recent_times[row]
+                self._overlay_counts[overlay_row] = self.event_counts[row]
+            # Published once filled, so readers never see a half-copied row
+            self._overlay_rows[row] = overlay_row
+        return self._overlay_tracks, self._overlay_times, self._overlay_counts, overlay_row
+
+    def add_user(self, user_id: str) -> int:
+        """
+        Return the row of a user, adding an empty profile if needed (callers serialize writes)
+        """
+        row = self.user_rows.get(user_id)
+        if row is None:
+            row = len(self.user_ids)
+            self._grow_rings(row + 1)
+            self.user_ids.append(user_id)
+            self.user_rows[user_id] = row
+        return row
+
+    def _code(self, vocabulary: Dict[str, int], values: List[str], value: str) -> int:
+        code = vocabulary.get(value)
+        if code is None:
+            code = vocabulary[value] = len(values)
+            values.append(value)
+        return code
+
+    def add_weight(self, field: str, row: int, value: str, weight: float):
+        """
+        Add weight to a user's preference for a genre, creator or location (O(1) amortized)
+        """
+        code = self._code(self.vocabularies[field], self.values[field], str(value))
+        weights = self._weights[field]
+        if weights.log_size == len(weights.log_rows):
+            weights = self._weights[field] = weights.merged(len(self.user_ids))
+        slot = weights.log_size
+        weights.log_rows[slot] = row
+        weights.log_codes[slot] = code
+        weights.log_weights[slot] = weight
+        weights.log_size = slot + 1
+
+    def add_history(self, row: int, track_id: str, timestamp: Any = None):
+        """
+        Push an interaction onto a user's recent-history ring buffer
+        """
+        track_code = self._code(self.track_vocabulary, self.track_ids, str(track_id))
+        recent_tracks, recent_times, event_counts, ring_row = self._writable_ring(row)
+        count = event_counts[ring_row]
+        slot = count % self.history_size
+        recent_tracks[ring_row, slot] = track_code
+        recent_times[ring_row, slot] = _epoch_seconds(timestamp)
+        event_counts[ring_row] = count + 1
+
+    def record(self, user_id: str, track_id: Optional[str], timestamp: Any = None, weight: float = 1.0,
+               values: Optional[Dict[str, str]] = None) -> int:
+        """
+        Record one interaction: values maps each preference field to the track's value
+        (None when the track is unknown, which only updates the history)
+        Returns the user's row
+        """
+        row = self.add_user(user_id)
+        if values:
+            for field, value in values.items():
+                self.add_weight(field, row, value, weight)
+        if track_id is not None:
+            self.add_history(row, track_id, timestamp)
+        return row
+
+    def compact(self):
+        """
+        Merge every field's update log into its CSR matrix (callers serialize writes)
+        """
+        for field in PROFILE_FIELDS:
+            weights = self._weights[field]
+            if weights.log_size or weights.n_rows != len(self.user_ids):
+                self._weights[field] = weights.merged(len(self.user_ids))
+
+    def weights(self, field: str, user_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        A user's (store codes, weights) for a field; empty arrays for unknown users
+        """
+        row = self.user_rows.get(user_id)
+        if row is None:
+            return _EMPTY_CODES, _EMPTY_WEIGHTS
+        return self._weights[field].row(row)
+
+    def preferences(self, field: str, user_id: str) -> Dict[str, float]:
+        """
+        A user's {value: weight} preferences for a field
+        """
+        codes, weights = self.weights(field, user_id)
+        values = self.values[field]
+        return {values[code]: float(weight) for code, weight in zip(codes.tolist(), weights.tolist())}
+
+    def _code_map(self, field: str, vocabulary: Dict[str, int]) -> np.ndarray:
+        """
+        Store code -> vocabulary code (-1 where the value is missing), cached per vocabulary
+        """
+        values = self.values[field]
+        cached = self._code_maps.get(field)
+        if cached is not None and cached[0] is vocabulary and cached[1] == len(values):
+            return cached[2]
+        with self._code_map_lock:
+            n_values = len(values)
+            code_map = np.fromiter((vocabulary.get(value, -1) for value in values[:n_values]),
+                                   dtype=np.int64, count=n_values)
+            # Keep a reference to the vocabulary so the identity check stays valid
+            self._code_maps[field] = (vocabulary, n_values, code_map)
+        return code_map
+
+    def preference_vector(self, field: str, user_id: str, vocabulary: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        A user's (codes, weights) for a field translated into another vocabulary's codes
+        (e.g. the catalog's), dropping values that vocabulary does not have
+        """
+        codes, weights = self.weights(field, user_id)
+        if len(codes) == 0:
+            return codes.astype(np.int64), weights
+        mapped = self._code_map(field, vocabulary)[codes]
+        known = mapped >= 0
+        return mapped[known], weights[known]
+
+    def recent_history(self, user_id: str) -> Tuple[List[str], np.ndarray]:
+        """
+        A user's recent track ids and epoch timestamps, oldest first
+        """
+        row = self.user_rows.get(user_id)
+        ring = self._ring(row) if row is not None else None
+        if ring is None:
+            return [], np.empty(0, dtype=np.uint32)
+        recent_tracks, recent_times, count = ring
+        n = min(count, self.history_size)
+        slots = np.arange(count - n, count) % self.history_size
+        track_ids = self.track_ids
+        return [track_ids[code] for code in recent_tracks[slots].tolist()], recent_times[slots]
+
+    def recent_track_ids(self, user_id: str) -> List[str]:
+        return self.recent_history(user_id)[0]
+
+    def event_count(self, user_id: str) -> int:
+        """
+        Number of interactions recorded for a user (0 for an unknown user)
+        """
+        row = self.user_rows.get(user_id)
+        ring = self._ring(row) if row is not None else None
+        return ring[2] if ring is not None else 0
+
+    def nbytes(self) -> int:
+        """
+        Bytes of array state held for the current users: ring buffer rows, CSR rows and
+        pending log entries (spare capacity, vocabularies and id maps excluded)
+        """
+        n_users = len(self.user_ids)
+        # Loaded rings hold their saved rows plus the overlay rows
+        n_ring_rows = n_users if self._ring_writable else len(self.event_counts) + len(self._overlay_rows)
+        total = n_ring_rows * (self.recent_tracks.itemsize + self.recent_times.itemsize) * self.history_size
+        total += n_ring_rows * self.event_counts.itemsize
+        for weights in self._weights.values():
+            total += weights.indptr.nbytes + weights.indices.nbytes + weights.data.nbytes
+            total += weights.log_size * (weights.log_rows.itemsize + weights.log_codes.itemsize +
+                                         weights.log_weights.itemsize)
+        return total
+
+    def get_stats(self) -> Dict[str, Any]:
+        n_users = len(self.user_ids)
+        nbytes = self.nbytes()
+        return {
+            'users': n_users,
+            'vocabulary_sizes': {field: len(values) for field, values in self.values.items()},
+            'tracks_seen': len(self.track_ids),
+            'history_size': self.history_size,
+            'array_bytes': nbytes,
+            'array_bytes_per_user': nbytes / n_users if n_users else 0.0
+        }
+
+    def to_arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        """
+        The store as named arrays for the model store (merges pending updates first)
+        """
+        self.compact()
+        n_users = len(self.user_ids)
+        recent_tracks, recent_times, event_counts = self.recent_tracks, self.recent_times, self.event_counts
+        if not self._ring_writable:
+            # Saved rows with the overlay rows written over them
+            recent_tracks, recent_times, event_counts = self._grown_rings(
+                recent_tracks, recent_times, event_counts, n_users)
+            rows = np.fromiter(self._overlay_rows.keys(), dtype=np.int64, count=len(self._overlay_rows))
+            overlay_rows = np.fromiter(self._overlay_rows.values(), dtype=np.int64, count=len(self._overlay_rows))
+            recent_tracks[rows] = self._overlay_tracks[overlay_rows]
+            recent_times[rows] = self._overlay_times[overlay_rows]
+            event_counts[rows] = self._overlay_counts[overlay_rows]
+        arrays = {
+            f'{prefix}.user_ids': np.array(self.user_ids, dtype=object),
+            f'{prefix}.track_ids': np.array(self.track_ids, dtype=object),
+            f'{prefix}.recent_tracks': recent_tracks[:n_users],
+            f'{prefix}.recent_times': recent_times[:n_users],
+            f'{prefix}.event_counts': event_counts[:n_users]
+        }
+        for field in PROFILE_FIELDS:
+            weights = self._weights[field]
+            arrays[f'{prefix}.{field}.values'] = np.array(self.values[field], dtype=object)
+            arrays[f'{prefix}.{field}.indptr'] = weights.indptr
+            arrays[f'{prefix}.{field}.indices'] = weights.indices
+            arrays[f'{prefix}.{field}.data'] = weights.data
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], prefix: str, log_capacity: int = 65536) -> 'UserProfileStore':
+        """
+        Rebuild a store saved by to_arrays; the (possibly memory-mapped) arrays are used in place
+        """
+        recent_tracks = arrays[f'{prefix}.recent_tracks']
+        store = cls(history_size=recent_tracks.shape[1], log_capacity=log_capacity)
+        store.user_ids = arrays[f'{prefix}.user_ids'].tolist()
+        store.user_rows = {user_id: row for row, user_id in enumerate(store.user_ids)}
+        store.track_ids = arrays[f'{prefix}.track_ids'].tolist()
+        store.track_vocabulary = {track_id: code for code, track_id in enumerate(store.track_ids)}
+        store.recent_tracks = recent_tracks
+        store.recent_times = arrays[f'{prefix}.recent_times']
+        store.event_counts = arrays[f'{prefix}.event_counts']
+        store._ring_writable = False
+        for field in PROFILE_FIELDS:
+            store.values[field] = arrays[f'{prefix}.{field}.values'].tolist()
+            store.vocabularies[field] = {value: code for code, value in enumerate(store.values[field])}
+            store._weights[field] = _FieldWeights(
+                arrays[f'{prefix}.{field}.indptr'], arrays[f'{prefix}.{field}.indices'],
+                arrays[f'{prefix}.{field}.data'], log_capacity
+            )
+        return store
+
+    @classmethod
+    def from_profiles(cls, profiles: Dict[str, Dict], history_size: int = 64) -> 'UserProfileStore':
+        """
+        Convert the dict-based profiles saved by earlier versions
+        """
+        store = cls(history_size=history_size)
+        for user_id, profile in profiles.items():
+            row = store.add_user(user_id)
+            for field in PROFILE_FIELDS:
+                for value, weight in profile.get(field, {}).items():
+                    store.add_weight(field, row, value, weight)
+            for item in profile.get('interaction_history', [])[-history_size:]:
+                if item.get('trackId') is not None:
+                    store.add_history(row, item['trackId'], item.get('timestamp'))
+        store.compact()
+        logger.info(f"Converted {len(store)} dict-based user profiles")
+        return store
@@ -0,0 +1,300 @@
+"""
+On-demand Profiling for the MuzikaX ML API Workers
+This module profiles a running worker without restarting it. A session either samples
+the stacks of every thread at a fixed interval for a number of seconds, or captures the
+next N requests with cProfile (while also sampling the threads serving them). Reports
+carry collapsed stacks ("frame;frame;frame count" lines, the input format of
+flamegraph.pl and speedscope) plus the top functions by cumulative time. Nothing is
+installed on the request path until a session is started: idle cost is one attribute
+check per request. From Python 3.12 cProfile records every thread of the process, so
+there the thread-filtered samples rank the captured requests' functions and the cProfile
+table is reported separately as process-wide.
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Set
+import logging
+
+logger = logging.getLogger(__name__)
+
+# cProfile is built on sys.monitoring from 3.12: one profiler at a time, seeing every thread
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse_stack(frame) -> str:
+    """
+    Root-first, semicolon-separated frame labels of a stack
+    """
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    def __init__(self, interval: float = 0.005, thread_filter: Optional[Callable[[int], bool]] = None):
+        """
+        Initialize the sampler
+        Every interval seconds the current stack of each thread (except the sampler's own,
+        and those thread_filter rejects) is collapsed and counted
+        """
+        self.interval = interval
+        self.thread_filter = thread_filter
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_filter is not None and not self.thread_filter(thread_id)):
+                    continue
+                self.stacks[collapse_stack(frame)] += 1
+            self.samples += 1
+
+
+def _sampled_top_functions(stacks: Counter, interval: float, top_n: int) -> List[Dict[str, Any]]:
+    """
+    Functions ranked by inclusive sample time (self time alongside)
+    """
+    inclusive: Counter = Counter()
+    exclusive: Counter = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        for label in set(frames):
+            inclusive[label] += count
+        exclusive[frames[-1]] += count
+    return [
+        {
+            'function': label,
+            'samples': count,
+            'cumulative_time': count * interval,
+            'self_time': exclusive[label] * interval
+        }
+        for label, count in inclusive.most_common(top_n)
+    ]
+
+
+def _profiled_top_functions(stats: pstats.Stats, top_n: int) -> List[Dict[str, Any]]:
+    """
+    Functions ranked by cumulative time from a cProfile capture
+    """
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top_n]
+    return [
+        {
+            'function': f"{os.path.basename(filename)}:{line}({name})",
+            'calls': calls,
+            'cumulative_time': cumulative,
+            'self_time': total
+        }
+        for (filename, line, name), (_, calls, total, cumulative, _) in rows
+    ]
+
+
+class RequestCapture:
+    """
+    The cProfile runs of one captured request: the one started by begin_request on the
+    request's thread (if any), plus one per profile_call on the threads it hands work to
+    """
+    __slots__ = ('profiles', 'own_profile', 'sampled_thread')
+
+    def __init__(self):
+        self.profiles: List[cProfile.Profile] = []
+        self.own_profile: Optional[cProfile.Profile] = None
+        self.sampled_thread = False  # Whether begin_request registered its thread
+
+
+class RequestProfiler:
+    def __init__(self, max_seconds: float = 120.0, top_n: int = 30):
+        """
+        Initialize the profiler (one session at a time per process)
+        max_seconds caps how long any session can run
+        """
+        self.max_seconds = max_seconds
+        self.top_n = top_n
+        # Read on every request by the API hooks; False except during a request capture
+        self.active = False
+        self.session: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._sampler: Optional[StackSampler] = None
+        self._timer: Optional[threading.Timer] = None
+        self._stats: Optional[pstats.Stats] = None
+        self._profiled_threads: Set[int] = set()
+        self._slots = 0
+
+    def _start_session(self, mode: str, duration: float, interval: float, **details: Any) -> Dict[str, Any]:
+        # Callers hold the lock
+        if self.session is not None and self.session['status'] == 'running':
+            raise RuntimeError('A profiling session is already running')
+        self.session = dict(
+            sessionId=uuid.uuid4().hex, mode=mode, status='running', pid=os.getpid(),
+            interval=interval, startedAt=time.time(), finishedAt=None, report=None, **details
+        )
+        self._timer = threading.Timer(min(duration, self.max_seconds), self.finish)
+        self._timer.daemon = True
+        self._timer.start()
+        return dict(self.session)
+
+    def start_sampling(self, seconds: float, interval: float = 0.005) -> Dict[str, Any]:
+        """
+        Sample every thread for the given number of seconds
+        """
+        with self._lock:
+            session = self._start_session('sample', seconds, interval, seconds=seconds)
+            # Leave out the session's own timer thread
+            timer_id = self._timer.ident
+            self._sampler = StackSampler(interval, thread_filter=lambda thread_id: thread_id != timer_id)
+            self._sampler.start()
+        return session
+
+    def start_request_capture(self, n_requests: int, timeout: float = 60.0, interval: float = 0.002) -> Dict[str, Any]:
+        """
+        Profile the next n_requests requests with cProfile, giving up after timeout seconds
+        """
+        with self._lock:
+            session = self._start_session('requests', timeout, interval,
+                                          requestsWanted=n_requests, requestsCaptured=0)
+            self._stats = None
+            self._profiled_threads = set()
+            self._slots = n_requests
+            # Only sample the threads serving a captured request
+            self._sampler = StackSampler(interval, thread_filter=self._profiled_threads.__contains__)
+            self._sampler.start()
+            self.active = True
+        return session
+
+    def _enter(self, capture: RequestCapture) -> Optional[cProfile.Profile]:
+        # Sample the calling thread and profile it as part of capture (None if another
+        # profiler already owns the interpreter, 3.12+ allowing only one); callers hold the lock
+        self._profiled_threads.add(threading.get_ident())
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None
+        capture.profiles.append(profile)
+        return profile
+
+    def _exit(self, profile: Optional[cProfile.Profile]):
+        if profile is not None:
+            profile.disable()
+        with self._lock:
+            self._profiled_threads.discard(threading.get_ident())
+
+    def begin_request(self, profile_thread: bool = True) -> Optional[RequestCapture]:
+        """
+        Start capturing a request if the capture still has room
+        profile_thread=False leaves the calling thread alone, for an event loop that serves
+        many requests at once; the request's work is then profiled through profile_call
+        """
+        with self._lock:
+            if not self.active or self._slots <= 0:
+                return None
+            capture = RequestCapture()
+            if profile_thread:
+                capture.own_profile = self._enter(capture)
+                if capture.own_profile is None and not PROCESS_WIDE_PROFILER:
+                    # Another profiler owns this thread; from 3.12 it is process-wide (another
+                    # captured request's) and the request is still sampled
+                    self._profiled_threads.discard(threading.get_ident())
+                    return None
+                capture.sampled_thread = True
+            self._slots -= 1
+            return capture
+
+    def profile_call(self, capture: Optional[RequestCapture], fn: Callable, *args: Any) -> Any:
+        """
+        Run fn(*args) on the calling thread, profiled as part of the captured request
+        """
+        if capture is None:
+            return fn(*args)
+        with self._lock:
+            profile = self._enter(capture)
+        try:
+            return fn(*args)
+        finally:
+            self._exit(profile)
+
+    def end_request(self, capture: RequestCapture):
+        if capture.sampled_thread:
+            self._exit(capture.own_profile)
+        with self._lock:
+            if self.session is None or self.session['mode'] != 'requests' or self.session['status'] != 'running':
+                return
+            for profile in capture.profiles:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+            self.session['requestsCaptured'] += 1
+            done = self.session['requestsCaptured'] >= self.session['requestsWanted']
+        if done:
+            self.finish()
+
+    def finish(self):
+        """
+        Stop the running session and build its report (called by the timer or the last request)
+        """
+        with self._lock:
+            if self.session is None or self.session['status'] != 'running':
+                return
+            self.active = False
+            self._slots = 0
+            if self._timer is not None:
+                self._timer.cancel()
+            sampler, stats = self._sampler, self._stats
+            self._sampler, self._stats = None, None
+        if sampler is not None:
+            sampler.stop()
+
+        report = {
+            'samples': sampler.samples if sampler is not None else 0,
+            'collapsed': '\n'.join(f'{stack} {count}' for stack, count in sampler.stacks.most_common())
+            if sampler is not None else ''
+        }
+        if stats is not None and PROCESS_WIDE_PROFILER:
+            # The cProfile table includes every concurrent request and background thread, so
+            # the samples of the captured requests' threads come first (when there are any)
+            report['process_top_functions'] = _profiled_top_functions(stats, self.top_n)
+            report['top_functions'] = _sampled_top_functions(sampler.stacks, sampler.interval, self.top_n) \
+                if sampler is not None and sampler.stacks else report['process_top_functions']
+            report['profile_scope'] = 'process'
+        elif stats is not None:
+            report['top_functions'] = _profiled_top_functions(stats, self.top_n)
+            report['profile_scope'] = 'request'
+        elif sampler is not None:
+            report['top_functions'] = _sampled_top_functions(sampler.stacks, sampler.interval, self.top_n)
+        else:
+            report['top_functions'] = []
+
+        with self._lock:
+            self.session.update(status='finished', finishedAt=time.time(), report=report)
+        logger.info(f"Profiling session {self.session['sessionId']} finished")
+
+    def get_session(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return dict(self.session) if self.session is not None else None
@@ -7,10 +7,14 @@ and location data.
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import StandardScaler
+from sklearn.preprocessing import StandardScaler, normalize
 from sklearn.cluster import KMeans
+from ml_catalog import TrackCatalog, top_n_rows
+from ml_location_index import LocationIndex
+from ml_candidate_index import CandidateIndex
 import json
 import pickle
 import os
@@ -25,10 +29,13 @@ class MLRecommendationEngine:
         """
         self.track_features = None
         self.track_metadata = None
+        self.catalog = None
+        self.location_index = None
+        self.candidate_index = None
         self.user_profiles = {}
         self.genre_clusters = {}
         self.location_preferences = {}
-        self.scaler = StandardScaler()
+        self.scaler = StandardScaler(with_mean=False)
         self.tfidf_vectorizer = TfidfVectorizer(max_features=100, stop_words='english')
         
     def load_data(self, tracks_data: List[Dict], user_data: List[Dict]):
@@ -38,6 +45,9 @@ class MLRecommendationEngine:
         # Convert to DataFrame for easier processing
         self.track_metadata = pd.DataFrame(tracks_data)
         
+        # Columnar arrays used by the scoring kernels
+        self.catalog = TrackCatalog(self.track_metadata)
+        
         # Create numerical features for ML
         self.create_numerical_features()
         
@@ -47,56 +57,69 @@ class MLRecommendationEngine:
     def create_numerical_features(self):
         """
         Create numerical features from track metadata for ML processing
+        Features stay in scipy.sparse form end to end, so memory scales with non-zeros
         """
-        # Create features from categorical data
-        features_df = pd.DataFrame()
+        n_tracks = len(self.track_metadata)
+        blocks = []
+        feature_names = []
+        
+        def add_column(name, values):
+            values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+            blocks.append(sp.csr_matrix(values.reshape(-1, 1)))
+            feature_names.append(name)
         
         # Normalize plays and likes
         if 'plays' in self.track_metadata.columns:
-            features_df['normalized_plays'] = self.track_metadata['plays'].fillna(0) / (self.track_metadata['plays'].max() + 1)
+            add_column('normalized_plays', self.track_metadata['plays'].fillna(0) / (self.track_metadata['plays'].max() + 1))
         else:
-            features_df['normalized_plays'] = 0
+            add_column('normalized_plays', np.zeros(n_tracks))
             
         if 'likes' in self.track_metadata.columns:
-            features_df['normalized_likes'] = self.track_metadata['likes'].fillna(0) / (self.track_metadata['likes'].max() + 1)
+            add_column('normalized_likes', self.track_metadata['likes'].fillna(0) / (self.track_metadata['likes'].max() + 1))
         else:
-            features_df['normalized_likes'] = 0
+            add_column('normalized_likes', np.zeros(n_tracks))
         
         # Genre encoding (using TF-IDF for genre similarity)
         if 'genre' in self.track_metadata.columns:
             genre_str = self.track_metadata['genre'].fillna('unknown').astype(str)
             genre_matrix = self.tfidf_vectorizer.fit_transform(genre_str)
-            genre_df = pd.DataFrame(genre_matrix.toarray(), columns=[f'genre_{i}' for i in range(genre_matrix.shape[1])])
-            features_df = pd.concat([features_df, genre_df], axis=1)
+            blocks.append(genre_matrix)
+            feature_names.extend(f'genre_{i}' for i in range(genre_matrix.shape[1]))
         else:
             # Create dummy genre features
-            features_df['genre_unknown'] = 1
+            add_column('genre_unknown', np.ones(n_tracks))
         
         # Creator ID encoding (if available)
         if 'creatorId' in self.track_metadata.columns:
             creator_counts = self.track_metadata['creatorId'].value_counts()
-            features_df['creator_popularity'] = self.track_metadata['creatorId'].map(creator_counts).fillna(0) / creator_counts.max()
+            add_column('creator_popularity', self.track_metadata['creatorId'].map(creator_counts).fillna(0) / creator_counts.max())
         
         # Type encoding (song, beat, mix)
         if 'type' in self.track_metadata.columns:
-            type_dummies = pd.get_dummies(self.track_metadata['type'], prefix='type')
-            features_df = pd.concat([features_df, type_dummies], axis=1)
+            type_codes, type_values = pd.factorize(self.track_metadata['type'], sort=True)
+            known = type_codes >= 0
+            blocks.append(sp.csr_matrix(
+                (np.ones(known.sum()), (np.flatnonzero(known), type_codes[known])),
+                shape=(n_tracks, len(type_values))
+            ))
+            feature_names.extend(f'type_{value}' for value in type_values)
         else:
-            features_df['type_song'] = 1  # Default to song
+            add_column('type_song', np.ones(n_tracks))  # Default to song
         
         # Location-based features (if available)
         if 'location' in self.track_metadata.columns:
             location_str = self.track_metadata['location'].fillna('global').astype(str)
             location_matrix = self.tfidf_vectorizer.fit_transform(location_str)
-            location_df = pd.DataFrame(location_matrix.toarray(), columns=[f'loc_{i}' for i in range(location_matrix.shape[1])])
-            features_df = pd.concat([features_df, location_df], axis=1)
+            blocks.append(location_matrix)
+            feature_names.extend(f'loc_{i}' for i in range(location_matrix.shape[1]))
         
-        # Fill NaN values with 0
-        self.track_features = features_df.fillna(0)
+        self.track_features = sp.hstack(blocks, format='csr')
+        self.feature_names = feature_names
         
-        # Scale the features
+        # Scale the features (mean-free scaling keeps the matrix sparse)
         self.track_features_scaled = self.scaler.fit_transform(self.track_features)
-        
+        self.track_features_normalized = normalize(self.track_features_scaled)
+    
     def build_user_profiles(self, user_data: List[Dict]):
         """
         Build user preference profiles based on listening history
@@ -119,11 +142,11 @@ class MLRecommendationEngine:
             interaction_type = user_interaction.get('type', 'play')  # play, like, skip, etc.
             timestamp = user_interaction.get('timestamp', datetime.now())
             
-            # Get track metadata to extract preferences
-            track_row = self.track_metadata[self.track_metadata['_id'] == track_id]
-            if not track_row.empty:
-                track_genre = track_row.iloc[0].get('genre', 'unknown')
-                track_creator = track_row.iloc[0].get('creatorId', 'unknown')
+            # Get track metadata to extract preferences (O(1) id -> row lookup)
+            row = self.catalog.row_of(track_id)
+            if row is not None:
+                track_genre = self.catalog.genre_values[self.catalog.genre_codes[row]]
+                track_creator = self.catalog.creator_values[self.catalog.creator_codes[row]]
                 
                 # Weight based on interaction type
                 weight = 1.0
@@ -158,6 +181,22 @@ class MLRecommendationEngine:
         """
         return cosine_similarity(self.track_features_scaled)
     
+    def calculate_seed_similarities(self, seed_rows: np.ndarray, block_size: int = 4096) -> np.ndarray:
+        """
+        Calculate the summed cosine similarity of every track to the given seed rows
+        Only the seed rows are compared, block by block over the catalog, so the cost is
+        O(seeds x N) with a bounded working set instead of the full N x N matrix
+        """
+        features = self.track_features_normalized
+        # Summing dot products over seeds equals one dot product with the summed seed vector
+        seed_vector = np.asarray(features[seed_rows].sum(axis=0)).ravel()
+        n_tracks = features.shape[0]
+        similarities = np.empty(n_tracks)
+        for start in range(0, n_tracks, block_size):
+            block = features[start:start + block_size]
+            similarities[start:start + block_size] = block @ seed_vector
+        return similarities
+    
     def get_collaborative_filtering_recommendations(self, user_id: str, n_recommendations: int = 10) -> List[str]:
         """
         Get recommendations using collaborative filtering based on similar users
@@ -172,78 +211,53 @@ class MLRecommendationEngine:
         user_genres = user_profile['genres']
         user_creators = user_profile['creators']
         
-        # Score all tracks based on user preferences
-        track_scores = []
-        for idx, track in self.track_metadata.iterrows():
-            score = 0.0
-            
-            # Genre match score
-            track_genre = track.get('genre', 'unknown')
-            if track_genre in user_genres:
-                score += user_genres[track_genre] * 0.4  # 40% weight to genre
-            else:
-                score += 0.1  # Small bonus for diversity
-                
-            # Creator match score
-            track_creator = track.get('creatorId', 'unknown')
-            if track_creator in user_creators:
-                score += user_creators[track_creator] * 0.3  # 30% weight to creator
-            else:
-                score += 0.1  # Small bonus for diversity
-                
-            # Popularity boost
-            track_plays = track.get('plays', 0)
-            if track_plays > 0:
-                normalized_plays = track_plays / self.track_metadata['plays'].max() if 'plays' in self.track_metadata.columns else 0
-                score += normalized_plays * 0.2  # 20% weight to popularity
-            
-            # Freshness factor
-            track_created = track.get('createdAt', datetime.now())
-            if isinstance(track_created, str):
-                try:
-                    track_created = datetime.fromisoformat(track_created.replace('Z', '+00:00'))
-                except:
-                    track_created = datetime.now()
-                    
-            freshness = min(1.0, (datetime.now() - track_created).days / 365)  # Up to 1 year gets full freshness score
-            score += (1 - freshness) * 0.1  # 10% weight to freshness
-            
-            track_scores.append((track['_id'], score))
+        # On large catalogs only candidates from the user's top genres and creators are scored
+        # (rebuilt when the catalog or its prior is replaced); profiles with a preference
+        # scoring below the unmatched bonus are scored in full, as retrieval could miss tracks
+        candidate_index = self.candidate_index
+        if candidate_index is None or not candidate_index.is_current(self.catalog):
+            candidate_index = self.candidate_index = CandidateIndex(self.catalog)
+        candidates = None
+        if candidate_index.enabled:
+            candidates = candidate_index.candidates(user_genres, user_creators, min_per_list=n_recommendations,
+                                                    miss_bonus=0.1)
+        if candidates is not None:
+            scores = self.catalog.score_collaborative_rows(candidates, user_genres, user_creators, miss_bonus=0.1,
+                                                           prior=candidate_index.prior)
+            return self.catalog.track_ids[candidates[top_n_rows(scores, n_recommendations)]].tolist()
+        
+        # Score all tracks based on user preferences (40% genre, 30% creator,
+        # 20% popularity, 10% freshness, small bonus for unmatched genres/creators)
+        scores = self.catalog.score_collaborative(user_genres, user_creators, miss_bonus=0.1)
         
-        # Sort by score and return top N
-        track_scores.sort(key=lambda x: x[1], reverse=True)
-        return [track_id for track_id, score in track_scores[:n_recommendations]]
+        # Return top N
+        top_rows = top_n_rows(scores, n_recommendations)
+        return self.catalog.track_ids[top_rows].tolist()
+    
+    def refresh_prior(self):
+        """
+        Recompute the catalog's popularity/freshness prior and re-rank the candidate index by it
+        """
+        if self.catalog is None:
+            return
+        self.catalog.refresh_prior()
+        self.candidate_index = CandidateIndex(self.catalog)
     
     def get_content_based_recommendations(self, seed_track_ids: List[str], n_recommendations: int = 10) -> List[str]:
         """
         Get recommendations using content-based filtering based on track features
         """
-        similarities = self.calculate_track_similarities()
-        
-        track_scores = {}
+        # Find the indices of the seed tracks
+        seed_rows = self.catalog.rows_of(seed_track_ids)
+        if len(seed_rows) == 0:
+            return []
         
-        for seed_track_id in seed_track_ids:
-            # Find the index of the seed track
-            seed_idx = self.track_metadata[self.track_metadata['_id'] == seed_track_id].index
-            if len(seed_idx) == 0:
-                continue
-            seed_idx = seed_idx[0]
-            
-            # Get similarity scores for this track
-            sim_scores = list(enumerate(similarities[seed_idx]))
-            
-            # Add scores to track_scores dictionary
-            for idx, score in sim_scores:
-                track_id = self.track_metadata.iloc[idx]['_id']
-                if track_id in seed_track_ids:
-                    continue  # Skip seed tracks
-                if track_id not in track_scores:
-                    track_scores[track_id] = 0
-                track_scores[track_id] += score
+        # Sum the similarities to every seed track
+        similarities = self.calculate_seed_similarities(seed_rows)
         
-        # Sort and return top recommendations
-        sorted_scores = sorted(track_scores.items(), key=lambda x: x[1], reverse=True)
-        return [track_id for track_id, score in sorted_scores[:n_recommendations]]
+        # Return top recommendations, skipping seed tracks
+        top_rows = top_n_rows(similarities, n_recommendations, exclude_rows=seed_rows)
+        return self.catalog.track_ids[top_rows].tolist()
     
     def get_popular_tracks(self, n_recommendations: int = 10) -> List[str]:
         """
@@ -264,23 +278,11 @@ class MLRecommendationEngine:
         if 'location' not in self.track_metadata.columns:
             return self.get_popular_tracks(n_recommendations)
         
-        # Find tracks from the same or similar locations
-        location_matches = self.track_metadata[
-            self.track_metadata['location'].str.contains(user_location, case=False, na=False)
-        ]
-        
-        if len(location_matches) < n_recommendations:
-            # If not enough local tracks, include nearby locations or global tracks
-            all_locations = self.track_metadata.copy()
-            all_locations['location_match'] = all_locations['location'].apply(
-                lambda loc: 2.0 if user_location.lower() in str(loc).lower() else 
-                           1.5 if str(loc) != 'global' else 1.0
-            )
-            sorted_tracks = all_locations.nlargest(n_recommendations * 2, ['location_match', 'plays'])
-        else:
-            sorted_tracks = location_matches.nlargest(n_recommendations, 'plays')
-        
-        return sorted_tracks['_id'].tolist()
+        # Find tracks from the same location, then from the regions around it
+        if self.location_index is None or self.location_index.catalog is not self.catalog:
+            self.location_index = LocationIndex(self.catalog)
+        rows = self.location_index.lookup(user_location, n_recommendations)
+        return self.catalog.track_ids[rows].tolist()
     
     def get_personalized_recommendations(self, user_id: str, seed_track_id: Optional[str] = None, 
                                        user_location: Optional[str] = None, n_recommendations: int = 10) -> List[str]:
@@ -327,7 +329,8 @@ class MLRecommendationEngine:
             'user_profiles': self.user_profiles,
             'scaler': self.scaler,
             'tfidf_vectorizer': self.tfidf_vectorizer,
-            'track_features_scaled': self.track_features_scaled
+            'track_features_scaled': self.track_features_scaled,
+            'catalog': self.catalog
         }
         
         with open(filepath, 'wb') as f:
@@ -346,6 +349,9 @@ class MLRecommendationEngine:
         self.scaler = model_data['scaler']
         self.tfidf_vectorizer = model_data['tfidf_vectorizer']
         self.track_features_scaled = model_data['track_features_scaled']
+        self.track_features_normalized = normalize(self.track_features_scaled)
+        # Older model files predate the saved catalog and id index
+        self.catalog = model_data.get('catalog') or TrackCatalog(self.track_metadata)
 
 
 # Example usage
@@ -9,6 +9,8 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from ml_recommendation import MLRecommendationEngine
+from ml_catalog import PriorRefresher
+from ml_hydration import TrackHydrator
 import json
 import pymongo
 from bson import ObjectId
@@ -25,6 +27,9 @@ app = Flask(__name__)
 client = pymongo.MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
 db = client['muzikax_db']
 
+# Bulk track lookups with a local document cache
+track_hydrator = TrackHydrator(lambda: db['tracks'])
+
 class ObjectIdEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, ObjectId):
@@ -127,17 +132,8 @@ def get_ml_personalized_recommendations():
             n_recommendations=limit
         )
         
-        # Get track details for the recommended track IDs
-        track_details = []
-        tracks_collection = db['tracks']
-        
-        for track_id in recommendations:
-            track = tracks_collection.find_one({'_id': ObjectId(track_id)})
-            if track:
-                track['_id'] = str(track['_id'])
-                if 'creatorId' in track and isinstance(track['creatorId'], ObjectId):
-                    track['creatorId'] = str(track['creatorId'])
-                track_details.append(track)
+        # Get track details for the recommended track IDs (a single $in query at most)
+        track_details = track_hydrator.hydrate(recommendations)
         
         return jsonify({
             'tracks': track_details,
@@ -178,17 +174,8 @@ def get_location_based_recommendations():
             n_recommendations=limit
         )
         
-        # Get track details for the recommended track IDs
-        track_details = []
-        tracks_collection = db['tracks']
-        
-        for track_id in recommendations:
-            track = tracks_collection.find_one({'_id': ObjectId(track_id)})
-            if track:
-                track['_id'] = str(track['_id'])
-                if 'creatorId' in track and isinstance(track['creatorId'], ObjectId):
-                    track['creatorId'] = str(track['creatorId'])
-                track_details.append(track)
+        # Get track details for the recommended track IDs (a single $in query at most)
+        track_details = track_hydrator.hydrate(recommendations)
         
         return jsonify({
             'tracks': track_details,
@@ -230,17 +217,8 @@ def get_collaborative_recommendations():
             n_recommendations=limit
         )
         
-        # Get track details for the recommended track IDs
-        track_details = []
-        tracks_collection = db['tracks']
-        
-        for track_id in recommendations:
-            track = tracks_collection.find_one({'_id': ObjectId(track_id)})
-            if track:
-                track['_id'] = str(track['_id'])
-                if 'creatorId' in track and isinstance(track['creatorId'], ObjectId):
-                    track['creatorId'] = str(track['creatorId'])
-                track_details.append(track)
+        # Get track details for the recommended track IDs (a single $in query at most)
+        track_details = track_hydrator.hydrate(recommendations)
         
         return jsonify({
             'tracks': track_details,
@@ -284,17 +262,8 @@ def get_content_based_recommendations():
             n_recommendations=limit
         )
         
-        # Get track details for the recommended track IDs
-        track_details = []
-        tracks_collection = db['tracks']
-        
-        for track_id in recommendations:
-            track = tracks_collection.find_one({'_id': ObjectId(track_id)})
-            if track:
-                track['_id'] = str(track['_id'])
-                if 'creatorId' in track and isinstance(track['creatorId'], ObjectId):
-                    track['creatorId'] = str(track['creatorId'])
-                track_details.append(track)
+        # Get track details for the recommended track IDs (a single $in query at most)
+        track_details = track_hydrator.hydrate(recommendations)
         
         return jsonify({
             'tracks': track_details,
@@ -358,4 +327,7 @@ if __name__ == '__main__':
         logger.error(f"Error loading model: {e}")
         logger.info("Will load data on first request")
     
+    # Recompute the popularity/freshness prior hourly so freshness keeps decaying
+    PriorRefresher(lambda: [engine], interval=float(os.getenv('ML_PRIOR_REFRESH_SECONDS', '3600'))).start()
+    
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
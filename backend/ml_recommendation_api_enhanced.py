@@ -4,18 +4,34 @@ This module provides REST API endpoints to serve advanced ML-based music recomme
 optimized for massive data and scalable algorithms
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from ml_recommendation_enhanced import AdvancedMLRecommendationEngine
+from ml_recommendation_enhanced import AdvancedMLRecommendationEngine, INTERACTION_WEIGHTS
+from ml_profile_store import parse_timestamp
+from ml_prefork_server import serve_prefork
+from ml_hydration import TrackHydrator
+from ml_model_store import version_dir, publish_model_version, resolve_published_model, prune_model_versions
+from ml_training_jobs import TrainingJobManager
+from ml_event_log import InteractionEventLog
+from ml_materialize import MaterializedRecommendationStore, materialize_recommendations
+from ml_asgi_app import create_asgi_app, serve_asgi
+from ml_profiling import RequestProfiler
+from ml_catalog import PriorRefresher
+from ml_metrics import (REGISTRY, REQUEST_DURATION, STAGE_DURATION, MODEL_LOAD_DURATION,
+                        PROMETHEUS_CONTENT_TYPE, time_stage, cache_samples)
 import json
 import pymongo
 from bson import ObjectId
 from datetime import datetime
 import logging
+import time
+import threading
+import hmac
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging with reduced verbosity
 logging.basicConfig(level=logging.WARNING, format='%(levelname)s: %(message)s')
@@ -25,33 +41,80 @@ logger.setLevel(logging.INFO)  # Only show INFO and above
 app = Flask(__name__)
 
 # MongoDB connection (you'll need to configure this based on your setup)
-client = pymongo.MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = client['muzikax_db']
+def connect_db():
+    """(Re)create the MongoDB client; called again in each pre-forked worker since clients are not fork-safe"""
+    global client, db
+    client = pymongo.MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
+    db = client['muzikax_db']
+
+connect_db()
+
+# Bulk track lookups with a local document cache (resolves the current db on every query)
+track_hydrator = TrackHydrator(lambda: db['tracks'])
 
 # Global lock for thread safety
 engine_lock = Lock()
 
+# Root directory of the versioned, memory-mappable model artifacts (its CURRENT file
+# names the published version)
+MODEL_DIR = os.getenv('ML_MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'enhanced_ml_model'))
+MODEL_VERSIONS_TO_KEEP = int(os.getenv('ML_MODEL_VERSIONS_TO_KEEP', '3'))
+
+# SQLite store of the top-K recommendations precomputed for every user after training
+MATERIALIZED_DB = os.getenv('ML_MATERIALIZED_DB', os.path.join(MODEL_DIR, 'materialized.sqlite3'))
+MATERIALIZED_TOP_K = int(os.getenv('ML_MATERIALIZED_TOP_K', '50'))
+
+# Training job records, shared by the pre-forked workers (one training job at a time across all of them)
+TRAINING_JOBS_DB = os.getenv('ML_TRAINING_JOBS_DB', os.path.join(MODEL_DIR, 'training_jobs.sqlite3'))
+
+# Users whose interactions a training run reads, and interactions read per user
+TRAINING_USER_LIMIT = int(os.getenv('ML_TRAINING_USER_LIMIT', '10'))
+TRAINING_INTERACTIONS_PER_USER = int(os.getenv('ML_TRAINING_INTERACTIONS_PER_USER', '50'))
+
+# Largest micro-batch accepted by the events endpoint
+MAX_EVENTS_PER_REQUEST = int(os.getenv('ML_MAX_EVENTS_PER_REQUEST', '5000'))
+
+# Live interactions shared by the pre-forked workers: each worker applies the events the
+# others received, and a newly published model replays those logged after its training data
+EVENT_LOG_DB = os.getenv('ML_EVENT_LOG_DB', os.path.join(MODEL_DIR, 'events.sqlite3'))
+EVENT_LOG_MAX_EVENTS = int(os.getenv('ML_EVENT_LOG_MAX_EVENTS', '1000000'))
+EVENT_POLL_SECONDS = float(os.getenv('ML_EVENT_POLL_SECONDS', '1.0'))
+
+# The debug profiling route only exists when a token is configured
+DEBUG_TOKEN = os.getenv('ML_DEBUG_TOKEN')
+PROFILE_ROUTE = '/api/ml-recommendations/debug/profile'
+
+# Largest number of users, and of recommendations per user, served by one batch request
+MAX_BATCH_USERS = int(os.getenv('ML_MAX_BATCH_USERS', '10000'))
+MAX_BATCH_LIMIT = 100
+
+# How often the serving catalog's popularity/freshness prior is recomputed
+PRIOR_REFRESH_SECONDS = float(os.getenv('ML_PRIOR_REFRESH_SECONDS', '3600'))
+
 class ObjectIdEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, ObjectId):
             return str(obj)
         return super().default(obj)
 
+# Track fields needed to featurize and score tracks
+TRACK_TRAINING_PROJECTION = {
+    '_id': 1,
+    'title': 1,
+    'genre': 1,
+    'creatorId': 1,
+    'plays': 1,
+    'likes': 1,
+    'location': 1,
+    'createdAt': 1,
+    'type': 1
+}
+
 def get_tracks_from_db(limit=10000, offset=0):
     """Retrieve tracks data from MongoDB with pagination for massive datasets"""
     try:
         tracks_collection = db['tracks']
-        tracks = list(tracks_collection.find({}, {
-            '_id': 1,
-            'title': 1,
-            'genre': 1,
-            'creatorId': 1,
-            'plays': 1,
-            'likes': 1,
-            'location': 1,
-            'createdAt': 1,
-            'type': 1
-        }).skip(offset).limit(limit))
+        tracks = list(tracks_collection.find({}, TRACK_TRAINING_PROJECTION).skip(offset).limit(limit))
         
         # Convert ObjectId to string
         for track in tracks:
@@ -64,6 +127,15 @@ def get_tracks_from_db(limit=10000, offset=0):
         logger.error(f"Error retrieving tracks from DB: {e}")
         return []
 
+def iter_tracks_from_db(batch_size=1000):
+    """Stream every track from MongoDB, fetching batch_size documents per round-trip"""
+    cursor = db['tracks'].find({}, TRACK_TRAINING_PROJECTION).batch_size(batch_size)
+    for track in cursor:
+        track['_id'] = str(track['_id'])
+        if 'creatorId' in track and isinstance(track['creatorId'], ObjectId):
+            track['creatorId'] = str(track['creatorId'])
+        yield track
+
 def get_user_interactions_from_db(user_id=None, limit=10000, offset=0):
     """Retrieve user interactions data from MongoDB with pagination"""
     try:
@@ -126,10 +198,237 @@ def get_all_users(limit=1000):
 # Initialize the enhanced ML recommendation engine with reduced memory footprint
 engine = AdvancedMLRecommendationEngine(max_tracks_for_training=1000, cache_size=100)
 engine_initialized = False
-is_initializing = False
+published_model_dir = None  # Artifact directory the serving engine was loaded from
 
-# Global lock for thread safety
-engine_lock = Lock()
+event_log = InteractionEventLog(EVENT_LOG_DB, max_events=EVENT_LOG_MAX_EVENTS)
+event_log_lock = Lock()  # One engine catches up on the event log at a time
+
+def apply_logged_events(target_engine):
+    """
+    Apply the events logged after target_engine's position in the shared event log
+    An engine without a position (built straight from the database) starts at the current end
+    Returns the ids of the users whose profiles changed
+    """
+    updated_users = set()
+    with event_log_lock:
+        if target_engine.event_seq is None:
+            target_engine.event_seq = event_log.last_seq()
+        while True:
+            logged = event_log.since(target_engine.event_seq, limit=MAX_EVENTS_PER_REQUEST)
+            if not logged:
+                return updated_users
+            try:
+                updated_users |= target_engine.ingest_interactions(event for _, event in logged)
+            finally:
+                # Never re-applied, even if an event failed half-way
+                target_engine.event_seq = logged[-1][0]
+
+def publish_engine(new_engine, model_dir=None):
+    """
+    Make new_engine the one serving requests
+    Rebinding the global is atomic: requests already running finish on the engine they started with
+    """
+    global engine, engine_initialized, published_model_dir
+    engine = new_engine
+    engine_initialized = True
+    published_model_dir = model_dir
+
+def load_published_model(verify=False):
+    """Load the currently published model version into a fresh engine and swap it in"""
+    model_dir = resolve_published_model(MODEL_DIR)
+    if model_dir is None:
+        raise FileNotFoundError(f"No published model under {MODEL_DIR}")
+    load_started = time.perf_counter()
+    new_engine = AdvancedMLRecommendationEngine(max_tracks_for_training=2000, cache_size=200)
+    new_engine.load_model(model_dir, mmap=True, verify=verify)
+    if os.path.isfile(MATERIALIZED_DB):
+        new_engine.materialized_store = MaterializedRecommendationStore(MATERIALIZED_DB)
+    # Replay the live events the model's training data predates, then once more after the
+    # swap for any that reached the previous engine in between
+    apply_logged_events(new_engine)
+    publish_engine(new_engine, model_dir)
+    apply_logged_events(new_engine)
+    load_seconds = time.perf_counter() - load_started
+    REGISTRY.observe(MODEL_LOAD_DURATION, load_seconds)
+    logger.info(f"Loaded enhanced model version {new_engine.model_version} from {model_dir} "
+                f"in {load_seconds:.3f}s")
+
+def ensure_engine_initialized(track_limit=500, user_id=None):
+    """
+    Return the serving engine, building a small one from a sample of tracks on first use
+    """
+    if engine_initialized:
+        return engine
+    with engine_lock:
+        if not engine_initialized:
+            logger.info("Initializing recommendation engine with optimized data loading...")
+            # Load a small sample, plus the current user's interactions if provided; the two
+            # queries are independent, so run them concurrently
+            snapshot_seq = event_log.last_seq()
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                tracks_future = executor.submit(get_tracks_from_db, limit=track_limit)
+                interactions = get_user_interactions_from_db(user_id=user_id, limit=100) if user_id else []
+                tracks = tracks_future.result()
+            new_engine = AdvancedMLRecommendationEngine(max_tracks_for_training=1000, cache_size=100)
+            new_engine.load_data_incrementally(tracks, interactions, batch_size=200)
+            new_engine.train_models()
+            new_engine.event_seq = snapshot_seq
+            apply_logged_events(new_engine)
+            publish_engine(new_engine)
+            logger.info(f"Engine initialized with {len(tracks)} tracks and {len(interactions)} interactions")
+        return engine
+
+def train_and_save_model(model_version):
+    """
+    Train a fresh engine on the whole tracks collection and save it as model_version
+    Runs in the training worker process, never on the request path
+    """
+    # Live events logged from here on may be missing from the interactions read below; the
+    # serving workers replay them into the new engine when it is published
+    snapshot_seq = event_log.last_seq()
+    # Only load interactions for a few active users
+    active_users = get_all_users(limit=TRAINING_USER_LIMIT)
+    all_interactions = []
+    for user_id in active_users:
+        all_interactions.extend(get_user_interactions_from_db(user_id=user_id,
+                                                              limit=TRAINING_INTERACTIONS_PER_USER))
+    
+    new_engine = AdvancedMLRecommendationEngine(max_tracks_for_training=2000, cache_size=200)
+    # Featurize the whole tracks collection in two streaming passes of fixed-size chunks
+    new_engine.load_data_incrementally(lambda: iter_tracks_from_db(batch_size=1000),
+                                       all_interactions, batch_size=1000)
+    new_engine.train_models()
+    new_engine.model_version = model_version
+    new_engine.event_seq = snapshot_seq
+    model_dir = version_dir(MODEL_DIR, model_version)
+    new_engine.save_model(model_dir)
+    
+    logger.info(f"Model version {model_version} trained on {new_engine.catalog.n_tracks} tracks "
+                f"and {len(all_interactions)} interactions")
+    
+    # Precompute every known user's top-K so serving them is a single key lookup
+    users_materialized = materialize_recommendations(
+        model_dir, MATERIALIZED_DB, model_version, list(new_engine.user_profiles),
+        k=MATERIALIZED_TOP_K, keep_versions=MODEL_VERSIONS_TO_KEEP
+    )
+    return {
+        'tracks_processed': new_engine.catalog.n_tracks,
+        'interactions_processed': len(all_interactions),
+        'users_materialized': users_materialized
+    }
+
+def publish_trained_model(model_version):
+    """Point CURRENT at a freshly trained version, swap it in and drop old versions"""
+    publish_model_version(MODEL_DIR, model_version)
+    load_published_model()
+    prune_model_versions(MODEL_DIR, keep=MODEL_VERSIONS_TO_KEEP)
+
+def watch_published_model(interval=5.0):
+    """
+    Poll the CURRENT pointer and reload when another process publishes a new version
+    Used by pre-forked workers, where a retrain only swaps the engine of the worker that ran it
+    """
+    def poll():
+        while True:
+            time.sleep(interval)
+            try:
+                model_dir = resolve_published_model(MODEL_DIR)
+                if model_dir is not None and model_dir != published_model_dir:
+                    load_published_model()
+            except Exception as e:
+                logger.error(f"Error reloading published model: {e}")
+    
+    threading.Thread(target=poll, name='model-watcher', daemon=True).start()
+
+def watch_event_log(interval=EVENT_POLL_SECONDS):
+    """
+    Poll the shared event log and apply the events other pre-forked workers received
+    """
+    def poll():
+        while True:
+            time.sleep(interval)
+            try:
+                if engine_initialized:
+                    apply_logged_events(engine)
+            except Exception as e:
+                logger.error(f"Error applying logged events: {e}")
+    
+    threading.Thread(target=poll, name='event-log-watcher', daemon=True).start()
+
+def start_prior_refresher():
+    """Recompute the serving engine's prior, and the candidate lists ranked by it, in the background"""
+    return PriorRefresher(lambda: [engine], interval=PRIOR_REFRESH_SECONDS).start()
+
+# Training runs in a spawned process so featurization and ALS never compete with serving for the GIL
+training_jobs = TrainingJobManager(train_and_save_model, publish_trained_model, TRAINING_JOBS_DB)
+
+def request_stage(stage):
+    """Time one stage (engine_init, scoring, hydration, serialization) of the current request"""
+    return time_stage(request.url_rule.rule, stage)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Route patterns rather than raw paths keep the label set bounded
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REGISTRY.observe(REQUEST_DURATION, time.perf_counter() - started, endpoint=endpoint)
+    return response
+
+def collect_serving_metrics():
+    """Model, cache and hydration samples for /metrics, read from the engine serving right now"""
+    current_engine = engine
+    samples = [
+        ('ml_engine_initialized', 'gauge', 'Whether a recommendation engine is serving', {}, int(engine_initialized)),
+        ('ml_engine_requests_total', 'counter', 'Recommendation engine calls served by the current engine', {},
+         current_engine.performance_stats['requests_served'])
+    ]
+    prior_refreshed_at = getattr(current_engine.catalog, 'prior_refreshed_at', None)
+    if prior_refreshed_at is not None:
+        samples.append(('ml_catalog_prior_age_seconds', 'gauge', 'Seconds since the catalog prior was recomputed', {},
+                        time.time() - prior_refreshed_at))
+    if current_engine.model_version is not None:
+        samples.append(('ml_model_version', 'gauge', 'Version of the published model being served', {},
+                        current_engine.model_version))
+    samples.extend(cache_samples('ml_recommendation_cache', current_engine.recommendation_cache.get_stats(),
+                                 'Recommendation cache'))
+    hydration = track_hydrator.get_stats()
+    for result, field in (('hit', 'hits'), ('revalidated', 'revalidated'), ('miss', 'misses')):
+        samples.append(('ml_hydration_documents_total', 'counter', 'Track documents hydrated by cache result',
+                        {'result': result}, hydration[field]))
+    samples.append(('ml_hydration_round_trips_total', 'counter', 'MongoDB queries issued by track hydration', {},
+                    hydration['round_trips']))
+    return samples
+
+REGISTRY.register_collector(collect_serving_metrics)
+
+profiler = RequestProfiler()
+
+if DEBUG_TOKEN:
+    # Registered only when profiling is enabled; while no capture runs each request
+    # costs a single attribute check
+    @app.before_request
+    def begin_profiled_request():
+        if profiler.active and request.path != PROFILE_ROUTE:
+            g.profile = profiler.begin_request()
+
+    @app.teardown_request
+    def end_profiled_request(exc):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profiler.end_request(profile)
+
+def debug_authorized():
+    """Check the X-Debug-Token (or Bearer) header against ML_DEBUG_TOKEN in constant time"""
+    provided = request.headers.get('X-Debug-Token', '')
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        provided = authorization[len('Bearer '):]
+    return hmac.compare_digest(provided.encode('utf-8'), DEBUG_TOKEN.encode('utf-8'))
 
 @app.route('/api/ml-recommendations/personalized', methods=['GET'])
 def get_ml_personalized_recommendations():
@@ -149,62 +448,32 @@ def get_ml_personalized_recommendations():
         
         logger.info(f"Getting enhanced ML recommendations for user: {user_id}, track: {current_track_id}, limit: {limit}")
         
-        # Acquire lock to ensure thread safety during engine initialization
-        global engine_initialized, is_initializing
-        with engine_lock:
-            # Load data if engine hasn't been initialized
-            if not engine_initialized and not is_initializing:
-                is_initializing = True
-                logger.info("Initializing recommendation engine with optimized data loading...")
-                
-                try:
-                    # Load a smaller sample to reduce memory usage
-                    tracks = get_tracks_from_db(limit=1000, offset=0)
-                    
-                    # Only load interactions for the current user if provided
-                    all_interactions = []
-                    if user_id:
-                        all_interactions = get_user_interactions_from_db(user_id=user_id, limit=100)
-                    
-                    # Load data incrementally with small batch size
-                    engine.load_data_incrementally(tracks, all_interactions, batch_size=200)
-                    
-                    # Train the models
-                    engine.train_models()
-                    
-                    engine_initialized = True
-                    logger.info(f"Engine initialized with {len(tracks)} tracks and {len(all_interactions)} interactions")
-                except Exception as init_error:
-                    logger.error(f"Error initializing engine: {init_error}")
-                    is_initializing = False
-                    raise init_error
+        # Build a small engine on first use; keep one reference for the whole request
+        # so a concurrent model swap cannot change engines halfway through
+        with request_stage('engine_init'):
+            current_engine = ensure_engine_initialized(track_limit=1000, user_id=user_id)
         
         # Get recommendations with reduced limit to save memory
         max_limit = min(limit, 20)  # Cap at 20 recommendations
-        recommendations = engine.get_personalized_recommendations(
-            user_id=user_id,
-            seed_track_id=current_track_id,
-            user_location=user_location,
-            n_recommendations=max_limit
-        )
-        
-        # Get track details for the recommended track IDs
-        track_details = []
-        tracks_collection = db['tracks']
-        
-        for track_id in recommendations:
-            track = tracks_collection.find_one({'_id': ObjectId(track_id)})
-            if track:
-                track['_id'] = str(track['_id'])
-                if 'creatorId' in track and isinstance(track['creatorId'], ObjectId):
-                    track['creatorId'] = str(track['creatorId'])
-                track_details.append(track)
-        
-        return jsonify({
-            'tracks': track_details[:max_limit],
-            'count': len(track_details[:max_limit]),
-            'algorithm': 'enhanced_ml_personalized'
-        }), 200
+        with request_stage('scoring'):
+            recommendations = current_engine.get_personalized_recommendations(
+                user_id=user_id,
+                seed_track_id=current_track_id,
+                user_location=user_location,
+                n_recommendations=max_limit
+            )
+        
+        # Get track details for the recommended track IDs (a single $in query at most)
+        with request_stage('hydration'):
+            track_details = track_hydrator.hydrate(recommendations)
+        
+        with request_stage('serialization'):
+            response = jsonify({
+                'tracks': track_details[:max_limit],
+                'count': len(track_details[:max_limit]),
+                'algorithm': 'enhanced_ml_personalized'
+            })
+        return response, 200
 
     except Exception as e:
         logger.error(f"Error in get_ml_personalized_recommendations: {e}")
@@ -227,48 +496,30 @@ def get_location_based_recommendations():
         
         logger.info(f"Getting enhanced location-based recommendations for: {location}, limit: {limit}")
         
-        # Ensure engine is initialized with minimal data
-        global engine_initialized, is_initializing
-        with engine_lock:
-            if not engine_initialized and not is_initializing:
-                is_initializing = True
-                try:
-                    # Load minimal dataset
-                    tracks = get_tracks_from_db(limit=500)
-                    engine.load_data_incrementally(tracks, [], batch_size=200)
-                    engine.train_models()
-                    engine_initialized = True
-                    logger.info(f"Location engine initialized with {len(tracks)} tracks")
-                except Exception as init_error:
-                    logger.error(f"Error initializing location engine: {init_error}")
-                    is_initializing = False
-                    raise init_error
+        # Build a small engine on first use; keep one reference for the whole request
+        with request_stage('engine_init'):
+            current_engine = ensure_engine_initialized(track_limit=500)
         
         # Get location-based recommendations with capped limit
         max_limit = min(limit, 20)
-        recommendations = engine.get_location_based_recommendations(
-            user_location=location,
-            n_recommendations=max_limit
-        )
-        
-        # Get track details for the recommended track IDs
-        track_details = []
-        tracks_collection = db['tracks']
-        
-        for track_id in recommendations:
-            track = tracks_collection.find_one({'_id': ObjectId(track_id)})
-            if track:
-                track['_id'] = str(track['_id'])
-                if 'creatorId' in track and isinstance(track['creatorId'], ObjectId):
-                    track['creatorId'] = str(track['creatorId'])
-                track_details.append(track)
-        
-        return jsonify({
-            'tracks': track_details[:max_limit],
-            'count': len(track_details[:max_limit]),
-            'algorithm': 'enhanced_location_based',
-            'location': location
-        }), 200
+        with request_stage('scoring'):
+            recommendations = current_engine.get_location_based_recommendations(
+                user_location=location,
+                n_recommendations=max_limit
+            )
+        
+        # Get track details for the recommended track IDs (a single $in query at most)
+        with request_stage('hydration'):
+            track_details = track_hydrator.hydrate(recommendations)
+        
+        with request_stage('serialization'):
+            response = jsonify({
+                'tracks': track_details[:max_limit],
+                'count': len(track_details[:max_limit]),
+                'algorithm': 'enhanced_location_based',
+                'location': location
+            })
+        return response, 200
 
     except Exception as e:
         logger.error(f"Error in get_location_based_recommendations: {e}")
@@ -291,50 +542,30 @@ def get_collaborative_recommendations():
         
         logger.info(f"Getting enhanced collaborative recommendations for user: {user_id}, limit: {limit}")
         
-        # Ensure engine is initialized with minimal data
-        global engine_initialized, is_initializing
-        with engine_lock:
-            if not engine_initialized and not is_initializing:
-                is_initializing = True
-                try:
-                    # Load minimal dataset
-                    tracks = get_tracks_from_db(limit=500)
-                    # Only load current user's interactions
-                    interactions = get_user_interactions_from_db(user_id=user_id, limit=100)
-                    engine.load_data_incrementally(tracks, interactions, batch_size=200)
-                    engine.train_models()
-                    engine_initialized = True
-                    logger.info(f"Collaborative engine initialized with {len(tracks)} tracks")
-                except Exception as init_error:
-                    logger.error(f"Error initializing collaborative engine: {init_error}")
-                    is_initializing = False
-                    raise init_error
+        # Build a small engine on first use; keep one reference for the whole request
+        with request_stage('engine_init'):
+            current_engine = ensure_engine_initialized(track_limit=500, user_id=user_id)
         
         # Get collaborative filtering recommendations with capped limit
         max_limit = min(limit, 20)
-        recommendations = engine.get_collaborative_filtering_recommendations(
-            user_id=user_id,
-            n_recommendations=max_limit
-        )
-        
-        # Get track details for the recommended track IDs
-        track_details = []
-        tracks_collection = db['tracks']
-        
-        for track_id in recommendations:
-            track = tracks_collection.find_one({'_id': ObjectId(track_id)})
-            if track:
-                track['_id'] = str(track['_id'])
-                if 'creatorId' in track and isinstance(track['creatorId'], ObjectId):
-                    track['creatorId'] = str(track['creatorId'])
-                track_details.append(track)
-        
-        return jsonify({
-            'tracks': track_details[:max_limit],
-            'count': len(track_details[:max_limit]),
-            'algorithm': 'enhanced_collaborative_filtering',
-            'userId': user_id
-        }), 200
+        with request_stage('scoring'):
+            recommendations = current_engine.get_collaborative_filtering_recommendations(
+                user_id=user_id,
+                n_recommendations=max_limit
+            )
+        
+        # Get track details for the recommended track IDs (a single $in query at most)
+        with request_stage('hydration'):
+            track_details = track_hydrator.hydrate(recommendations)
+        
+        with request_stage('serialization'):
+            response = jsonify({
+                'tracks': track_details[:max_limit],
+                'count': len(track_details[:max_limit]),
+                'algorithm': 'enhanced_collaborative_filtering',
+                'userId': user_id
+            })
+        return response, 200
 
     except Exception as e:
         logger.error(f"Error in get_collaborative_recommendations: {e}")
@@ -359,109 +590,273 @@ def get_content_based_recommendations():
         
         logger.info(f"Getting enhanced content-based recommendations for tracks: {seed_track_ids}, limit: {limit}")
         
-        # Ensure engine is initialized with minimal data
-        global engine_initialized, is_initializing
-        with engine_lock:
-            if not engine_initialized and not is_initializing:
-                is_initializing = True
-                try:
-                    # Load minimal dataset
-                    tracks = get_tracks_from_db(limit=500)
-                    engine.load_data_incrementally(tracks, [], batch_size=200)
-                    engine.train_models()
-                    engine_initialized = True
-                    logger.info(f"Content engine initialized with {len(tracks)} tracks")
-                except Exception as init_error:
-                    logger.error(f"Error initializing content engine: {init_error}")
-                    is_initializing = False
-                    raise init_error
+        # Build a small engine on first use; keep one reference for the whole request
+        with request_stage('engine_init'):
+            current_engine = ensure_engine_initialized(track_limit=500)
         
         # Get content-based recommendations with capped limit
         max_limit = min(limit, 20)
-        recommendations = engine.get_content_based_recommendations(
-            seed_track_ids=seed_track_ids,
-            n_recommendations=max_limit
+        with request_stage('scoring'):
+            recommendations = current_engine.get_content_based_recommendations(
+                seed_track_ids=seed_track_ids,
+                n_recommendations=max_limit
+            )
+        
+        # Get track details for the recommended track IDs (a single $in query at most)
+        with request_stage('hydration'):
+            track_details = track_hydrator.hydrate(recommendations)
+        
+        with request_stage('serialization'):
+            response = jsonify({
+                'tracks': track_details[:max_limit],
+                'count': len(track_details[:max_limit]),
+                'algorithm': 'enhanced_content_based',
+                'seedTrackIds': seed_track_ids
+            })
+        return response, 200
+
+    except Exception as e:
+        logger.error(f"Error in get_content_based_recommendations: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def batch_option_error(options, field):
+    """
+    Why options[field] is not a valid batch option, or None if it is valid or absent
+    """
+    value = options.get(field)
+    if value is None:
+        return None
+    if field == 'limit':
+        # bool is an int subclass, but never a meaningful limit
+        if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= MAX_BATCH_LIMIT:
+            return f'limit must be an integer between 1 and {MAX_BATCH_LIMIT}'
+    elif not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        return f'{field} must be a list of strings'
+    return None
+
+@app.route('/api/ml-recommendations/batch', methods=['POST'])
+def get_batch_recommendations():
+    """
+    Get collaborative recommendations for many users in one request (digests, feed warmers)
+    Body:
+    - users: [{"userId", "limit"?, "excludeTrackIds"?, "genres"?}, ...]
+      or userIds: [...] sharing the top-level options
+    - limit: Default number of recommendations per user (default 10, max 100)
+    - genres: Default genre filter (a list of genre names)
+    - excludeHistory: Skip tracks the user already interacted with (default true)
+    Returns ranked track ids per user, without track details
+    """
+    try:
+        payload = request.get_json(silent=True) or {}
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'A JSON object is required'}), 400
+        users = payload.get('users')
+        if users is None:
+            user_ids = payload.get('userIds') or []
+            if not isinstance(user_ids, list):
+                return jsonify({'error': 'userIds must be a list'}), 400
+            users = [{'userId': user_id} for user_id in user_ids]
+        if not isinstance(users, list) or not users:
+            return jsonify({'error': 'users or userIds is required'}), 400
+        if len(users) > MAX_BATCH_USERS:
+            return jsonify({'error': f'At most {MAX_BATCH_USERS} users per request'}), 413
+        if not all(isinstance(user, dict) and user.get('userId') for user in users):
+            return jsonify({'error': 'Every user needs a userId'}), 400
+        for options in [payload] + users:
+            for field in ('limit', 'excludeTrackIds', 'genres'):
+                error = batch_option_error(options, field)
+                if error is not None:
+                    return jsonify({'error': error}), 400
+        default_limit = payload.get('limit') or 10
+        
+        current_engine = ensure_engine_initialized(track_limit=500)
+        
+        user_ids = [str(user['userId']) for user in users]
+        recommendations = current_engine.get_batch_recommendations(
+            user_ids,
+            limits=[user.get('limit') or default_limit for user in users],
+            exclude_track_ids=[user.get('excludeTrackIds') or [] for user in users],
+            genres=[user.get('genres') or payload.get('genres') for user in users],
+            exclude_history=bool(payload.get('excludeHistory', True))
         )
         
-        # Get track details for the recommended track IDs
-        track_details = []
-        tracks_collection = db['tracks']
-        
-        for track_id in recommendations:
-            track = tracks_collection.find_one({'_id': ObjectId(track_id)})
-            if track:
-                track['_id'] = str(track['_id'])
-                if 'creatorId' in track and isinstance(track['creatorId'], ObjectId):
-                    track['creatorId'] = str(track['creatorId'])
-                track_details.append(track)
+        return jsonify({
+            'recommendations': dict(zip(user_ids, recommendations)),
+            'count': len(user_ids),
+            'algorithm': 'enhanced_batch_collaborative',
+            'modelVersion': current_engine.model_version
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error in get_batch_recommendations: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ml-recommendations/events', methods=['POST'])
+def ingest_events():
+    """
+    Apply a micro-batch of user interactions to the live user profiles
+    Body: {"events": [{"userId", "trackId", "type": play|like|skip|comment, "timestamp"?}, ...]}
+    (a bare list of events is accepted too)
+    """
+    try:
+        payload = request.get_json(silent=True)
+        events = payload.get('events') if isinstance(payload, dict) else payload
+        if not isinstance(events, list):
+            return jsonify({'error': 'A list of events is required'}), 400
+        if len(events) > MAX_EVENTS_PER_REQUEST:
+            return jsonify({'error': f'At most {MAX_EVENTS_PER_REQUEST} events per request'}), 413
+        
+        # Validated up front so no event of the batch is half-applied; timestamps must be
+        # parseable and within the profile history's range (1970-2106, any epoch unit)
+        valid_events = [
+            event for event in events
+            if isinstance(event, dict) and event.get('userId') and event.get('trackId')
+            and event.get('type', 'play') in INTERACTION_WEIGHTS
+            and (event.get('timestamp') is None or parse_timestamp(event['timestamp']) is not None)
+        ]
+        
+        # Events are only applied once an engine is serving; until then the next
+        # training run picks them up from the database
+        current_engine = engine
+        if not engine_initialized:
+            return jsonify({
+                'accepted': 0,
+                'rejected': len(events),
+                'error': 'Recommendation engine is not initialized'
+            }), 503
+        
+        # Logged first so the other workers, and the next published model, apply them too;
+        # this worker's engine catches up right away
+        event_log.append(valid_events)
+        updated_users = apply_logged_events(current_engine)
         
         return jsonify({
-            'tracks': track_details[:max_limit],
-            'count': len(track_details[:max_limit]),
-            'algorithm': 'enhanced_content_based',
-            'seedTrackIds': seed_track_ids
+            'accepted': len(valid_events),
+            'rejected': len(events) - len(valid_events),
+            'usersUpdated': len(updated_users),
+            'modelVersion': current_engine.model_version
         }), 200
 
     except Exception as e:
-        logger.error(f"Error in get_content_based_recommendations: {e}")
+        logger.error(f"Error in ingest_events: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/ml-recommendations/train-model', methods=['POST'])
 def train_model():
     """
-    Train or retrain the enhanced ML model with optimized memory usage
+    Start retraining the enhanced ML model in the background
+    Returns a job id right away; the current model keeps serving until the new version is swapped in
     """
     try:
-        logger.info("Training enhanced ML model with optimized memory settings")
-        
-        global engine_initialized, is_initializing
-        with engine_lock:
-            is_initializing = True
-            
-            # Get a smaller sample of data to reduce memory usage
-            tracks = get_tracks_from_db(limit=1000, offset=0)
-            
-            # Only load interactions for a few active users
-            active_users = get_all_users(limit=10)
-            all_interactions = []
-            for user_id in active_users:
-                user_interactions = get_user_interactions_from_db(user_id=user_id, limit=50)
-                all_interactions.extend(user_interactions)
-            
-            # Initialize with reduced capacity
-            global engine
-            engine = AdvancedMLRecommendationEngine(max_tracks_for_training=2000, cache_size=200)
-            engine.load_data_incrementally(tracks, all_interactions, batch_size=200)
-            engine.train_models()
-            
-            engine_initialized = True
-            is_initializing = False
-            
-            logger.info(f"Model trained on {len(tracks)} tracks and {len(all_interactions)} interactions")
-        
+        job, created = training_jobs.submit()
+        if not created:
+            return jsonify({
+                'error': 'A training job is already running',
+                'jobId': job['jobId']
+            }), 409
+        
+        logger.info(f"Started training job {job['jobId']} for model version {job['modelVersion']}")
         return jsonify({
-            'message': 'Enhanced model trained successfully',
-            'tracks_processed': len(tracks),
-            'interactions_processed': len(all_interactions),
+            'message': 'Enhanced model training started',
+            'jobId': job['jobId'],
+            'status': job['status'],
+            'modelVersion': job['modelVersion'],
+            'statusUrl': f"/api/ml-recommendations/train-model/{job['jobId']}",
             'algorithm': 'enhanced_ml_recommendation_engine'
-        }), 200
+        }), 202
 
     except Exception as e:
         logger.error(f"Error in train_model: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ml-recommendations/train-model/<job_id>', methods=['GET'])
+def get_training_job(job_id):
+    """
+    Get the status of a training job (running, publishing, succeeded or failed)
+    """
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Training job not found'}), 404
+    return jsonify(dict(job, currentModelVersion=engine.model_version)), 200
+
 @app.route('/api/ml-recommendations/performance-stats', methods=['GET'])
 def get_performance_stats():
     """
     Get performance statistics for the ML recommendation engine
     """
     try:
-        stats = engine.get_performance_stats()
+        stats = dict(engine.get_performance_stats(), hydration=track_hydrator.get_stats(),
+                     requests=REGISTRY.percentiles(REQUEST_DURATION), stages=REGISTRY.percentiles(STAGE_DURATION))
         return jsonify(stats), 200
     except Exception as e:
         logger.error(f"Error in get_performance_stats: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route(PROFILE_ROUTE, methods=['POST'])
+def start_profiling():
+    """
+    Start a profiling session on the worker serving this request (needs ML_DEBUG_TOKEN)
+    Body:
+    - mode: 'sample' samples every thread for `seconds` (default 10);
+      'requests' captures the next `requests` requests (default 20) with cProfile, for up to `timeout` seconds (default 60)
+    - interval: stack sampling period in seconds
+    """
+    if not DEBUG_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not debug_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    body = request.get_json(silent=True) or {}
+    mode = body.get('mode', 'sample')
+    try:
+        interval = float(body.get('interval', 0.005 if mode == 'sample' else 0.002))
+        if interval < 0.001:
+            return jsonify({'error': 'interval must be at least 0.001 seconds'}), 400
+        if mode == 'sample':
+            seconds = float(body.get('seconds', 10))
+            if seconds <= 0:
+                return jsonify({'error': 'seconds must be positive'}), 400
+            session = profiler.start_sampling(seconds, interval=interval)
+        elif mode == 'requests':
+            n_requests = int(body.get('requests', 20))
+            timeout = float(body.get('timeout', 60))
+            if n_requests <= 0 or timeout <= 0:
+                return jsonify({'error': 'requests and timeout must be positive'}), 400
+            session = profiler.start_request_capture(n_requests, timeout=timeout, interval=interval)
+        else:
+            return jsonify({'error': "mode must be 'sample' or 'requests'"}), 400
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid profiling parameters'}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e), 'session': profiler.get_session()}), 409
+    
+    return jsonify(session), 202
+
+@app.route(PROFILE_ROUTE, methods=['GET'])
+def get_profiling_session():
+    """
+    Status and report of this worker's latest profiling session
+    ?format=collapsed returns just the collapsed stacks as text (pipe into flamegraph.pl)
+    """
+    if not DEBUG_TOKEN:
+        return jsonify({'error': 'Not found'}), 404
+    if not debug_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    session = profiler.get_session()
+    if session is None:
+        return jsonify({'error': 'No profiling session on this worker'}), 404
+    if request.args.get('format') == 'collapsed':
+        if session['report'] is None:
+            return jsonify({'error': 'Profiling session still running', 'session': session}), 409
+        return Response(session['report']['collapsed'] + '\n', content_type='text/plain; charset=utf-8')
+    return jsonify(session), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Latency histograms and serving counters in the Prometheus text format"""
+    return Response(REGISTRY.render_prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -469,21 +864,48 @@ def health_check():
         'status': 'healthy', 
         'service': 'enhanced-ml-recommendation-api',
         'initialized': engine_initialized,
+        'modelVersion': engine.model_version,
         'performance': engine.get_performance_stats() if engine_initialized else {}
     }), 200
 
 if __name__ == '__main__':
-    # Try to load a saved enhanced model on startup
+    # Try to load the published enhanced model on startup
     try:
-        with engine_lock:
-            engine.load_model('enhanced_ml_recommendation_model.pkl')
-            engine_initialized = True
-            logger.info("Loaded pre-trained enhanced model from disk")
+        load_published_model(verify=True)
     except FileNotFoundError:
         logger.info("No pre-trained enhanced model found, will load data on first request")
     except Exception as e:
         logger.error(f"Error loading enhanced model: {e}")
         logger.info("Will load data on first request")
     
-    # Run with debug=False to reduce memory overhead in production
-    app.run(debug=False, host='0.0.0.0', port=5001, threaded=True)
\ No newline at end of file
+    # ML_API_MODE=asgi serves from an event loop (needs the optional uvicorn dependency from
+    # requirements-asgi.txt); one process handles many
+    # concurrent proxy connections, with scoring and MongoDB calls offloaded to thread pools
+    api_mode = os.getenv('ML_API_MODE', 'wsgi').lower()
+    # ML_API_WORKERS > 1 pre-forks worker processes that share the memory-mapped model
+    workers = int(os.getenv('ML_API_WORKERS', '1'))
+    if workers <= 1 or api_mode == 'asgi':
+        start_prior_refresher()
+    if api_mode == 'asgi':
+        if workers > 1:
+            logger.warning("ML_API_WORKERS is ignored in ASGI mode, which serves from a single process")
+        asgi_app = create_asgi_app(sys.modules[__name__],
+                                   scoring_threads=int(os.getenv('ML_ASGI_SCORING_THREADS', '0')) or None,
+                                   io_threads=int(os.getenv('ML_ASGI_IO_THREADS', '32')))
+        if not serve_asgi(asgi_app, '0.0.0.0', 5001):
+            logger.warning("uvicorn is not installed (pip install -r requirements-asgi.txt), "
+                           "falling back to the threaded Flask server")
+            app.run(debug=False, host='0.0.0.0', port=5001, threaded=True)
+    elif workers > 1:
+        def start_worker(worker_id):
+            connect_db()
+            watch_published_model()
+            watch_event_log()
+            start_prior_refresher()
+        
+        serve_prefork(app, '0.0.0.0', 5001, workers,
+                      blas_threads=int(os.getenv('ML_API_BLAS_THREADS', '1')),
+                      on_worker_start=start_worker)
+    else:
+        # Run with debug=False to reduce memory overhead in production
+        app.run(debug=False, host='0.0.0.0', port=5001, threaded=True)
\ No newline at end of file
@@ -7,19 +7,33 @@ and location data. Optimized for handling massive datasets.
 
 import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import TruncatedSVD
 from sklearn.cluster import MiniBatchKMeans
+from ml_catalog import (TrackCatalog, top_n_rows, top_n_rows_batch, compact_track_frame, concat_track_frames,
+                        frame_footprint)
+from ml_profile_store import UserProfileStore
+from ml_location_index import LocationIndex, load_region_parents
+from ml_candidate_index import CandidateIndex
+from ml_featurizer import StreamingTrackFeaturizer
+from ml_model_store import (save_model_artifacts, load_model_artifacts, detach_arrays, attach_arrays,
+                            frame_to_arrays, frame_from_arrays)
+from ml_ann_index import ClusterANNIndex
+from ml_matrix_factorization import ImplicitALSModel, build_confidence_matrix
+from ml_cache import RecommendationCache, user_tag, seed_tag, model_tag, key_prefix
+from ml_metrics import REGISTRY, ENGINE_CALL_DURATION
 import json
 import pickle
 import os
 import sqlite3
 from datetime import datetime
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator, Callable, Union
+from itertools import islice
 from collections import defaultdict
+from array import array
 import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 import logging
 
@@ -27,31 +41,88 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Implicit feedback weight of each interaction type (unknown types count as a play)
+INTERACTION_WEIGHTS = {
+    'play': 1.0,
+    'like': 2.0,
+    'comment': 1.0,
+    'skip': 0.1
+}
+
 
 class AdvancedMLRecommendationEngine:
-    def __init__(self, max_tracks_for_training=10000, cache_size=1000):
+    def __init__(self, max_tracks_for_training=10000, cache_size=1000, ann_n_probe=8, mf_factors=64,
+                 cache_ttl: Optional[float] = 600.0, cache_max_bytes: Optional[int] = None,
+                 profile_history_size: int = 64, region_parents: Optional[Dict[str, str]] = None,
+                 max_candidates: int = 2000):
         """
         Initialize the advanced ML recommendation engine
+        ann_n_probe is the number of clusters the content-based ANN index scans per query,
+        mf_factors the number of latent factors of the collaborative ALS model;
+        cached results expire after cache_ttl seconds and are capped at cache_size entries
+        (and cache_max_bytes estimated bytes, if set); collaborative requests fully score at
+        most about max_candidates tracks retrieved from the user's top genres and creators
         """
         self.max_tracks_for_training = max_tracks_for_training
         self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache_max_bytes = cache_max_bytes
+        self.ann_n_probe = ann_n_probe
+        self.mf_factors = mf_factors
         
         # Core components
         self.track_features = None
         self.track_metadata = None
-        self.user_profiles = {}
+        self.catalog = None
+        # Integer-coded preference vectors and a bounded recent-history ring buffer per user
+        self.user_profiles = UserProfileStore(history_size=profile_history_size)
         self.genre_clusters = {}
         self.location_preferences = {}
         
+        # User id -> row of the user x track interaction matrix, and the interaction
+        # log (user row, track row, weight) it is built from, kept in typed arrays
+        self.user_index = {}
+        self._interaction_log = (array('i'), array('i'), array('f'))
+        # The same interactions grouped by user: a CSR matrix of summed weights up to the
+        # last compaction (training or loading) plus the live (track rows, weights) logged
+        # per user row since, so one user's interactions are read without scanning the log
+        self._interaction_matrix = None
+        self._interaction_deltas = {}
+        
         # ML components
-        self.scaler = StandardScaler()
-        self.tfidf_vectorizer = TfidfVectorizer(max_features=100, stop_words='english')
+        self.scaler = StandardScaler(with_mean=False)  # Mean-free so sparse features stay sparse
+        self.featurizer = StreamingTrackFeaturizer()  # Global-statistics track featurizer
         self.svd_model = TruncatedSVD(n_components=50)  # For dimensionality reduction
         self.kmeans_model = MiniBatchKMeans(n_clusters=50, random_state=42)  # Scalable clustering
+        self.mf_model = None  # Implicit-feedback ALS for collaborative filtering
+        self.model_manifest = None  # Manifest of the artifact directory the model was loaded from
+        self.model_version = None  # Version number of the published model this engine serves
+        # Sequence number of the last shared event log entry (ml_event_log) applied to this
+        # engine; a saved model records the log position its training data was read at
+        self.event_seq = None
         
         # Caching for performance
-        self.recommendation_cache = {}
-        self.similarity_matrices = {}
+        # Bounded LRU/TTL cache; entries are tagged by user, seed track and model version
+        self.recommendation_cache = RecommendationCache(
+            max_entries=cache_size, max_bytes=cache_max_bytes, default_ttl=cache_ttl, key_family=key_prefix
+        )
+        self.ann_index = None
+        
+        # Location -> presorted track rows, rebuilt whenever the catalog is replaced; region
+        # links default to load_region_parents() (ML_REGION_HIERARCHY)
+        self.region_parents = region_parents if region_parents is not None else load_region_parents()
+        self.location_index = None
+        
+        # Genre/creator posting lists ranked by the static prior, the candidate-generation
+        # stage of collaborative recommendations (rebuilt with the catalog)
+        self.max_candidates = max_candidates
+        self.candidate_index = None
+        
+        # Precomputed top-K store (see ml_materialize)
+        self.materialized_store = None
+        
+        # (metadata frame, reduced features, footprint) of the last get_catalog_footprint call
+        self._catalog_footprint = None
         
         # Thread safety
         self.lock = threading.RLock()
@@ -63,165 +134,215 @@ class AdvancedMLRecommendationEngine:
             'avg_response_time': 0.0
         }
     
-    def load_data_incrementally(self, tracks_data: List[Dict], user_data: List[Dict], 
-                               batch_size=1000):
+    def load_data_incrementally(self, tracks_data: Union[Iterable[Dict], Callable[[], Iterable[Dict]]],
+                               user_data: List[Dict], batch_size=1000):
         """
         Load data incrementally to handle massive datasets without memory overload
+        tracks_data is a list of tracks or a callable returning a fresh track iterator
+        (e.g. a database cursor), since features are built in two streaming passes:
+        a statistics pass for global normalizers and vocabularies, then a transform pass
         """
         logger.info(f"Loading data incrementally with batch size {batch_size}")
         
-        # Process tracks in batches
-        track_batches = [tracks_data[i:i + batch_size] for i in range(0, len(tracks_data), batch_size)]
+        # Statistics pass: global normalizers and separate genre/location vocabularies
+        self.featurizer = StreamingTrackFeaturizer()
+        for i, batch_df in enumerate(self._iter_track_batches(tracks_data, batch_size)):
+            logger.info(f"Collecting statistics from track batch {i+1}")
+            self.featurizer.update_stats(batch_df)
+        self.featurizer.finalize()
+        
+        # Transform pass: featurize each batch with the global statistics
         all_track_features = []
         all_track_metadata = []
-        
-        for i, track_batch in enumerate(track_batches):
-            logger.info(f"Processing track batch {i+1}/{len(track_batches)}")
-            
-            # Convert to DataFrame for this batch
-            batch_df = pd.DataFrame(track_batch)
-            batch_features = self._create_numerical_features_batch(batch_df)
-            
-            all_track_features.append(batch_features)
-            all_track_metadata.append(batch_df)
+        for i, batch_df in enumerate(self._iter_track_batches(tracks_data, batch_size)):
+            logger.info(f"Featurizing track batch {i+1}")
+            all_track_features.append(self.featurizer.transform(batch_df))
+            # Keep only the compact columns the engine reads (categoricals, narrow counts, epoch times)
+            all_track_metadata.append(compact_track_frame(batch_df))
         
         # Combine all batches
-        self.track_features = pd.concat(all_track_features, ignore_index=True)
-        self.track_metadata = pd.concat(all_track_metadata, ignore_index=True)
+        if all_track_features:
+            self.track_features = sp.vstack(all_track_features, format='csr')
+            self.track_metadata = concat_track_frames(all_track_metadata)
+        else:
+            self.track_features = sp.csr_matrix((0, len(self.featurizer.feature_names)))
+            self.track_metadata = pd.DataFrame(columns=['_id'])
+        
+        # Columnar arrays used by the scoring kernels, built once per load
+        self.catalog = TrackCatalog(self.track_metadata)
+        self.location_index = LocationIndex(self.catalog, self.region_parents)
+        self.candidate_index = CandidateIndex(self.catalog, self.max_candidates)
+        logger.info(f"Catalog footprint: {self.get_catalog_footprint()['total_bytes'] / 2**20:.1f} MiB "
+                    f"for {self.catalog.n_tracks} tracks")
         
         # Process user data in batches
         user_batches = [user_data[i:i + batch_size] for i in range(0, len(user_data), batch_size)]
         for i, user_batch in enumerate(user_batches):
             logger.info(f"Processing user batch {i+1}/{len(user_batches)}")
             self._build_user_profiles_batch(user_batch)
+        with self.lock:
+            self._compact_interactions()
     
-    def _create_numerical_features_batch(self, track_df: pd.DataFrame) -> pd.DataFrame:
+    @staticmethod
+    def _iter_track_batches(tracks_data, batch_size: int) -> Iterator[pd.DataFrame]:
         """
-        Create numerical features from track metadata for ML processing
+        Yield DataFrames of at most batch_size tracks from a list or a track iterator factory
         """
-        features_df = pd.DataFrame(index=track_df.index)
-        
-        # Normalize plays and likes with min-max scaling
-        if 'plays' in track_df.columns:
-            max_plays = track_df['plays'].max()
-            features_df['normalized_plays'] = track_df['plays'].fillna(0) / (max_plays if max_plays > 0 else 1)
-        else:
-            features_df['normalized_plays'] = 0
-            
-        if 'likes' in track_df.columns:
-            max_likes = track_df['likes'].max()
-            features_df['normalized_likes'] = track_df['likes'].fillna(0) / (max_likes if max_likes > 0 else 1)
-        else:
-            features_df['normalized_likes'] = 0
-        
-        # Genre encoding (using TF-IDF for genre similarity)
-        if 'genre' in track_df.columns:
-            genre_str = track_df['genre'].fillna('unknown').astype(str)
-            # Fit only on first batch, transform subsequent batches
-            if hasattr(self.tfidf_vectorizer, 'vocabulary_'):
-                genre_matrix = self.tfidf_vectorizer.transform(genre_str)
-            else:
-                genre_matrix = self.tfidf_vectorizer.fit_transform(genre_str)
-            genre_df = pd.DataFrame(
-                genre_matrix.toarray(), 
-                columns=[f'genre_{i}' for i in range(genre_matrix.shape[1])],
-                index=track_df.index
-            )
-            features_df = pd.concat([features_df, genre_df], axis=1)
-        else:
-            features_df['genre_unknown'] = 1
+        tracks = iter(tracks_data() if callable(tracks_data) else tracks_data)
+        while True:
+            batch = list(islice(tracks, batch_size))
+            if not batch:
+                return
+            yield pd.DataFrame(batch)
+    
+    def _build_user_profiles_batch(self, user_data: List[Dict]):
+        """
+        Build user preference profiles based on listening history from batch
+        """
+        with self.lock:
+            for user_interaction in user_data:
+                self._apply_interaction(user_interaction, live=False)
+    
+    def _apply_interaction(self, user_interaction: Dict, live: bool = True) -> Optional[str]:
+        """
+        Fold one interaction into its user's profile and the interaction log (O(1))
+        Live interactions are also kept per user until the next compaction; bulk loads are
+        compacted once at the end instead
+        Callers hold self.lock; returns the user id, or None if the interaction has none
+        """
+        user_id = user_interaction.get('userId')
+        if not user_id:
+            return None
         
-        # Creator ID encoding (if available)
-        if 'creatorId' in track_df.columns:
-            creator_counts = track_df['creatorId'].value_counts()
-            features_df['creator_popularity'] = track_df['creatorId'].map(creator_counts).fillna(0) / creator_counts.max()
+        # Update user profile based on interaction
+        track_id = user_interaction.get('trackId')
+        interaction_type = user_interaction.get('type', 'play')  # play, like, skip, etc.
+        timestamp = user_interaction.get('timestamp', datetime.now())
         
-        # Type encoding (song, beat, mix)
-        if 'type' in track_df.columns:
-            type_dummies = pd.get_dummies(track_df['type'], prefix='type')
-            features_df = pd.concat([features_df, type_dummies], axis=1)
-        else:
-            features_df['type_song'] = 1  # Default to song
-        
-        # Location-based features (if available)
-        if 'location' in track_df.columns:
-            location_str = track_df['location'].fillna('global').astype(str)
-            # Use the same TF-IDF vectorizer to transform
-            if hasattr(self.tfidf_vectorizer, 'vocabulary_'):
-                location_matrix = self.tfidf_vectorizer.transform(location_str)
-            else:
-                location_matrix = self.tfidf_vectorizer.fit_transform(location_str)
-            location_df = pd.DataFrame(
-                location_matrix.toarray(),
-                columns=[f'loc_{i}' for i in range(location_matrix.shape[1])],
-                index=track_df.index
-            )
-            features_df = pd.concat([features_df, location_df], axis=1)
+        # Weight based on interaction type
+        weight = INTERACTION_WEIGHTS.get(interaction_type, 1.0)
         
-        # Fill NaN values with 0
-        features_df = features_df.fillna(0)
+        # Find track metadata to extract preferences (O(1) id -> row lookup)
+        row = self.catalog.row_of(track_id)
+        track_values = None
+        if row is not None:
+            track_values = {
+                'genres': self.catalog.genre_values[self.catalog.genre_codes[row]],
+                'creators': self.catalog.creator_values[self.catalog.creator_codes[row]],
+                'locations': self.catalog.location_values[self.catalog.location_codes[row]]
+            }
+            
+            # Log the interaction for the user x track confidence matrix
+            user_row = self.user_index.setdefault(user_id, len(self.user_index))
+            user_rows, track_rows, weights = self._interaction_log
+            user_rows.append(user_row)
+            track_rows.append(row)
+            weights.append(weight)
+            if live:
+                delta_rows, delta_weights = self._interaction_deltas.setdefault(user_row, (array('i'), array('f')))
+                delta_rows.append(row)
+                delta_weights.append(weight)
         
-        return features_df
+        # Update genre, creator and location preferences (known tracks only) and push the
+        # interaction onto the user's recent history
+        self.user_profiles.record(user_id, track_id, timestamp, weight, track_values)
+        return user_id
     
-    def _build_user_profiles_batch(self, user_data: List[Dict]):
+    def ingest_interactions(self, interactions: Iterable[Dict]) -> set:
         """
-        Build user preference profiles based on listening history from batch
+        Apply a micro-batch of live interactions (play, like, skip, comment) without retraining
+        Each event is an O(1) profile update; the affected users' ALS factors are then re-solved
+        once per batch and only their cached results are dropped
+        Returns the ids of the users whose profiles changed
         """
-        for user_interaction in user_data:
-            user_id = user_interaction.get('userId')
-            if not user_id:
-                continue
-                
+        affected_users = set()
+        try:
             with self.lock:
-                if user_id not in self.user_profiles:
-                    self.user_profiles[user_id] = {
-                        'genres': defaultdict(float),
-                        'creators': defaultdict(float),
-                        'locations': defaultdict(float),
-                        'interaction_history': [],
-                        'preferences_updated': datetime.now()
-                    }
-                
-                # Update user profile based on interaction
-                track_id = user_interaction.get('trackId')
-                interaction_type = user_interaction.get('type', 'play')  # play, like, skip, etc.
-                timestamp = user_interaction.get('timestamp', datetime.now())
-                
-                # Find track metadata to extract preferences
-                track_row = self.track_metadata[self.track_metadata['_id'] == track_id]
-                if not track_row.empty:
-                    track_genre = track_row.iloc[0].get('genre', 'unknown')
-                    track_creator = track_row.iloc[0].get('creatorId', 'unknown')
-                    track_location = track_row.iloc[0].get('location', 'global')
-                    
-                    # Weight based on interaction type
-                    weight = 1.0
-                    if interaction_type == 'like':
-                        weight = 2.0
-                    elif interaction_type == 'skip':
-                        weight = 0.1
-                    elif interaction_type == 'play':
-                        weight = 1.0
-                        
-                    # Update genre preferences with decay function
-                    current_weight = self.user_profiles[user_id]['genres'][track_genre]
-                    self.user_profiles[user_id]['genres'][track_genre] = current_weight + weight
-                    
-                    # Update creator preferences
-                    current_weight = self.user_profiles[user_id]['creators'][track_creator]
-                    self.user_profiles[user_id]['creators'][track_creator] = current_weight + weight
-                    
-                    # Update location preferences
-                    current_weight = self.user_profiles[user_id]['locations'][track_location]
-                    self.user_profiles[user_id]['locations'][track_location] = current_weight + weight
-                
-                # Store interaction in history
-                self.user_profiles[user_id]['interaction_history'].append({
-                    'trackId': track_id,
-                    'type': interaction_type,
-                    'timestamp': timestamp,
-                    'weight': weight
-                })
+                try:
+                    for interaction in interactions:
+                        # Marked before applying, so a failing event's partial update is still
+                        # treated as live and its user's cached results dropped
+                        if interaction.get('userId'):
+                            affected_users.add(interaction['userId'])
+                        self._apply_interaction(interaction)
+                finally:
+                    self._fold_in_users(affected_users)
+        finally:
+            self.invalidate_user_cache(affected_users)
+        return affected_users
+    
+    def _compact_interactions(self):
+        """
+        Rebuild the per-user interaction matrix from the whole log and drop the live deltas
+        Callers hold self.lock
+        """
+        user_rows, track_rows, weights = self._interaction_log
+        self._interaction_matrix = build_confidence_matrix(
+            np.frombuffer(user_rows, dtype=np.int32), np.frombuffer(track_rows, dtype=np.int32),
+            np.frombuffer(weights, dtype=np.float32), len(self.user_index), self.catalog.n_tracks
+        )
+        self._interaction_deltas = {}
+    
+    def _user_interactions(self, user_row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (track rows, weights) of every logged interaction of one user, O(that user's interactions)
+        Callers hold self.lock
+        """
+        matrix = self._interaction_matrix
+        track_rows, weights = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        if matrix is not None and user_row < matrix.shape[0]:
+            start, end = matrix.indptr[user_row], matrix.indptr[user_row + 1]
+            track_rows, weights = matrix.indices[start:end], matrix.data[start:end]
+        delta = self._interaction_deltas.get(user_row)
+        if delta is not None:
+            track_rows = np.concatenate([track_rows, np.frombuffer(delta[0], dtype=np.int32)])
+            weights = np.concatenate([weights, np.frombuffer(delta[1], dtype=np.float32)])
+        return track_rows, weights
+    
+    def _history_rows(self, user_id: str) -> np.ndarray:
+        """
+        Sorted catalog rows of every track the user has interacted with: their logged
+        interactions plus the recent history (the only record in models saved without a log)
+        """
+        with self.lock:
+            user_row = self.user_index.get(user_id)
+            logged = self._user_interactions(user_row)[0] if user_row is not None else np.empty(0, dtype=np.int64)
+            recent = self.catalog.rows_of(self.user_profiles.recent_track_ids(user_id))
+        return np.unique(np.concatenate([logged.astype(np.int64), recent]))
+    
+    def _fold_in_users(self, user_ids: Iterable[str]):
+        """
+        Re-solve the ALS factors of the given users against the fixed item factors, so live
+        interactions reach latent-factor scoring before the next retrain
+        Callers hold self.lock; reads only the given users' interactions
+        """
+        if self.mf_model is None:
+            return
+        for user_id in user_ids:
+            user_row = self.user_index.get(user_id)
+            if user_row is None:
+                continue
+            track_rows, weights = self._user_interactions(user_row)
+            # Tracks added since the fit have no item factors yet
+            known = track_rows < len(self.mf_model.item_factors)
+            if known.any():
+                self.mf_model.fold_in(user_row, track_rows[known], weights[known])
+    
+    def _cache_tags(self, user_id: Optional[str] = None, seed_track_ids: Iterable[str] = ()) -> List[str]:
+        """
+        Tags for a cached result: the model version plus the user and seed tracks it depends on
+        """
+        tags = [model_tag(self.model_version)]
+        if user_id:
+            tags.append(user_tag(user_id))
+        tags.extend(seed_tag(track_id) for track_id in seed_track_ids)
+        return tags
+    
+    def invalidate_user_cache(self, user_ids: Iterable[str]):
+        """
+        Drop the cached recommendations computed for the given users
+        """
+        self.recommendation_cache.invalidate_tags(user_tag(user_id) for user_id in user_ids)
     
     def train_models(self):
         """
@@ -230,167 +351,272 @@ class AdvancedMLRecommendationEngine:
         """
         logger.info("Training ML models for scalability...")
         
-        # Scale features
+        # Scale features (CSR in, CSR out)
         scaled_features = self.scaler.fit_transform(self.track_features)
         
-        # Apply SVD for dimensionality reduction
+        # Apply SVD for dimensionality reduction, straight from the sparse matrix (small catalogs have fewer features than components)
+        self.svd_model.n_components = max(1, min(self.svd_model.n_components, scaled_features.shape[1] - 1))
         reduced_features = self.svd_model.fit_transform(scaled_features)
         
         # Apply MiniBatch K-Means for clustering (scalable clustering)
+        self.kmeans_model.n_clusters = max(1, min(self.kmeans_model.n_clusters, len(reduced_features)))
         cluster_labels = self.kmeans_model.fit_predict(reduced_features)
         
         # Store reduced features and clusters
         self.reduced_track_features = reduced_features
         self.track_clusters = cluster_labels
         
-        # Precompute similarity matrices for different use cases
-        logger.info("Computing similarity matrices...")
+        # Build the cluster-backed ANN index for content-based lookups
+        # (linear in catalog size, unlike a dense N x N similarity matrix)
+        logger.info("Building ANN index...")
+        self.ann_index = ClusterANNIndex(n_probe=self.ann_n_probe).build(
+            reduced_features, self.kmeans_model.cluster_centers_, cluster_labels
+        )
+        
+        # Factorize the user x track confidence matrix for collaborative filtering
+        self.train_collaborative_model()
         
-        # Content-based similarity (using reduced features)
-        self.content_similarity_matrix = cosine_similarity(reduced_features)
+        # Results cached from the previous fit are stale now
+        self.recommendation_cache.invalidate_tag(model_tag(self.model_version))
         
         logger.info("Models trained successfully!")
     
+    def train_collaborative_model(self):
+        """
+        Train the implicit-feedback ALS model on every logged interaction
+        """
+        with self.lock:
+            self._compact_interactions()
+            interaction_matrix = self._interaction_matrix
+        if not interaction_matrix.nnz:
+            self.mf_model = None
+            return
+        
+        self.mf_model = ImplicitALSModel(factors=self.mf_factors).fit(interaction_matrix)
+    
     def get_collaborative_filtering_recommendations(self, user_id: str, n_recommendations: int = 10) -> List[str]:
         """
         Get recommendations using collaborative filtering based on similar users
         Enhanced to handle massive data efficiently
         """
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         
         # Check cache first
         cache_key = f"collab_{user_id}_{n_recommendations}"
-        if cache_key in self.recommendation_cache:
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is not None:
             self.performance_stats['cache_hits'] += 1
             self.performance_stats['requests_served'] += 1
-            self._update_avg_response_time(start_time)
-            return self.recommendation_cache[cache_key]
+            self._record_response_time('collaborative', start_time, cache_hit=True)
+            return cached
+        
+        # Taken before computing: a result that races an invalidation of its tags is not cached
+        generation = self.recommendation_cache.generation()
         
         if user_id not in self.user_profiles:
             # Return popular tracks if user profile doesn't exist
             result = self.get_popular_tracks(n_recommendations)
         else:
-            user_profile = self.user_profiles[user_id]
-            
-            # Get user's interaction history
-            user_history = set(item['trackId'] for item in user_profile['interaction_history'])
-            
-            # Score tracks based on user preferences
-            track_scores = []
-            for idx, track in self.track_metadata.iterrows():
-                track_id = track['_id']
+            # Precomputed after training for this model version (history already excluded)
+            top_rows = self._materialized_rows(user_id, n_recommendations)
+            if top_rows is None:
+                # Every track the user has interacted with, not just the recent history
+                history_rows = self._history_rows(user_id)
+                genre_preferences = self.user_profiles.preference_vector(
+                    'genres', user_id, self.catalog.genre_vocabulary)
+                creator_preferences = self.user_profiles.preference_vector(
+                    'creators', user_id, self.catalog.creator_vocabulary)
                 
-                # Skip tracks user has already interacted with
-                if track_id in user_history:
-                    continue
+                # Stage 1: on large catalogs, retrieve candidates from the posting lists of the
+                # user's top genres and creators; small ones (and users whose history alone
+                # would fill the candidate budget) are scored in full
+                candidate_index = self._get_candidate_index()
+                candidates = None
+                if candidate_index.enabled and \
+                        n_recommendations + len(history_rows) <= candidate_index.max_candidates:
+                    candidates = candidate_index.candidates(genre_preferences, creator_preferences,
+                                                            min_per_list=n_recommendations + len(history_rows))
                 
-                score = 0.0
+                # Stage 2: score the candidates (or every track)
+                user_row = self.user_index.get(user_id)
+                if self.mf_model is not None and user_row is not None and self.mf_model.has_user(user_row):
+                    # Latent-factor scores learned from every user's interactions (one matrix-vector product)
+                    scores = self.mf_model.score_items(user_row, candidates)
+                elif candidates is not None:
+                    scores = self.catalog.score_collaborative_rows(candidates, genre_preferences, creator_preferences,
+                                                                   prior=candidate_index.prior)
+                else:
+                    # Score all tracks based on user preferences (40% genre, 30% creator,
+                    # 20% popularity, 10% freshness) in a few array operations, reading the
+                    # profile's preference vectors in catalog codes
+                    scores = self.catalog.score_collaborative(genre_preferences, creator_preferences)
                 
-                # Genre match score
-                track_genre = track.get('genre', 'unknown')
-                if track_genre in user_profile['genres']:
-                    genre_score = user_profile['genres'][track_genre]
-                    score += genre_score * 0.4  # 40% weight to genre
-                
-                # Creator match score
-                track_creator = track.get('creatorId', 'unknown')
-                if track_creator in user_profile['creators']:
-                    creator_score = user_profile['creators'][track_creator]
-                    score += creator_score * 0.3  # 30% weight to creator
-                
-                # Popularity boost
-                track_plays = track.get('plays', 0)
-                if track_plays > 0:
-                    max_plays = self.track_metadata['plays'].max()
-                    normalized_plays = track_plays / max_plays if max_plays > 0 else 0
-                    score += normalized_plays * 0.2  # 20% weight to popularity
-                
-                # Freshness factor
-                track_created = track.get('createdAt', datetime.now())
-                if isinstance(track_created, str):
-                    try:
-                        track_created = datetime.fromisoformat(track_created.replace('Z', '+00:00'))
-                    except:
-                        track_created = datetime.now()
-                        
-                days_old = (datetime.now() - track_created).days
-                freshness = min(1.0, days_old / 365.0)  # Up to 1 year gets full freshness score
-                score += (1 - freshness) * 0.1  # 10% weight to freshness
-                
-                track_scores.append((track_id, score))
-            
-            # Sort by score and return top N
-            track_scores.sort(key=lambda x: x[1], reverse=True)
-            result = [track_id for track_id, score in track_scores[:n_recommendations]]
+                # Skip tracks user has already interacted with and return top N
+                if candidates is None:
+                    top_rows = top_n_rows(scores, n_recommendations, exclude_rows=history_rows)
+                else:
+                    excluded = np.flatnonzero(np.isin(candidates, history_rows))
+                    top_rows = candidates[top_n_rows(scores, n_recommendations, exclude_rows=excluded)]
+            result = self.catalog.track_ids[top_rows].tolist()
         
-        # Cache the result
-        if len(self.recommendation_cache) >= self.cache_size:
-            # Remove oldest cache entry
-            oldest_key = next(iter(self.recommendation_cache))
-            del self.recommendation_cache[oldest_key]
-        
-        self.recommendation_cache[cache_key] = result
+        # Cache the result (least recently used entries are evicted past the cap)
+        self.recommendation_cache.set(cache_key, result, tags=self._cache_tags(user_id=user_id),
+                                      generation=generation)
         
         self.performance_stats['requests_served'] += 1
-        self._update_avg_response_time(start_time)
+        self._record_response_time('collaborative', start_time)
         
         return result
     
+    def _materialized_rows(self, user_id: str, n_recommendations: int) -> Optional[np.ndarray]:
+        """
+        Top rows from the materialized store, or None when the store does not cover the
+        user for this model version (or holds fewer than n_recommendations rows), or the
+        entry is stale: ranked by an older prior, or before the user's latest interactions
+        """
+        if self.materialized_store is None or self.model_version is None:
+            return None
+        try:
+            entry = self.materialized_store.get(user_id, self.model_version)
+        except sqlite3.Error as e:
+            logger.warning(f"Materialized store lookup failed, scoring live: {e}")
+            return None
+        if entry is None:
+            return None
+        rows, prior_version, event_count = entry
+        if len(rows) < n_recommendations or prior_version < self.catalog.prior_refreshed_at or \
+                event_count < self.user_profiles.event_count(user_id):
+            return None
+        return rows[:n_recommendations]
+    
+    def get_batch_recommendations(self, user_ids: List[str], limits: Optional[List[int]] = None,
+                                  exclude_track_ids: Optional[List[Iterable[str]]] = None,
+                                  genres: Optional[List[Optional[Iterable[str]]]] = None,
+                                  exclude_history: bool = True,
+                                  max_chunk_bytes: int = 64 * 1024 * 1024) -> List[List[str]]:
+        """
+        Collaborative recommendations for many users, scored together as a float32 users x catalog matrix
+        limits, exclude_track_ids and genres (allowed genres, None for any) are per user;
+        users are processed in chunks whose score matrix stays under max_chunk_bytes
+        Users without a profile are ranked by popularity and freshness alone
+        """
+        start_time = time.perf_counter()
+        
+        rows = self.get_batch_recommendation_rows(user_ids, limits, exclude_track_ids, genres,
+                                                  exclude_history, max_chunk_bytes)
+        results = [self.catalog.track_ids[user_rows].tolist() for user_rows in rows]
+        
+        self.performance_stats['requests_served'] += 1
+        self._record_response_time('batch', start_time)
+        
+        return results
+    
+    def get_batch_recommendation_rows(self, user_ids: List[str], limits: Optional[List[int]] = None,
+                                      exclude_track_ids: Optional[List[Iterable[str]]] = None,
+                                      genres: Optional[List[Optional[Iterable[str]]]] = None,
+                                      exclude_history: bool = True,
+                                      max_chunk_bytes: int = 64 * 1024 * 1024) -> List[np.ndarray]:
+        """
+        get_batch_recommendations returning the ranked catalog rows of each user
+        """
+        n_users = len(user_ids)
+        limits = limits if limits is not None else [10] * n_users
+        results = [np.empty(0, dtype=np.int64) for _ in range(n_users)]
+        if n_users == 0 or self.catalog is None or self.catalog.n_tracks == 0:
+            return results
+        
+        n_tracks = self.catalog.n_tracks
+        prior = self.catalog.static_prior()
+        genre_masks = {}  # Allowed-genre tuple -> boolean mask of tracks outside those genres
+        chunk_size = max(1, max_chunk_bytes // (4 * n_tracks))
+        
+        for chunk_start in range(0, n_users, chunk_size):
+            chunk = range(chunk_start, min(chunk_start + chunk_size, n_users))
+            scores = np.empty((len(chunk), n_tracks), dtype=np.float32)
+            
+            # Latent-factor users: one (users x factors) @ (factors x tracks) product
+            mf_positions, mf_rows, profile_positions = [], [], []
+            for position, i in enumerate(chunk):
+                user_row = self.user_index.get(user_ids[i])
+                if self.mf_model is not None and user_row is not None and self.mf_model.has_user(user_row):
+                    mf_positions.append(position)
+                    mf_rows.append(user_row)
+                else:
+                    profile_positions.append(position)
+            if mf_positions:
+                user_factors = self.mf_model.user_factor_matrix(mf_rows)
+                item_factors = np.asarray(self.mf_model.item_factors, dtype=np.float32)
+                if len(mf_positions) == len(chunk):
+                    np.matmul(user_factors, item_factors.T, out=scores)
+                else:
+                    scores[mf_positions] = user_factors @ item_factors.T
+            
+            # Profile users: genre/creator preference terms gathered per track, plus the shared prior
+            if profile_positions:
+                profile_users = [user_ids[chunk[position]] for position in profile_positions]
+                scores[profile_positions] = self.catalog.score_collaborative_batch(
+                    [self.user_profiles.preference_vector('genres', user_id, self.catalog.genre_vocabulary)
+                     for user_id in profile_users],
+                    [self.user_profiles.preference_vector('creators', user_id, self.catalog.creator_vocabulary)
+                     for user_id in profile_users],
+                    prior=prior
+                )
+            
+            # Per-user exclusions and genre filters
+            for position, i in enumerate(chunk):
+                if exclude_track_ids is not None and exclude_track_ids[i]:
+                    scores[position, self.catalog.rows_of(exclude_track_ids[i])] = -np.inf
+                if exclude_history:
+                    scores[position, self._history_rows(user_ids[i])] = -np.inf
+                allowed = tuple(sorted(genres[i])) if genres is not None and genres[i] else None
+                if allowed is not None:
+                    if allowed not in genre_masks:
+                        codes = [self.catalog.genre_vocabulary[g] for g in allowed if g in self.catalog.genre_vocabulary]
+                        genre_masks[allowed] = ~np.isin(self.catalog.genre_codes, codes)
+                    scores[position, genre_masks[allowed]] = -np.inf
+            
+            top_rows = top_n_rows_batch(scores, max(limits[i] for i in chunk))
+            top_scores = np.take_along_axis(scores, top_rows, axis=1)
+            for position, i in enumerate(chunk):
+                rows = top_rows[position, :limits[i]]
+                results[i] = rows[np.isfinite(top_scores[position, :limits[i]])]
+        
+        return results
+    
     def get_content_based_recommendations(self, seed_track_ids: List[str], n_recommendations: int = 10) -> List[str]:
         """
         Get recommendations using content-based filtering based on track features
-        Uses SVD-reduced features for efficiency with large datasets
+        Queries the ANN index over SVD-reduced features for efficiency with large datasets
         """
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         
         # Check cache first
         cache_key = f"content_{'_'.join(sorted(seed_track_ids))}_{n_recommendations}"
-        if cache_key in self.recommendation_cache:
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is not None:
             self.performance_stats['cache_hits'] += 1
             self.performance_stats['requests_served'] += 1
-            self._update_avg_response_time(start_time)
-            return self.recommendation_cache[cache_key]
+            self._record_response_time('content_based', start_time, cache_hit=True)
+            return cached
+        
+        generation = self.recommendation_cache.generation()
         
         # Get indices of seed tracks
-        seed_indices = []
-        for seed_track_id in seed_track_ids:
-            idx_list = self.track_metadata[self.track_metadata['_id'] == seed_track_id].index.tolist()
-            if idx_list:
-                seed_indices.append(idx_list[0])
+        seed_indices = self.catalog.rows_of(seed_track_ids)
         
-        if not seed_indices:
+        if len(seed_indices) == 0:
             result = []
         else:
-            # Calculate average similarity to all seed tracks
-            avg_similarities = np.zeros(len(self.track_metadata))
-            
-            for seed_idx in seed_indices:
-                if seed_idx < len(self.content_similarity_matrix):
-                    avg_similarities += self.content_similarity_matrix[seed_idx]
-            
-            avg_similarities /= len(seed_indices) if seed_indices else 1
-            
-            # Get top N most similar tracks (excluding seed tracks)
-            track_scores = [(self.track_metadata.iloc[i]['_id'], avg_similarities[i]) 
-                           for i in range(len(avg_similarities))]
-            
-            # Sort by similarity and return top N
-            track_scores.sort(key=lambda x: x[1], reverse=True)
-            
-            # Exclude seed tracks from results
-            result = [track_id for track_id, score in track_scores 
-                     if track_id not in seed_track_ids][:n_recommendations]
-        
-        # Cache the result
-        if len(self.recommendation_cache) >= self.cache_size:
-            # Remove oldest cache entry
-            oldest_key = next(iter(self.recommendation_cache))
-            del self.recommendation_cache[oldest_key]
+            # Top N tracks by average similarity to the seed tracks (seeds excluded)
+            top_rows, _ = self.ann_index.search_by_rows(seed_indices, n_recommendations)
+            result = self.catalog.track_ids[top_rows].tolist()
         
-        self.recommendation_cache[cache_key] = result
+        # Cache the result (least recently used entries are evicted past the cap)
+        self.recommendation_cache.set(cache_key, result, tags=self._cache_tags(seed_track_ids=seed_track_ids),
+                                      generation=generation)
         
         self.performance_stats['requests_served'] += 1
-        self._update_avg_response_time(start_time)
+        self._record_response_time('content_based', start_time)
         
         return result
     
@@ -398,14 +624,17 @@ class AdvancedMLRecommendationEngine:
         """
         Get popular tracks based on plays and likes
         """
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         
         cache_key = f"popular_{n_recommendations}"
-        if cache_key in self.recommendation_cache:
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is not None:
             self.performance_stats['cache_hits'] += 1
             self.performance_stats['requests_served'] += 1
-            self._update_avg_response_time(start_time)
-            return self.recommendation_cache[cache_key]
+            self._record_response_time('popular', start_time, cache_hit=True)
+            return cached
+        
+        generation = self.recommendation_cache.generation()
         
         if 'plays' in self.track_metadata.columns:
             # Sort by plays and likes
@@ -416,9 +645,9 @@ class AdvancedMLRecommendationEngine:
             result = self.track_metadata.sample(n=min(n_recommendations, len(self.track_metadata)), 
                                              random_state=42)['_id'].tolist()
         
-        self.recommendation_cache[cache_key] = result
+        self.recommendation_cache.set(cache_key, result, tags=self._cache_tags(), generation=generation)
         self.performance_stats['requests_served'] += 1
-        self._update_avg_response_time(start_time)
+        self._record_response_time('popular', start_time)
         
         return result
     
@@ -427,83 +656,129 @@ class AdvancedMLRecommendationEngine:
         Get recommendations based on user's location
         Optimized for massive data with efficient filtering
         """
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         
         cache_key = f"location_{user_location}_{n_recommendations}"
-        if cache_key in self.recommendation_cache:
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is not None:
             self.performance_stats['cache_hits'] += 1
             self.performance_stats['requests_served'] += 1
-            self._update_avg_response_time(start_time)
-            return self.recommendation_cache[cache_key]
+            self._record_response_time('location_based', start_time, cache_hit=True)
+            return cached
+        
+        generation = self.recommendation_cache.generation()
         
         if 'location' not in self.track_metadata.columns:
             result = self.get_popular_tracks(n_recommendations)
         else:
-            # Use vectorized string operations for efficiency
-            location_mask = self.track_metadata['location'].str.contains(
-                user_location, case=False, na=False
-            )
-            location_matches = self.track_metadata[location_mask]
-            
-            if len(location_matches) < n_recommendations:
-                # If not enough local tracks, include nearby locations or global tracks
-                all_locations = self.track_metadata.copy()
-                all_locations['location_match'] = all_locations['location'].apply(
-                    lambda loc: 2.0 if user_location.lower() in str(loc).lower() else 
-                               1.5 if str(loc) != 'global' else 1.0
-                )
-                sorted_tracks = all_locations.nlargest(
-                    n_recommendations * 2, ['location_match', 'plays']
-                )
-            else:
-                sorted_tracks = location_matches.nlargest(n_recommendations, 'plays')
-            
-            result = sorted_tracks['_id'].tolist()
+            # Most played tracks matching the location; when there are too few, widen along
+            # the region hierarchy (e.g. Kigali -> Rwanda -> East Africa -> global)
+            rows = self._get_location_index().lookup(user_location, n_recommendations)
+            result = self.catalog.track_ids[rows].tolist()
         
-        self.recommendation_cache[cache_key] = result
+        self.recommendation_cache.set(cache_key, result, tags=self._cache_tags(), generation=generation)
         self.performance_stats['requests_served'] += 1
-        self._update_avg_response_time(start_time)
+        self._record_response_time('location_based', start_time)
         
         return result
     
+    def _get_location_index(self) -> LocationIndex:
+        """
+        The location index of the current catalog (built on first use after each load)
+        """
+        index = self.location_index
+        if index is None or index.catalog is not self.catalog:
+            with self.lock:
+                index = self.location_index
+                if index is None or index.catalog is not self.catalog:
+                    index = self.location_index = LocationIndex(self.catalog, self.region_parents)
+        return index
+    
+    def _get_candidate_index(self) -> CandidateIndex:
+        """
+        The candidate index of the current catalog and prior (rebuilt on first use after each
+        load, and after a prior refresh that did not go through refresh_prior)
+        """
+        index = self.candidate_index
+        if index is None or not index.is_current(self.catalog):
+            with self.lock:
+                index = self.candidate_index
+                if index is None or not index.is_current(self.catalog):
+                    index = self.candidate_index = CandidateIndex(self.catalog, self.max_candidates)
+        return index
+    
+    def refresh_prior(self, now: Optional[float] = None):
+        """
+        Recompute the catalog's popularity/freshness prior and re-rank the candidate posting
+        lists by it, off the request path (called periodically by PriorRefresher)
+        """
+        catalog = self.catalog
+        if catalog is None:
+            return
+        catalog.refresh_prior(now)
+        self._get_candidate_index()
+    
     def get_personalized_recommendations(self, user_id: str, seed_track_id: Optional[str] = None, 
                                        user_location: Optional[str] = None, n_recommendations: int = 10) -> List[str]:
         """
         Main recommendation function that combines multiple approaches
         Uses weighted combination of different recommendation strategies
         """
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         
-        cache_key = f"personalized_{user_id}_{seed_track_id}_{user_location}_{n_recommendations}"
-        if cache_key in self.recommendation_cache:
+        cache_key = self.personalized_cache_key(user_id, seed_track_id, user_location, n_recommendations)
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is not None:
             self.performance_stats['cache_hits'] += 1
             self.performance_stats['requests_served'] += 1
-            self._update_avg_response_time(start_time)
-            return self.recommendation_cache[cache_key]
+            self._record_response_time('personalized', start_time, cache_hit=True)
+            return cached
         
-        recommendations = []
+        generation = self.recommendation_cache.generation()
         
         # Get collaborative filtering recommendations (40% weight)
         collab_recs = self.get_collaborative_filtering_recommendations(user_id, n_recommendations)
-        for i, track_id in enumerate(collab_recs):
-            recommendations.append((track_id, 0.4 * (1 - i/len(collab_recs))))  # Rank-based weighting
         
-        if seed_track_id:
-            # Get content-based recommendations from seed track (30% weight)
-            content_recs = self.get_content_based_recommendations([seed_track_id], n_recommendations)
-            for i, track_id in enumerate(content_recs):
-                recommendations.append((track_id, 0.3 * (1 - i/len(content_recs))))
+        # Get content-based recommendations from seed track (30% weight)
+        content_recs = self.get_content_based_recommendations([seed_track_id], n_recommendations) \
+            if seed_track_id else []
         
-        if user_location:
-            # Get location-based recommendations (20% weight)
-            location_recs = self.get_location_based_recommendations(user_location, n_recommendations)
-            for i, track_id in enumerate(location_recs):
-                recommendations.append((track_id, 0.2 * (1 - i/len(location_recs))))
+        # Get location-based recommendations (20% weight)
+        location_recs = self.get_location_based_recommendations(user_location, n_recommendations) \
+            if user_location else []
         
         # Get popular tracks as fallback (10% weight)
         popular_recs = self.get_popular_tracks(n_recommendations)
-        for i, track_id in enumerate(popular_recs):
-            recommendations.append((track_id, 0.1 * (1 - i/len(popular_recs))))
+        
+        result = self.blend_personalized_recommendations(
+            user_id, seed_track_id, user_location, n_recommendations,
+            collab_recs, content_recs, location_recs, popular_recs, generation=generation
+        )
+        
+        self.performance_stats['requests_served'] += 1
+        self._record_response_time('personalized', start_time)
+        
+        return result
+    
+    @staticmethod
+    def personalized_cache_key(user_id: str, seed_track_id: Optional[str], user_location: Optional[str],
+                               n_recommendations: int) -> str:
+        return f"personalized_{user_id}_{seed_track_id}_{user_location}_{n_recommendations}"
+    
+    def blend_personalized_recommendations(self, user_id: str, seed_track_id: Optional[str],
+                                           user_location: Optional[str], n_recommendations: int,
+                                           collab_recs: List[str], content_recs: List[str],
+                                           location_recs: List[str], popular_recs: List[str],
+                                           generation: Optional[int] = None) -> List[str]:
+        """
+        Combine the sub-recommender results with rank-based weights and cache the blend
+        Separate from get_personalized_recommendations so the parts can be computed concurrently;
+        generation is the cache generation taken before they were
+        """
+        recommendations = []
+        for recs, weight in ((collab_recs, 0.4), (content_recs, 0.3), (location_recs, 0.2), (popular_recs, 0.1)):
+            for i, track_id in enumerate(recs):
+                recommendations.append((track_id, weight * (1 - i/len(recs))))  # Rank-based weighting
         
         # Aggregate scores and remove duplicates while preserving order
         track_scores = defaultdict(float)
@@ -514,24 +789,22 @@ class AdvancedMLRecommendationEngine:
         sorted_tracks = sorted(track_scores.items(), key=lambda x: x[1], reverse=True)
         result = [track_id for track_id, score in sorted_tracks[:n_recommendations]]
         
-        # Cache the result
-        if len(self.recommendation_cache) >= self.cache_size:
-            # Remove oldest cache entry
-            oldest_key = next(iter(self.recommendation_cache))
-            del self.recommendation_cache[oldest_key]
-        
-        self.recommendation_cache[cache_key] = result
-        
-        self.performance_stats['requests_served'] += 1
-        self._update_avg_response_time(start_time)
-        
+        # Cache the result (least recently used entries are evicted past the cap)
+        seed_track_ids = [seed_track_id] if seed_track_id else []
+        self.recommendation_cache.set(
+            self.personalized_cache_key(user_id, seed_track_id, user_location, n_recommendations), result,
+            tags=self._cache_tags(user_id=user_id, seed_track_ids=seed_track_ids), generation=generation
+        )
         return result
     
-    def _update_avg_response_time(self, start_time):
+    def _record_response_time(self, method: str, start_time: float, cache_hit: bool = False):
         """
-        Update average response time for performance tracking
+        Update average response time and the latency histogram of the method (cache hits and
+        misses are recorded as separate series)
+        start_time is a time.perf_counter() reading
         """
-        response_time = (datetime.now() - start_time).total_seconds()
+        response_time = time.perf_counter() - start_time
+        REGISTRY.observe(ENGINE_CALL_DURATION, response_time, method=method, cache='hit' if cache_hit else 'miss')
         self.performance_stats['avg_response_time'] = (
             (self.performance_stats['avg_response_time'] * (self.performance_stats['requests_served'] - 1) + response_time) /
             self.performance_stats['requests_served']
@@ -539,53 +812,192 @@ class AdvancedMLRecommendationEngine:
     
     def get_performance_stats(self):
         """
-        Get performance statistics
+        Get performance statistics, with recent latency percentiles per engine method
+        """
+        return dict(self.performance_stats, cache=self.recommendation_cache.get_stats(),
+                    latency=REGISTRY.percentiles(ENGINE_CALL_DURATION),
+                    profiles=self.user_profiles.get_stats(), catalog=self.get_catalog_footprint())
+    
+    def get_catalog_footprint(self) -> Dict:
+        """
+        Memory held for the track catalog: metadata frame columns (deep), the scoring
+        arrays and the feature matrices, in bytes
         """
-        return self.performance_stats
+        reduced = getattr(self, 'reduced_track_features', None)
+        cached = self._catalog_footprint
+        if cached is not None and cached[0] is self.track_metadata and cached[1] is reduced:
+            return cached[2]
+        columns = frame_footprint(self.track_metadata) if self.track_metadata is not None else {}
+        features = self.track_features.data.nbytes + self.track_features.indices.nbytes + \
+            self.track_features.indptr.nbytes if self.track_features is not None else 0
+        footprint = {
+            'n_tracks': self.catalog.n_tracks if self.catalog is not None else 0,
+            'metadata_columns': columns,
+            'metadata_bytes': sum(columns.values()),
+            'catalog_array_bytes': self.catalog.nbytes() if self.catalog is not None else 0,
+            'feature_bytes': features + (reduced.nbytes if reduced is not None else 0)
+        }
+        footprint['total_bytes'] = footprint['metadata_bytes'] + footprint['catalog_array_bytes'] + \
+            footprint['feature_bytes']
+        self._catalog_footprint = (self.track_metadata, reduced, footprint)
+        return footprint
     
-    def save_model(self, filepath: str):
+    def save_model(self, model_dir: str, metadata: Optional[Dict] = None):
         """
-        Save the trained model to disk
+        Save the trained model to disk as a versioned artifact directory
+        Large arrays go to memory-mappable .npy files; only the small fitted objects are pickled
         """
-        model_data = {
-            'track_features': self.track_features,
-            'track_metadata': self.track_metadata,
-            'user_profiles': self.user_profiles,
+        arrays = {
+            'track_features.data': self.track_features.data,
+            'track_features.indices': self.track_features.indices,
+            'track_features.indptr': self.track_features.indptr,
+            'reduced_track_features': self.reduced_track_features,
+            'track_clusters': self.track_clusters,
+            'user_ids': np.array(list(self.user_index), dtype=object),
+        }
+        with self.lock:
+            for name, log in zip(('user_rows', 'track_rows', 'weights'), self._interaction_log):
+                arrays[f'interactions.{name}'] = np.array(log)
+            # Saved compacted, so a loaded engine has every user's interactions grouped
+            self._compact_interactions()
+            arrays.update({
+                'interaction_matrix.data': self._interaction_matrix.data,
+                'interaction_matrix.indices': self._interaction_matrix.indices,
+                'interaction_matrix.indptr': self._interaction_matrix.indptr
+            })
+            arrays.update(self.user_profiles.to_arrays('user_profiles'))
+        
+        metadata_arrays, metadata_layout = frame_to_arrays(self.track_metadata, 'track_metadata')
+        arrays.update(metadata_arrays)
+        catalog_arrays, catalog = detach_arrays(
+            self.catalog, TrackCatalog.ARRAY_ATTRIBUTES, 'catalog', drop=TrackCatalog.LOOKUP_ATTRIBUTES
+        )
+        arrays.update(catalog_arrays)
+        ann_arrays, ann_index = detach_arrays(self.ann_index, ClusterANNIndex.ARRAY_ATTRIBUTES, 'ann_index')
+        arrays.update(ann_arrays)
+        mf_model = None
+        if self.mf_model is not None:
+            mf_arrays, mf_model = detach_arrays(self.mf_model, ImplicitALSModel.ARRAY_ATTRIBUTES, 'mf_model')
+            arrays.update(mf_arrays)
+        
+        objects = {
+            'track_features_shape': self.track_features.shape,
+            'track_metadata_layout': metadata_layout,
             'scaler': self.scaler,
-            'tfidf_vectorizer': self.tfidf_vectorizer,
+            'featurizer': self.featurizer,
             'svd_model': self.svd_model,
             'kmeans_model': self.kmeans_model,
-            'reduced_track_features': self.reduced_track_features,
-            'track_clusters': self.track_clusters,
-            'content_similarity_matrix': self.content_similarity_matrix,
-            'recommendation_cache': self.recommendation_cache,
-            'performance_stats': self.performance_stats
+            'catalog': catalog,
+            'ann_index': ann_index,
+            'mf_model': mf_model
         }
         
-        with open(filepath, 'wb') as f:
-            pickle.dump(model_data, f)
+        metadata = dict(metadata or {}, n_tracks=self.catalog.n_tracks, n_users=len(self.user_index))
+        if self.model_version is not None:
+            metadata.setdefault('model_version', self.model_version)
+        if self.event_seq is not None:
+            metadata.setdefault('event_seq', self.event_seq)
+        # Loaded engines (and the materialization workers) start from this same prior
+        metadata.setdefault('prior_refreshed_at', self.catalog.prior_refreshed_at)
+        save_model_artifacts(model_dir, arrays, objects, metadata)
         
-        logger.info(f"Model saved to {filepath}")
+        logger.info(f"Model saved to {model_dir}")
     
-    def load_model(self, filepath: str):
+    def load_model(self, model_dir: str, mmap: bool = True, verify: bool = False):
         """
         Load a trained model from disk
+        Arrays are memory-mapped read-only by default; verify checks the manifest checksums
+        Legacy single-file pickles are still accepted
+        """
+        if os.path.isfile(model_dir):
+            return self._load_pickled_model(model_dir)
+        
+        arrays, objects, manifest = load_model_artifacts(model_dir, mmap=mmap, verify=verify)
+        
+        self.track_features = sp.csr_matrix(
+            (arrays['track_features.data'], arrays['track_features.indices'], arrays['track_features.indptr']),
+            shape=objects['track_features_shape']
+        )
+        self.track_metadata = frame_from_arrays(arrays, objects['track_metadata_layout'], 'track_metadata')
+        if 'user_profiles' in objects:
+            # Saved before profiles were array-backed
+            self.user_profiles = UserProfileStore.from_profiles(objects['user_profiles'],
+                                                                self.user_profiles.history_size)
+        else:
+            self.user_profiles = UserProfileStore.from_arrays(arrays, 'user_profiles')
+        self.scaler = objects['scaler']
+        self.featurizer = objects['featurizer']
+        self.svd_model = objects['svd_model']
+        self.kmeans_model = objects['kmeans_model']
+        self.reduced_track_features = arrays['reduced_track_features']
+        self.track_clusters = arrays['track_clusters']
+        
+        self.catalog = attach_arrays(objects['catalog'], arrays, TrackCatalog.ARRAY_ATTRIBUTES, 'catalog')
+        self.catalog.rebuild_lookups(manifest['metadata'].get('prior_refreshed_at'))
+        self.location_index = LocationIndex(self.catalog, self.region_parents)
+        self.candidate_index = CandidateIndex(self.catalog, self.max_candidates)
+        self.ann_index = attach_arrays(objects['ann_index'], arrays, ClusterANNIndex.ARRAY_ATTRIBUTES, 'ann_index')
+        self.mf_model = objects['mf_model']
+        if self.mf_model is not None:
+            attach_arrays(self.mf_model, arrays, ImplicitALSModel.ARRAY_ATTRIBUTES, 'mf_model')
+        
+        self.user_index = {user_id: row for row, user_id in enumerate(arrays['user_ids'].tolist())} \
+            if 'user_ids' in arrays else {}
+        self._interaction_log = tuple(
+            array(typecode, np.asarray(arrays[f'interactions.{name}']).tobytes()) if f'interactions.{name}' in arrays
+            else array(typecode)
+            for name, typecode in (('user_rows', 'i'), ('track_rows', 'i'), ('weights', 'f'))
+        )
+        self._interaction_deltas = {}
+        if 'interaction_matrix.indptr' in arrays:
+            self._interaction_matrix = sp.csr_matrix(
+                (arrays['interaction_matrix.data'], arrays['interaction_matrix.indices'],
+                 arrays['interaction_matrix.indptr']),
+                shape=(len(arrays['interaction_matrix.indptr']) - 1, self.catalog.n_tracks)
+            )
+        else:
+            # Saved before the matrix was: group the loaded log once
+            self._compact_interactions()
+        self.model_manifest = manifest
+        previous_version = self.model_version
+        self.model_version = manifest['metadata'].get('model_version')
+        self.event_seq = manifest['metadata'].get('event_seq')
+        self.recommendation_cache.invalidate_tag(model_tag(previous_version))
+        
+        logger.info(f"Model loaded from {model_dir}")
+    
+    def _load_pickled_model(self, filepath: str):
+        """
+        Load a model saved as a single pickle by earlier versions
         """
         with open(filepath, 'rb') as f:
             model_data = pickle.load(f)
         
-        self.track_features = model_data['track_features']
+        # The oldest files hold a dense DataFrame of features; the engine reads CSR
+        track_features = model_data['track_features']
+        if isinstance(track_features, pd.DataFrame):
+            track_features = track_features.to_numpy(dtype=np.float64)
+        self.track_features = track_features if sp.issparse(track_features) and track_features.format == 'csr' \
+            else sp.csr_matrix(track_features)
         self.track_metadata = model_data['track_metadata']
-        self.user_profiles = model_data['user_profiles']
+        self.user_profiles = UserProfileStore.from_profiles(model_data['user_profiles'],
+                                                            self.user_profiles.history_size)
         self.scaler = model_data['scaler']
-        self.tfidf_vectorizer = model_data['tfidf_vectorizer']
+        self.featurizer = model_data.get('featurizer', self.featurizer)
         self.svd_model = model_data['svd_model']
         self.kmeans_model = model_data['kmeans_model']
         self.reduced_track_features = model_data['reduced_track_features']
         self.track_clusters = model_data['track_clusters']
-        self.content_similarity_matrix = model_data['content_similarity_matrix']
-        self.recommendation_cache = model_data['recommendation_cache']
-        self.performance_stats = model_data['performance_stats']
+        self.mf_model = model_data.get('mf_model')
+        self.user_index = model_data.get('user_index', {})
+        # Older model files predate the saved catalog and id index
+        self.catalog = model_data.get('catalog') or TrackCatalog(self.track_metadata)
+        self.ann_index = model_data.get('ann_index')
+        if self.ann_index is None:
+            # Older model files stored a dense similarity matrix instead of the ANN index
+            self.ann_index = ClusterANNIndex(n_probe=self.ann_n_probe).build(
+                self.reduced_track_features, self.kmeans_model.cluster_centers_, self.track_clusters
+            )
         
         logger.info(f"Model loaded from {filepath}")
 
@@ -688,7 +1100,7 @@ def example_usage():
     print("Performance stats:", engine.get_performance_stats())
     
     # Save the model
-    engine.save_model('advanced_ml_recommendation_model.pkl')
+    engine.save_model('advanced_ml_recommendation_model')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,232 @@
+"""
+Background Model Training Jobs for the MuzikaX ML API
+This module runs model retraining off the request path: a job trains a fresh engine
+in a separate (spawned) process, which saves it as a new model version, and the API
+process then loads that version and publishes it with a single reference swap.
+Requests keep being served by the previous engine until the swap, so serving latency
+is not affected by featurization or training. Job records live in a SQLite file shared by
+every pre-forked worker, which also makes "one training job at a time" hold across them.
+"""
+
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Statuses of a job that still holds the single-trainer slot
+ACTIVE_STATUSES = ('running', 'publishing')
+
+_JOB_COLUMNS = ('job_id', 'status', 'model_version', 'submitted_at', 'finished_at', 'error', 'result', 'owner_pid')
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TrainingJobStore:
+    def __init__(self, db_path: str):
+        """
+        Open (creating if needed) the SQLite job table at db_path
+        Each thread gets its own connection (per process, like MaterializedRecommendationStore)
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS training_jobs ('
+            'job_id TEXT PRIMARY KEY, '
+            'status TEXT NOT NULL, '
+            'model_version INTEGER NOT NULL, '
+            'submitted_at REAL NOT NULL, '
+            'finished_at REAL, '
+            'error TEXT, '
+            'result TEXT, '
+            'owner_pid INTEGER NOT NULL'
+            ')'
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        # A pre-forked worker must not reuse its parent's connection
+        if connection is None or getattr(self._local, 'pid', None) != os.getpid():
+            # Autocommit mode; claim() opens its own write transaction
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _to_job(row: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        record = dict(zip(_JOB_COLUMNS, row))
+        return {
+            'jobId': record['job_id'],
+            'status': record['status'],
+            'modelVersion': record['model_version'],
+            'submittedAt': record['submitted_at'],
+            'finishedAt': record['finished_at'],
+            'error': record['error'],
+            'result': json.loads(record['result']) if record['result'] is not None else None
+        }
+
+    def claim(self, history_size: int) -> Tuple[Dict[str, Any], bool]:
+        """
+        Record a new running job unless another one (in any process) is still active
+        Returns (job, created); created is False when the active job is returned instead.
+        Jobs whose owning process has exited are marked failed and no longer block
+        """
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            placeholders = ', '.join('?' * len(ACTIVE_STATUSES))
+            for row in connection.execute(
+                f'SELECT {", ".join(_JOB_COLUMNS)} FROM training_jobs WHERE status IN ({placeholders}) '
+                'ORDER BY submitted_at', ACTIVE_STATUSES
+            ).fetchall():
+                job, owner_pid = self._to_job(row), row[-1]
+                if _process_alive(owner_pid):
+                    connection.execute('COMMIT')
+                    return job, False
+                connection.execute(
+                    "UPDATE training_jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                    (f'Worker process {owner_pid} exited before the job finished', time.time(), job['jobId'])
+                )
+
+            # Millisecond timestamps give increasing version numbers across processes
+            job = {
+                'jobId': uuid.uuid4().hex,
+                'status': 'running',
+                'modelVersion': int(time.time() * 1000),
+                'submittedAt': time.time(),
+                'finishedAt': None,
+                'error': None,
+                'result': None
+            }
+            connection.execute(
+                'INSERT INTO training_jobs (job_id, status, model_version, submitted_at, owner_pid) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (job['jobId'], job['status'], job['modelVersion'], job['submittedAt'], os.getpid())
+            )
+            connection.execute(
+                'DELETE FROM training_jobs WHERE job_id NOT IN '
+                '(SELECT job_id FROM training_jobs ORDER BY submitted_at DESC LIMIT ?)', (history_size,)
+            )
+            connection.execute('COMMIT')
+            return job, True
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def update(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None, finished: bool = False):
+        self._connect().execute(
+            'UPDATE training_jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?',
+            (status, json.dumps(result) if result is not None else None, error,
+             time.time() if finished else None, job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._to_job(self._connect().execute(
+            f'SELECT {", ".join(_JOB_COLUMNS)} FROM training_jobs WHERE job_id = ?', (job_id,)
+        ).fetchone())
+
+
+class TrainingJobManager:
+    def __init__(self, train_fn: Callable[[int], Dict[str, Any]], publish_fn: Callable[[int], None],
+                 db_path: str, use_process: bool = True, history_size: int = 20):
+        """
+        Initialize the manager
+        train_fn(model_version) runs in the worker, saves the model version and returns job stats
+        (it must be a picklable module-level function when use_process is True);
+        publish_fn(model_version) runs in this process afterwards to load and swap in the model.
+        Job records are kept in the SQLite file at db_path, shared by every process using it
+        """
+        self.train_fn = train_fn
+        self.publish_fn = publish_fn
+        self.db_path = db_path
+        self.use_process = use_process
+        self.history_size = history_size
+        self._store = None
+        self._executor = None
+
+    def _get_store(self) -> TrainingJobStore:
+        # Opened on first use, after the pre-fork workers have started
+        if self._store is None:
+            self._store = TrainingJobStore(self.db_path)
+        return self._store
+
+    def _get_executor(self):
+        # Created on first use so pre-forked workers never inherit a pool from the master
+        if self._executor is None:
+            if self.use_process:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context('spawn')
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-training')
+        return self._executor
+
+    def submit(self) -> Tuple[Dict[str, Any], bool]:
+        """
+        Start a training job unless one is already running in any worker
+        Returns (job, created); created is False when the running job is returned instead
+        """
+        job, created = self._get_store().claim(self.history_size)
+        if not created:
+            return job, False
+
+        job_id, model_version = job['jobId'], job['modelVersion']
+        try:
+            future = self._get_executor().submit(self.train_fn, model_version)
+        except Exception as e:
+            self._finish(job_id, error=e)
+            raise
+        future.add_done_callback(lambda f: self._on_trained(job_id, model_version, f))
+        return job, True
+
+    def _on_trained(self, job_id: str, model_version: int, future: Future):
+        """
+        Publish the trained version, or record why the job failed
+        """
+        try:
+            result = future.result()
+            self._get_store().update(job_id, 'publishing')
+            self.publish_fn(model_version)
+            self._finish(job_id, result=result)
+            logger.info(f"Training job {job_id} published model version {model_version}")
+        except Exception as e:
+            logger.error(f"Training job {job_id} failed: {e}")
+            self._finish(job_id, error=e)
+
+    def _finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[Exception] = None):
+        self._get_store().update(job_id, 'failed' if error is not None else 'succeeded', result=result,
+                                 error=str(error) if error is not None else None, finished=True)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a snapshot of a job's status (whichever worker runs it), or None for unknown ids
+        """
+        return self._get_store().get(job_id)
+
+    def shutdown(self, wait: bool = False):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
@@ -0,0 +1,93 @@
+"""
+Candidate retrieval vs full scan for the collaborative recommender (run with pytest)
+Two-stage retrieval must return the same top tracks as scoring the whole catalog,
+including for profiles whose preferences score below the unmatched-value bonus
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from ml_benchmark import generate_catalog
+from ml_catalog import top_n_rows
+from ml_recommendation import MLRecommendationEngine
+
+N_RECOMMENDATIONS = 10
+MISS_BONUS = 0.1  # What MLRecommendationEngine gives unmatched genres and creators
+
+
+def _engine(n_tracks: int = 12000) -> MLRecommendationEngine:
+    engine = MLRecommendationEngine()
+    engine.load_data(generate_catalog(n_tracks, seed=7), [])
+    return engine
+
+
+def _profiles(engine: MLRecommendationEngine, weight_scale: float, n_profiles: int = 40, seed: int = 3):
+    """
+    Random profiles over the catalog's genres and creators with weights around weight_scale
+    """
+    rng = np.random.default_rng(seed)
+    genres, creators = engine.catalog.genre_values, engine.catalog.creator_values
+    profiles = []
+    for _ in range(n_profiles):
+        profile_genres = rng.choice(len(genres), size=rng.integers(1, 4), replace=False)
+        profile_creators = rng.choice(len(creators), size=rng.integers(1, 6), replace=False)
+        profiles.append({
+            'genres': {genres[code]: float(rng.uniform(0.5, 1.5) * weight_scale) for code in profile_genres},
+            'creators': {creators[code]: float(rng.uniform(0.5, 1.5) * weight_scale) for code in profile_creators},
+            'locations': {},
+            'interaction_history': []
+        })
+    return profiles
+
+
+def _full_scan(engine: MLRecommendationEngine, profile: dict) -> list:
+    scores = engine.catalog.score_collaborative(profile['genres'], profile['creators'], miss_bonus=MISS_BONUS)
+    return engine.catalog.track_ids[top_n_rows(scores, N_RECOMMENDATIONS)].tolist()
+
+
+def _compare(engine: MLRecommendationEngine, profiles: list) -> int:
+    mismatches = 0
+    for i, profile in enumerate(profiles):
+        engine.user_profiles[f'user{i}'] = profile
+        if engine.get_collaborative_filtering_recommendations(f'user{i}', N_RECOMMENDATIONS) != \
+                _full_scan(engine, profile):
+            mismatches += 1
+    return mismatches
+
+
+def test_strong_preferences_use_candidates_and_match_full_scan():
+    engine = _engine()
+    profiles = _profiles(engine, weight_scale=5.0)
+    assert _compare(engine, profiles) == 0
+    # Retrieval is actually used for these profiles
+    assert engine.candidate_index.enabled
+    assert all(engine.candidate_index.candidates(profile['genres'], profile['creators'],
+                                                 min_per_list=N_RECOMMENDATIONS, miss_bonus=MISS_BONUS) is not None
+               for profile in profiles)
+
+
+def test_weak_preferences_match_full_scan():
+    engine = _engine()
+    # A skip weighs 0.1: 0.4 * 0.1 for a genre is below the 0.1 an unmatched genre gets
+    profiles = _profiles(engine, weight_scale=0.1)
+    assert _compare(engine, profiles) == 0
+    assert all(engine.candidate_index.candidates(profile['genres'], profile['creators'],
+                                                 min_per_list=N_RECOMMENDATIONS, miss_bonus=MISS_BONUS) is None
+               for profile in profiles)
+
+
+def test_weak_preferences_refresh_prior_match_full_scan():
+    engine = _engine()
+    engine.catalog.refresh_prior(now=np.nanmax(engine.catalog.created_epoch) + 200 * 86400)
+    profiles = _profiles(engine, weight_scale=0.2, seed=11)
+    assert _compare(engine, profiles) == 0
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f'{name}: ok')